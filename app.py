@@ -1,27 +1,62 @@
 import logging
 import time
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 
 from mservice.api import init_routers
+from mservice.dependencies import pool_holder
+from mservice.metrics import registry
 from mservice.utils import prepare_logger
 
 logger = logging.getLogger(__name__)
 
+API_REQUEST_DURATION = registry.histogram(
+    'mservice_api_request_duration_seconds',
+    'API request latency per route',
+    ('method', 'route', 'status'),
+)
+
 
 def init_middleware(main_app: FastAPI):
     """
-    Initializes middleware. For now, it's just a simple logger.
+    Initializes middleware: a simple logger which also collects request
+    latency per route.
     :param main_app: FastAPI app
     """
     @main_app.middleware('http')
     async def log_request(request: Request, call_next):
         start = time.monotonic()
+        status_code = 500
         try:
             logger.info('Request has started')
-            return await call_next(request)
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
         finally:
-            logger.info(f'Request has ended. Elapsed time: {time.monotonic() - start}')
+            elapsed = time.monotonic() - start
+            # Route templates instead of paths, so IDs don't blow up labels
+            route = request.scope.get('route')
+            API_REQUEST_DURATION.labels(
+                method=request.method,
+                route=getattr(route, 'path', 'unmatched'),
+                status=status_code,
+            ).observe(elapsed)
+            logger.info(f'Request has ended. Elapsed time: {elapsed}')
+
+
+@asynccontextmanager
+async def lifespan(main_app: FastAPI):
+    """
+    Opens the DB pool before the app starts serving requests, so the first
+    ones don't wait for connections, and closes it on shutdown.
+    :param main_app: FastAPI app
+    """
+    await pool_holder.open()
+    try:
+        yield
+    finally:
+        await pool_holder.close()
 
 
 def create_application():
@@ -33,6 +68,7 @@ def create_application():
 
     main_app = FastAPI(
         title="URL monitoring service",
+        lifespan=lifespan,
     )
 
     init_middleware(main_app)
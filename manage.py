@@ -1,4 +1,6 @@
 import asyncio
+import json
+from datetime import timedelta
 from random import randint
 
 import click
@@ -30,17 +32,21 @@ def cli():
 def generate_monitors(url: str, count: int):
     click.echo('Starting template generation')
 
-    for template in TEMPLATES:
-        for i in range(count):
-            result = httpx.post(
-                url,
-                json={
-                    "url": f"{template}{i}",
-                    "frequency_sec": randint(10, 200),
-                    "regexp": ".*" if randint(0, 10) < 2 else None
-                }
-            )
-            result.raise_for_status()
+    items = [
+        {
+            "url": f"{template}{i}",
+            "frequency_sec": randint(10, 200),
+            "regexp": ".*" if randint(0, 10) < 2 else None
+        }
+        for template in TEMPLATES
+        for i in range(count)
+    ]
+    result = httpx.post(f"{url.rstrip('/')}/bulk", json=items, timeout=60)
+    result.raise_for_status()
+
+    failed = result.json()['failed']
+    if failed:
+        click.echo(f'{failed} monitors were not created')
 
     click.echo('Finished template generation')
 
@@ -59,5 +65,127 @@ def migrate():
     click.echo('Finishing migration')
 
 
+@cli.command()
+@click.option(
+    '--rows', default=100000, help='rows to write through each path per batch size'
+)
+@click.option(
+    '--batch-size',
+    'batch_sizes',
+    multiple=True,
+    type=int,
+    default=(10, 50, 200, 1000),
+    show_default=True,
+    help='rows written in one transaction, repeat to compare several',
+)
+def bench_log_ingest(rows: int, batch_sizes: tuple[int, ...]):
+    from mservice import settings
+    from mservice.bench.log_ingest import run_log_ingest_benchmark
+
+    async def db_bench():
+        conn = await create_connection()
+        try:
+            return await run_log_ingest_benchmark(conn, rows, batch_sizes)
+        finally:
+            await conn.close()
+
+    click.echo(
+        f'Writing {rows} monitor_log rows per path and batch size, '
+        f'LOG_COPY_THRESHOLD is {settings.LOG_COPY_THRESHOLD}'
+    )
+    results = asyncio.get_event_loop().run_until_complete(db_bench())
+    for batch_size, paths in results.items():
+        rates = ', '.join(
+            f'{name} {rows_per_sec:.0f}' for name, rows_per_sec in paths.items()
+        )
+        click.echo(f'batches of {batch_size}: {rates} rows/sec')
+
+
+@cli.command()
+@click.option('--rows', default=10000, help='rows mapped in one run')
+@click.option('--repeat', default=5, help='runs of every stage, best is taken')
+def bench_row_mapping(rows: int, repeat: int):
+    from mservice.bench.row_mapping import run_row_mapping_benchmark
+
+    click.echo(f'Mapping {rows} rows, best of {repeat} runs')
+    results = run_row_mapping_benchmark(rows, repeat)
+    for name, result in results.items():
+        click.echo(
+            f"{name}: {result['validated_us']:.2f} -> "
+            f"{result['plain_us']:.2f} us/row ({result['speedup']:.1f}x)"
+        )
+
+
+@cli.command()
+@click.option('--monitors', default=1000, help='monitors to create')
+@click.option('--interval', default=10, help='sync interval of monitors, sec')
+@click.option('--duration', default=60.0, help='seconds to run the worker for')
+@click.option('--hosts', default=16, help='loopback hosts of the target farm')
+@click.option('--port', default=18080, help='port of the target farm')
+@click.option('--latency-min', default=0.01, help='min response latency, sec')
+@click.option('--latency-max', default=0.2, help='max response latency, sec')
+@click.option('--error-rate', default=0.01, help='share of 500 responses')
+@click.option('--body-min', default=512, help='min body size, bytes')
+@click.option('--body-max', default=64 * 1024, help='max body size, bytes')
+@click.option('--regexp-rate', default=0.2, help='share of monitors with regexp')
+@click.option(
+    '--output', default='bench-worker.json', help='file to write results to'
+)
+def bench_worker(
+        monitors: int,
+        interval: int,
+        duration: float,
+        hosts: int,
+        port: int,
+        latency_min: float,
+        latency_max: float,
+        error_rate: float,
+        body_min: int,
+        body_max: int,
+        regexp_rate: float,
+        output: str,
+):
+    from mservice.bench.target_farm import FarmConfig
+    from mservice.bench.worker import run_worker_benchmark
+
+    farm = FarmConfig(
+        latency_min=latency_min,
+        latency_max=latency_max,
+        error_rate=error_rate,
+        body_size_min=max(body_min, 1),
+        body_size_max=max(body_max, body_min, 1),
+    )
+
+    async def worker_bench():
+        conn = await create_connection()
+        try:
+            return await run_worker_benchmark(
+                conn,
+                farm,
+                monitors,
+                timedelta(seconds=interval),
+                duration,
+                hosts,
+                port,
+                regexp_rate,
+            )
+        finally:
+            await conn.close()
+
+    click.echo(f'Running the worker for {duration} seconds on {monitors} monitors')
+    results = asyncio.get_event_loop().run_until_complete(worker_bench())
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    click.echo(f'scans/sec: {results["scans_per_sec"]:.1f}')
+    click.echo(f'schedule lag: {results["schedule_lag_sec"]}')
+    click.echo(
+        f'CPU: {results["cpu_percent"]:.0f}%, '
+        f'peak RSS: {results["peak_rss_mb"]:.0f} MB'
+    )
+    click.echo(f'Results are written to {output}')
+
+
 if __name__ == "__main__":
     cli()
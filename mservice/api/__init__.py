@@ -1,4 +1,5 @@
 from fastapi import FastAPI
+from mservice.api.metrics import router as metrics_router
 from mservice.api.monitors import router as monitor_router
 
 
@@ -8,3 +9,4 @@ def init_routers(app: FastAPI):
     :param app: FastAPI app
     """
     app.include_router(router=monitor_router)
+    app.include_router(router=metrics_router)
@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+
+from mservice.metrics import registry, CONTENT_TYPE
+
+router = APIRouter(tags=['metrics'])
+
+
+@router.get('/metrics', include_in_schema=False)
+async def metrics() -> Response:
+    return Response(registry.render(), media_type=CONTENT_TYPE)
@@ -1,17 +1,38 @@
+import json
 import logging
-from datetime import timedelta
-from typing import Annotated
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, AsyncIterator
 
 from asyncpg import Connection
-from fastapi import APIRouter, Depends, Path, HTTPException
-from pydantic import NonNegativeInt
+from fastapi import APIRouter, Depends, Path, HTTPException, Query, Request
+from pydantic import (
+    AnyUrl,
+    NonNegativeInt,
+    PositiveFloat,
+    PositiveInt,
+    TypeAdapter,
+    ValidationError,
+)
 from pydantic.dataclasses import dataclass
 from pydantic_core import Url
 from starlette import status
 
+from mservice import settings
+from mservice.database.metrics_dao import (
+    MetricsDao, choose_bucket, choose_source
+)
+from mservice.database.models import (
+    LatestResultModel,
+    MetricsBucketModel,
+    MonitorStatusModel,
+    MonitorSummaryModel,
+    NewMonitorModel,
+)
 from mservice.database.monitor_dao import MonitorDao, WrongRegexException
 from mservice.schema.metrics import FrequencySec
 from mservice.dependencies import db_connection
+from mservice.parser import compile_pattern
+from mservice.utils import utc_tz_now
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +43,10 @@ def monitor_dao(conn: Connection = Depends(db_connection)):
     return MonitorDao(conn)
 
 
+def metrics_dao(conn: Connection = Depends(db_connection)):
+    return MetricsDao(conn)
+
+
 @dataclass(frozen=True, slots=True)
 class DeletionMessageResponse:
     message: str
@@ -34,10 +59,150 @@ class CreatedItemMessageResponse:
 
 
 @dataclass(frozen=True, slots=True)
+class MonitorMetricsResponse:
+    monitor_id: int
+    start: datetime
+    end: datetime
+    bucket_sec: int
+    # Raw data or a rollup the buckets are read from
+    source: str
+    buckets: list[MetricsBucketModel]
+
+
+@dataclass(frozen=True, slots=True)
+class BulkItemResult:
+    # Position of the item in the request
+    index: int
+    id: int | None
+    error: str | None
+
+
+@dataclass(frozen=True, slots=True)
+class BulkCreationResponse:
+    created: int
+    failed: int
+    items: list[BulkItemResult]
+
+
+@dataclass(frozen=True, slots=True)
+class MonitorItemResponse:
+    id: int
+    url: str
+    frequency_sec: int
+    regexp: str | None
+    active: bool
+    next_sync: datetime
+    host_max_concurrency: int | None
+    host_rate_limit: float | None
+    # Only set if it was requested and the monitor has results
+    latest: LatestResultModel | None
+
+    @classmethod
+    def from_model(cls, item: MonitorSummaryModel):
+        return cls(
+            id=item.id,
+            url=str(item.url),
+            frequency_sec=round(item.sync_interval.total_seconds()),
+            regexp=item.regexp,
+            active=item.active,
+            next_sync=item.next_sync,
+            host_max_concurrency=item.host_max_concurrency,
+            host_rate_limit=item.host_rate_limit,
+            latest=item.latest,
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class MonitorListResponse:
+    items: list[MonitorItemResponse]
+    # Pass it as the cursor to get the next page, None on the last page
+    next_cursor: int | None
+
+
+@dataclass(frozen=True, slots=True)
+class MonitorStatusResponse:
+    items: list[MonitorStatusModel]
+    # Requested monitors which are unknown or have no scan results yet
+    missing: list[int]
+
+
+# Not slotted - pydantic can't set defaults of slotted dataclasses
+@dataclass(frozen=True)
 class UrlMonitorCreationRequest:
     url: str
     frequency_sec: FrequencySec
     regexp: str | None
+    # Optional overrides of the per-host request limits
+    host_max_concurrency: PositiveInt | None = None
+    host_rate_limit: PositiveFloat | None = None
+
+
+@router.get('/')
+async def list_monitors(
+        limit: Annotated[
+            int, Query(ge=1, le=settings.LIST_MAX_LIMIT, title="Page size")
+        ] = settings.LIST_DEFAULT_LIMIT,
+        cursor: Annotated[
+            NonNegativeInt | None,
+            Query(title="next_cursor of the previous page"),
+        ] = None,
+        active: Annotated[
+            bool | None, Query(title="Only active or inactive monitors")
+        ] = None,
+        host: Annotated[str | None, Query(title="URL host")] = None,
+        url_prefix: Annotated[
+            str | None, Query(min_length=1, title="Start of the URL")
+        ] = None,
+        overdue: Annotated[
+            bool | None,
+            Query(title="Only monitors which are (not) late for their sync"),
+        ] = None,
+        include_latest: Annotated[
+            bool, Query(title="Add the latest scan result of every monitor")
+        ] = False,
+        dao: MonitorDao = Depends(monitor_dao),
+) -> MonitorListResponse:
+    """
+    Lists monitors ordered by ID. Pages are read by a cursor instead of an
+    offset, so deep pages are as fast as the first one.
+    """
+    # One more item tells whether there is a next page
+    items = await dao.select_page(
+        limit + 1,
+        after_id=cursor,
+        active=active,
+        host=host,
+        url_prefix=url_prefix,
+        overdue=overdue,
+        include_latest=include_latest,
+    )
+    page = items[:limit]
+
+    return MonitorListResponse(
+        items=[MonitorItemResponse.from_model(item) for item in page],
+        next_cursor=page[-1].id if len(items) > limit else None,
+    )
+
+
+@router.get('/status')
+async def monitors_status(
+        ids: Annotated[
+            list[NonNegativeInt],
+            Query(max_length=settings.STATUS_MAX_IDS, title="IDs of monitors"),
+        ] = [],
+        dao: MonitorDao = Depends(monitor_dao),
+) -> MonitorStatusResponse:
+    """
+    Current status of many monitors at once, kept up to date by the worker
+    on every scan
+    """
+    items = await dao.select_status(ids)
+    found = {item.monitor_id for item in items}
+
+    return MonitorStatusResponse(
+        items=items,
+        missing=sorted(set(ids) - found),
+    )
 
 
 @router.post('/', status_code=status.HTTP_201_CREATED)
@@ -49,7 +214,9 @@ async def create(
         monitor_id = await dao.create(
             Url(new_monitor.url),
             timedelta(seconds=new_monitor.frequency_sec),
-            new_monitor.regexp
+            new_monitor.regexp,
+            host_max_concurrency=new_monitor.host_max_concurrency,
+            host_rate_limit=new_monitor.host_rate_limit,
         )
     except WrongRegexException as e:
         raise HTTPException(
@@ -64,6 +231,183 @@ async def create(
     return CreatedItemMessageResponse(monitor_id)
 
 
+_creation_request = TypeAdapter(UrlMonitorCreationRequest)
+_url = TypeAdapter(AnyUrl)
+
+
+def _too_many_items():
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Bulk request can have up to {settings.BULK_MAX_ITEMS} items"
+    )
+
+
+def _too_big_body():
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=(
+            f"Bulk request body can have up to "
+            f"{settings.BULK_MAX_BODY_SIZE} bytes"
+        )
+    )
+
+
+async def _limited_stream(request: Request) -> AsyncIterator[bytes]:
+    """
+    Streams the request body, failing as soon as it exceeds
+    settings.BULK_MAX_BODY_SIZE
+    :param request: request to read
+    :return: body chunks
+    """
+    declared = request.headers.get('content-length', '')
+    if declared.isdigit() and int(declared) > settings.BULK_MAX_BODY_SIZE:
+        raise _too_big_body()
+
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > settings.BULK_MAX_BODY_SIZE:
+            raise _too_big_body()
+        yield chunk
+
+
+async def _read_bulk_items(request: Request) -> list[dict | bytes]:
+    """
+    Reads items of a bulk request, up to settings.BULK_MAX_BODY_SIZE bytes.
+    NDJSON is read line by line as it arrives, its lines are returned
+    unparsed, so a malformed line only fails its own item.
+    :param request: request with a JSON array or an NDJSON body
+    :return: parsed items of an array or raw NDJSON lines
+    """
+    if 'ndjson' in request.headers.get('content-type', ''):
+        lines: list[dict | bytes] = []
+        rest = b''
+        async for chunk in _limited_stream(request):
+            *complete, rest = (rest + chunk).split(b'\n')
+            lines.extend(line for line in complete if line.strip())
+            if len(lines) > settings.BULK_MAX_ITEMS:
+                raise _too_many_items()
+        if rest.strip():
+            lines.append(rest)
+        if len(lines) > settings.BULK_MAX_ITEMS:
+            raise _too_many_items()
+
+        return lines
+
+    body = b''.join([chunk async for chunk in _limited_stream(request)])
+    try:
+        items = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Body should be a JSON array or NDJSON"
+        ) from e
+    if not isinstance(items, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Body should be a JSON array or NDJSON"
+        )
+    if len(items) > settings.BULK_MAX_ITEMS:
+        raise _too_many_items()
+
+    return items
+
+
+def _to_new_monitor(raw: dict | bytes) -> NewMonitorModel:
+    """
+    Validates one bulk item and compiles its regexp
+    :param raw: parsed item or raw NDJSON line
+    :return: monitor to create
+    :raises ValidationError: if the item is malformed
+    :raises WrongRegexException: if the regexp can't be compiled
+    """
+    item = (
+        _creation_request.validate_json(raw)
+        if isinstance(raw, bytes)
+        else _creation_request.validate_python(raw)
+    )
+    if item.regexp is not None:
+        try:
+            compile_pattern(item.regexp)
+        except Exception as e:
+            raise WrongRegexException("Malformed regexp") from e
+
+    return NewMonitorModel(
+        url=_url.validate_python(item.url),
+        sync_interval=timedelta(seconds=item.frequency_sec),
+        regexp=item.regexp,
+        host_max_concurrency=item.host_max_concurrency,
+        host_rate_limit=item.host_rate_limit,
+    )
+
+
+def _validation_error(error: ValidationError) -> str:
+    return '; '.join(
+        f"{'.'.join(map(str, details['loc'])) or 'item'}: {details['msg']}"
+        for details in error.errors()
+    )
+
+
+@router.post(
+    '/bulk',
+    status_code=status.HTTP_201_CREATED,
+    openapi_extra={
+        'requestBody': {
+            'required': True,
+            'content': {
+                'application/json': {
+                    'schema': {
+                        'type': 'array',
+                        'items': {
+                            '$ref': '#/components/schemas/'
+                                    'UrlMonitorCreationRequest'
+                        },
+                    },
+                },
+                'application/x-ndjson': {'schema': {'type': 'string'}},
+            },
+        },
+    },
+)
+async def create_bulk(
+    request: Request,
+    dao: MonitorDao = Depends(monitor_dao),
+) -> BulkCreationResponse:
+    """
+    Creates monitors from a JSON array or NDJSON. All items are validated
+    up front, valid ones are inserted at once, invalid ones are reported
+    with their errors.
+    """
+    raw_items = await _read_bulk_items(request)
+    errors: dict[int, str] = {}
+    new_monitors: dict[int, NewMonitorModel] = {}
+    for index, raw in enumerate(raw_items):
+        try:
+            new_monitors[index] = _to_new_monitor(raw)
+        except ValidationError as e:
+            errors[index] = _validation_error(e)
+        except WrongRegexException as e:
+            errors[index] = str(e)
+
+    ids = dict(zip(
+        new_monitors.keys(),
+        await dao.create_many(list(new_monitors.values())),
+    ))
+
+    logger.info(
+        f"Created {len(ids)} URL monitors in bulk, {len(errors)} have failed"
+    )
+
+    return BulkCreationResponse(
+        created=len(ids),
+        failed=len(errors),
+        items=[
+            BulkItemResult(index, ids.get(index), errors.get(index))
+            for index in range(len(raw_items))
+        ],
+    )
+
+
 @router.delete('/{id}/')
 async def delete(
         id: Annotated[NonNegativeInt, Path(title="ID of monitor for removal")],
@@ -80,3 +424,62 @@ async def delete(
     logger.info(message)
 
     return DeletionMessageResponse(message, is_removed)
+
+
+def _as_utc(value: datetime) -> datetime:
+    """
+    :return: the same time, naive values are treated as UTC
+    """
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+@router.get('/{id}/metrics')
+async def metrics(
+        id: Annotated[NonNegativeInt, Path(title="ID of monitor")],
+        start: Annotated[
+            datetime | None, Query(alias='from', title="Start of the range")
+        ] = None,
+        end: Annotated[
+            datetime | None, Query(alias='to', title="End of the range")
+        ] = None,
+        bucket: Annotated[
+            PositiveInt | None,
+            Query(title="Bucket size in seconds, grows to fit the point budget"),
+        ] = None,
+        dao: MonitorDao = Depends(monitor_dao),
+        mdao: MetricsDao = Depends(metrics_dao),
+) -> MonitorMetricsResponse:
+    end = utc_tz_now() if end is None else _as_utc(end)
+    start = (
+        end - timedelta(seconds=settings.METRICS_DEFAULT_RANGE)
+        if start is None
+        else _as_utc(start)
+    )
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Range start should be before its end"
+        )
+
+    if await dao.get(id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Not found or disabled an URL monitor with id: {id}"
+        )
+
+    bucket_size = choose_bucket(
+        start,
+        end,
+        settings.METRICS_MAX_POINTS,
+        None if bucket is None else timedelta(seconds=bucket),
+    )
+    buckets = await mdao.select_buckets(id, start, end, bucket_size)
+
+    return MonitorMetricsResponse(
+        monitor_id=id,
+        start=start,
+        end=end,
+        bucket_sec=round(bucket_size.total_seconds()),
+        source=choose_source(bucket_size),
+        buckets=buckets,
+    )
@@ -0,0 +1,133 @@
+import logging
+import time
+from collections.abc import Sequence
+from datetime import timedelta
+
+from asyncpg import Connection
+from pydantic_core import Url
+
+from mservice.database.models import NewMonitorModel
+from mservice.database.monitor_dao import MonitorDao
+from mservice.schema.errors import ErrorCode
+from mservice.utils import utc_tz_now
+
+logger = logging.getLogger(__name__)
+
+
+def _generate_records(monitor_ids: list[int], amount: int) -> list[tuple]:
+    """
+    Generates fake monitor_log records, one per millisecond forward from
+    now, spread round-robin over the given monitors
+    :param monitor_ids: monitors to attach records to
+    :param amount: amount of records
+    :return: records in LOG_COLUMNS order
+    """
+    now = utc_tz_now()
+    return [
+        (
+            monitor_ids[i % len(monitor_ids)],
+            now + timedelta(milliseconds=i),
+            200 if i % 10 else 500,
+            i % 1000,
+            i % 2 == 0,
+            None if i % 10 else ErrorCode.UNKNOWN,
+            None,
+            i % 3 == 0,
+            i % 50,
+            None,
+            None,
+            None,
+            i % 500,
+            i % 100,
+            i % 100000,
+        )
+        for i in range(amount)
+    ]
+
+
+async def _copy_log_and_status(mdao: MonitorDao, records: list[tuple]):
+    await mdao.copy_log_records(records)
+    await mdao.upsert_status(records)
+
+
+async def _insert_log_and_upsert_status(mdao: MonitorDao, records: list[tuple]):
+    await mdao.insert_log_records(records)
+    await mdao.upsert_status(records)
+
+
+async def run_log_ingest_benchmark(
+        connection: Connection, rows: int, batch_sizes: Sequence[int]
+) -> dict[int, dict[str, float]]:
+    """
+    Writes the same amount of monitor_log rows, together with the
+    monitor_status upsert, through every write path and measures their
+    throughput per batch size:
+    - executemany: one INSERT per row, kept for reference
+    - unnest: single statement, used below settings.LOG_COPY_THRESHOLD
+    - copy: binary COPY, used from settings.LOG_COPY_THRESHOLD on
+    The batch size where copy overtakes unnest is the threshold to use.
+    All generated data is removed afterwards.
+    :param connection: database connection
+    :param rows: amount of rows to write through each path per batch size
+    :param batch_sizes: rows written per transaction, one run for each
+    :return: rows per second for every path by batch size
+    """
+    mdao = MonitorDao(connection)
+    # A batch holds one result per monitor, as a scheduler flush does
+    monitor_ids = await mdao.create_many([
+        NewMonitorModel(
+            url=Url(f"http://benchmark.local/{i}"),
+            sync_interval=timedelta(minutes=1),
+            regexp=None,
+            host_max_concurrency=None,
+            host_rate_limit=None,
+        )
+        for i in range(max(batch_sizes))
+    ])
+    # Inactive, so running workers won't scan them
+    await connection.execute(
+        'UPDATE monitors SET active = false WHERE id = any($1)', monitor_ids
+    )
+
+    async def cleanup_results():
+        await connection.execute(
+            'DELETE FROM monitor_log WHERE monitor_id = any($1)', monitor_ids
+        )
+        await connection.execute(
+            'DELETE FROM monitor_status WHERE monitor_id = any($1)',
+            monitor_ids,
+        )
+
+    results: dict[int, dict[str, float]] = {}
+    try:
+        for batch_size in batch_sizes:
+            records = _generate_records(monitor_ids[:batch_size], rows)
+            batches = [
+                records[i:i + batch_size]
+                for i in range(0, len(records), batch_size)
+            ]
+            results[batch_size] = {}
+            for name, write in (
+                    ('executemany', _insert_log_and_upsert_status),
+                    ('unnest', MonitorDao.insert_log_and_status),
+                    ('copy', _copy_log_and_status),
+            ):
+                start = time.perf_counter()
+                for batch in batches:
+                    async with connection.transaction():
+                        await write(mdao, batch)
+                elapsed = time.perf_counter() - start
+
+                results[batch_size][name] = rows / elapsed
+                logger.info(
+                    f"{name}, batches of {batch_size}: "
+                    f"{rows} rows in {elapsed:.3f} seconds"
+                )
+                await cleanup_results()
+    finally:
+        await cleanup_results()
+        await connection.execute(
+            'DELETE FROM monitors WHERE id = any($1)', monitor_ids
+        )
+
+    return results
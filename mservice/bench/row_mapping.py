@@ -0,0 +1,215 @@
+import re
+import time
+from datetime import datetime, timedelta
+from collections.abc import Sequence
+from typing import Callable
+
+from pydantic import (
+    AnyUrl,
+    NonNegativeInt,
+    PositiveFloat,
+    PositiveInt,
+    TypeAdapter,
+    validate_call,
+)
+from pydantic.dataclasses import dataclass
+
+from mservice.database.monitor_dao import MonitorDao
+from mservice.parser import compile_pattern
+from mservice.requester import url_host
+from mservice.schema.errors import ErrorCode
+from mservice.schema.metrics import SiteMetricSchema
+from mservice.utils import utc_tz_now
+
+
+# Validated versions of the worker records, as they were before they became
+# plain dataclasses. Kept here to compare the per-row cost
+@dataclass(frozen=True, slots=True)
+class _ValidatedMonitorModel:
+    id: int
+    url: AnyUrl
+    regexp: str | None
+    pattern: re.Pattern | None
+    active: bool
+    sync_interval: timedelta
+    next_sync: datetime
+    host_max_concurrency: int | None
+    host_rate_limit: float | None
+
+
+@dataclass(frozen=True, slots=True)
+class _ValidatedSiteMetric:
+    ts: datetime
+    response_time_ms: NonNegativeInt
+    http_status: NonNegativeInt
+    regexp_found: bool
+    error_code: ErrorCode | None
+    from_cache: bool
+    queue_time_ms: NonNegativeInt
+    # No defaults: _metric sets all the fields
+    dns_ms: NonNegativeInt | None
+    connect_ms: NonNegativeInt | None
+    tls_ms: NonNegativeInt | None
+    ttfb_ms: NonNegativeInt | None
+    download_ms: NonNegativeInt | None
+    response_size: NonNegativeInt | None
+    error_detail: str | None
+
+
+# What @validate_call did with the arguments of the hot path methods
+_validated_url = TypeAdapter(AnyUrl)
+_validated_log_items = TypeAdapter(list[tuple[int, _ValidatedSiteMetric]])
+
+
+@validate_call
+def _validated_request_host(
+        url: AnyUrl,
+        patterns: tuple[re.Pattern, ...] = (),
+        max_concurrency: PositiveInt | None = None,
+        rate_limit: PositiveFloat | None = None,
+) -> str:
+    return url.host or ''
+
+
+def _generate_rows(amount: int) -> list[dict]:
+    """
+    :param amount: amount of rows
+    :return: monitors rows of MONITOR_COLUMNS, every 5th one with a regexp
+    """
+    now = utc_tz_now()
+    return [
+        {
+            'id': i,
+            'url': f'https://site{i % 1000}.example.com/page/{i}',
+            'regexp': r'status:\s+ok' if i % 5 == 0 else None,
+            'active': True,
+            'sync_interval': timedelta(seconds=60),
+            'next_sync': now,
+            'host_max_concurrency': None,
+            'host_rate_limit': None,
+        }
+        for i in range(amount)
+    ]
+
+
+def _validated_monitor(row: dict) -> _ValidatedMonitorModel:
+    regexp = row['regexp']
+    return _ValidatedMonitorModel(
+        **row, pattern=None if regexp is None else compile_pattern(regexp)
+    )
+
+
+def _metric(cls, ts: datetime):
+    """
+    Sets every field, so both record classes get the same arguments
+    """
+    return cls(
+        ts=ts,
+        response_time_ms=120,
+        http_status=200,
+        regexp_found=False,
+        error_code=None,
+        from_cache=False,
+        queue_time_ms=0,
+        dns_ms=3,
+        connect_ms=10,
+        tls_ms=25,
+        ttfb_ms=80,
+        download_ms=2,
+        response_size=14000,
+        error_detail=None,
+    )
+
+
+def _log_records(
+        items: Sequence[tuple[int, SiteMetricSchema | _ValidatedSiteMetric]]
+) -> list[tuple]:
+    """
+    Builds monitor_log records like MonitorDao.create_log_items_from_schema
+    """
+    return [
+        (
+            monitor_id,
+            item.ts,
+            item.http_status,
+            item.response_time_ms,
+            item.regexp_found,
+            item.error_code,
+            None,
+            item.from_cache,
+            item.queue_time_ms,
+            item.dns_ms,
+            item.connect_ms,
+            item.tls_ms,
+            item.ttfb_ms,
+            item.download_ms,
+            item.response_size,
+        )
+        for monitor_id, item in items
+    ]
+
+
+def _per_row_us(function: Callable[[], object], rows: int, repeat: int) -> float:
+    """
+    :return: the best time of repeat runs, microseconds per row
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best / rows * 1_000_000
+
+
+def run_row_mapping_benchmark(rows: int, repeat: int) -> dict[str, dict]:
+    """
+    Measures the per-row CPU cost of the worker hot path records with and
+    without pydantic validation: mapping claimed monitor rows, building
+    scan results, arguments of a request and the records written to the log.
+    Both sides of every stage get the same fields. Doesn't need a database.
+    :param rows: amount of rows per run
+    :param repeat: runs of every stage, the best one is taken
+    :return: microseconds per row of every stage, validated and plain
+    """
+    dict_rows = _generate_rows(rows)
+    urls = [row['url'] for row in dict_rows]
+    validated_urls = [_validated_url.validate_python(url) for url in urls]
+    now = utc_tz_now()
+    validated_metrics = [
+        (i, _metric(_ValidatedSiteMetric, now)) for i in range(rows)
+    ]
+    plain_metrics = [(i, _metric(SiteMetricSchema, now)) for i in range(rows)]
+
+    stages = {
+        'monitor_row': (
+            lambda: [_validated_monitor(row) for row in dict_rows],
+            lambda: [MonitorDao._db_to_model(row) for row in dict_rows],
+        ),
+        'scan_result': (
+            lambda: [_metric(_ValidatedSiteMetric, now) for _ in range(rows)],
+            lambda: [_metric(SiteMetricSchema, now) for _ in range(rows)],
+        ),
+        'request_url': (
+            lambda: [_validated_request_host(url) for url in validated_urls],
+            lambda: [url_host(url) for url in urls],
+        ),
+        'log_items': (
+            lambda: _log_records(
+                _validated_log_items.validate_python(validated_metrics)
+            ),
+            lambda: _log_records(plain_metrics),
+        ),
+    }
+
+    results = {}
+    for name, (validated, plain) in stages.items():
+        before = _per_row_us(validated, rows, repeat)
+        after = _per_row_us(plain, rows, repeat)
+        results[name] = {
+            'validated_us': before,
+            'plain_us': after,
+            'speedup': before / after if after else None,
+        }
+
+    return results
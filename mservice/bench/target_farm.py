@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import multiprocessing
+import random
+from dataclasses import dataclass
+from multiprocessing.process import BaseProcess
+
+logger = logging.getLogger(__name__)
+
+# Found by monitors with a regexp, placed at the end of every body
+NEEDLE = 'benchmark-needle'
+
+
+@dataclass(frozen=True, slots=True)
+class FarmConfig:
+    # Response latency is uniformly distributed between these seconds
+    latency_min: float
+    latency_max: float
+    # Share of responses with 500 status
+    error_rate: float
+    # Body size is log-uniformly distributed between these bytes
+    body_size_min: int
+    body_size_max: int
+
+    def latency(self) -> float:
+        return random.uniform(self.latency_min, self.latency_max)
+
+    def body_size(self) -> int:
+        return round(
+            self.body_size_min
+            * (self.body_size_max / self.body_size_min) ** random.random()
+        )
+
+
+def farm_hosts(amount: int) -> list[str]:
+    """
+    Loopback addresses of the farm. Every address is a separate host for
+    the per-host limits of the requester. Linux routes the whole 127.0.0.0/8
+    to the loopback interface.
+    :param amount: amount of hosts
+    :return: IP addresses
+    """
+    return [f'127.0.0.{i}' for i in range(1, amount + 1)]
+
+
+class TargetFarm:
+    """
+    Minimal keep-alive HTTP server which answers every GET request after
+    a random latency with a random status and body size.
+    """
+
+    def __init__(self, config: FarmConfig):
+        self.config = config
+        filler = b'x' * max(config.body_size_max - len(NEEDLE), 0)
+        self._body = filler + NEEDLE.encode()
+
+    async def _respond(self, writer: asyncio.StreamWriter):
+        await asyncio.sleep(self.config.latency())
+
+        status = (
+            b'500 Internal Server Error'
+            if random.random() < self.config.error_rate
+            else b'200 OK'
+        )
+        # Tail of the body, so it always ends with the needle
+        body = self._body[-self.config.body_size():]
+        writer.write(
+            b'HTTP/1.1 ' + status + b'\r\n'
+            b'Content-Type: text/plain; charset=utf-8\r\n'
+            b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n'
+            + body
+        )
+        await writer.drain()
+
+    async def _handle(
+            self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            while await reader.readline():
+                keep_alive = True
+                while header := (await reader.readline()).strip():
+                    if header.lower() == b'connection: close':
+                        keep_alive = False
+
+                await self._respond(writer)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, hosts: list[str], port: int, ready=None):
+        """
+        Serves requests until cancelled
+        :param hosts: addresses to listen on
+        :param port: port to listen on
+        :param ready: [optional] event to set once the farm is listening
+        """
+        server = await asyncio.start_server(
+            self._handle, hosts, port, backlog=4096
+        )
+        logger.info(f"Target farm is listening on {len(hosts)} hosts, port {port}")
+        if ready is not None:
+            ready.set()
+
+        async with server:
+            await server.serve_forever()
+
+
+def _run_farm(config: FarmConfig, hosts: list[str], port: int, ready):
+    asyncio.run(TargetFarm(config).serve(hosts, port, ready))
+
+
+def start_farm_process(
+        config: FarmConfig, hosts: list[str], port: int, timeout: float = 10
+) -> BaseProcess:
+    """
+    Runs the farm in a separate process, so its CPU usage isn't mixed
+    with the measured worker.
+    :param config: responses configuration
+    :param hosts: addresses to listen on
+    :param port: port to listen on
+    :param timeout: seconds to wait for the farm to start listening
+    :return: started process, should be terminated afterwards
+    """
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    process = context.Process(
+        target=_run_farm,
+        args=(config, hosts, port, ready),
+        name='target-farm',
+        daemon=True,
+    )
+    process.start()
+
+    if not ready.wait(timeout):
+        process.terminate()
+        raise RuntimeError("Target farm hasn't started in time")
+
+    return process
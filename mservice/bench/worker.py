@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import random
+import resource
+import subprocess
+import sys
+import time
+from bisect import bisect_left
+from dataclasses import asdict
+from datetime import timedelta
+
+from asyncpg import Connection
+
+from mservice import settings
+from mservice.bench.target_farm import (
+    FarmConfig, NEEDLE, farm_hosts, start_farm_process
+)
+from mservice.database.monitor_dao import MonitorDao
+from mservice.scheduler import (
+    REQUESTS, SCANS, SCHEDULE_LAG, monitors_update_task
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _histogram_quantile(
+        buckets: tuple[float, ...], counts: list[int], quantile: float
+) -> float | None:
+    """
+    Estimates a quantile from histogram buckets by linear interpolation
+    inside of the bucket, like Prometheus histogram_quantile() does
+    :param buckets: upper bounds of the buckets, without +Inf
+    :param counts: non-cumulative counts of the buckets, with +Inf
+    :param quantile: quantile to estimate, 0-1
+    :return: estimated value, None if there are no observations
+    """
+    total = sum(counts)
+    if total == 0:
+        return None
+
+    cumulative = [0]
+    for count in counts:
+        cumulative.append(cumulative[-1] + count)
+    rank = quantile * total
+    index = max(bisect_left(cumulative, rank) - 1, 0)
+    if index >= len(buckets):
+        # Falls into +Inf bucket - the highest known bound is the best guess
+        return buckets[-1]
+
+    lower = buckets[index - 1] if index > 0 else 0.0
+    in_bucket = counts[index]
+    position = (rank - cumulative[index]) / in_bucket if in_bucket else 1.0
+
+    return lower + (buckets[index] - lower) * position
+
+
+def _git_commit() -> str | None:
+    """
+    :return: current commit of the working tree, if it is known
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, check=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS - bytes
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def _create_monitors(
+        connection: Connection,
+        hosts: list[str],
+        port: int,
+        amount: int,
+        interval: timedelta,
+        regexp_rate: float,
+) -> list[int]:
+    """
+    Creates monitors of the farm URLs, spread evenly over their interval
+    :return: IDs of the created monitors
+    """
+    records = [
+        (
+            f'http://{hosts[i % len(hosts)]}:{port}/{i}',
+            NEEDLE if random.random() < regexp_rate else None,
+            interval,
+            1.0,
+            None,
+            None,
+        )
+        for i in range(amount)
+    ]
+    async with connection.transaction():
+        ids = [
+            await connection.fetchval(MonitorDao.INSERT, *record)
+            for record in records
+        ]
+
+    return ids
+
+
+async def _remove_monitors(connection: Connection, ids: list[int]):
+    await connection.execute(
+        'DELETE FROM monitor_log WHERE monitor_id = any($1::integer[])', ids
+    )
+    await connection.execute(
+        'DELETE FROM monitors WHERE id = any($1::integer[])', ids
+    )
+
+
+async def run_worker_benchmark(
+        connection: Connection,
+        farm: FarmConfig,
+        monitors: int,
+        interval: timedelta,
+        duration: float,
+        hosts: int,
+        port: int,
+        regexp_rate: float,
+) -> dict:
+    """
+    Runs monitors_update_task against a local target farm for a fixed time
+    and measures throughput and resource usage of the worker. The farm runs
+    in a separate process. Created monitors and their results are removed
+    afterwards, other monitors in the DB would be scanned as well, so it
+    should be run against a dedicated database.
+    :param connection: database connection
+    :param farm: responses configuration of the farm
+    :param monitors: amount of monitors to create
+    :param interval: sync interval of the monitors
+    :param duration: seconds to run the worker for
+    :param hosts: amount of loopback hosts of the farm
+    :param port: port of the farm
+    :param regexp_rate: share of monitors with a regexp
+    :return: benchmark results
+    """
+    farm_addresses = farm_hosts(hosts)
+    farm_process = start_farm_process(farm, farm_addresses, port)
+    ids = []
+    try:
+        ids = await _create_monitors(
+            connection, farm_addresses, port, monitors, interval, regexp_rate
+        )
+        logger.info(f"Created {len(ids)} monitors, running the worker")
+
+        scans, requests = SCANS.value, REQUESTS.value
+        lag_counts = list(SCHEDULE_LAG.labels().counts)
+        cpu_start = _cpu_seconds()
+        start = time.perf_counter()
+
+        worker = asyncio.create_task(monitors_update_task())
+        await asyncio.sleep(duration)
+        worker.cancel()
+        await worker
+
+        elapsed = time.perf_counter() - start
+        cpu = _cpu_seconds() - cpu_start
+        lag_counts = [
+            after - before
+            for after, before in zip(SCHEDULE_LAG.labels().counts, lag_counts)
+        ]
+    finally:
+        farm_process.terminate()
+        farm_process.join()
+        if ids:
+            await _remove_monitors(connection, ids)
+
+    return {
+        'commit': _git_commit(),
+        'config': {
+            'monitors': monitors,
+            'interval_sec': interval.total_seconds(),
+            'duration_sec': duration,
+            'hosts': hosts,
+            'regexp_rate': regexp_rate,
+            'farm': asdict(farm),
+            'sync_mode': settings.SYNC_MODE,
+            'pipelines': settings.WORKER_PIPELINES,
+            'max_in_flight': settings.WORKER_MAX_IN_FLIGHT,
+        },
+        'scans': SCANS.value - scans,
+        'scans_per_sec': (SCANS.value - scans) / elapsed,
+        'requests_per_sec': (REQUESTS.value - requests) / elapsed,
+        'schedule_lag_sec': {
+            f'p{round(q * 100)}': _histogram_quantile(
+                SCHEDULE_LAG.buckets, lag_counts, q
+            )
+            for q in (0.5, 0.95, 0.99)
+        },
+        'cpu_sec': cpu,
+        'cpu_percent': cpu / elapsed * 100,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
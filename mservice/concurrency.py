@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from typing import AsyncIterator
+
+from mservice.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Loop lag is probed this often between adjustments
+LAG_PROBE_INTERVAL = 0.1
+# Latency percentiles aren't trusted for windows with fewer samples
+MIN_LATENCY_SAMPLES = 20
+# The lowest observed p95 slowly grows back, so the baseline can follow
+# targets which became slower for good
+BASELINE_DRIFT = 1.01
+
+DECISIONS = registry.counter(
+    'mservice_concurrency_decisions_total',
+    'Adjustments of the scans concurrency limit by action and reason',
+    ('action', 'reason'),
+)
+
+
+@dataclass(frozen=True, slots=True)
+class ConcurrencyDecision:
+    ts: float
+    previous_limit: int
+    limit: int
+    # increase, decrease or hold
+    action: str
+    reason: str
+    loop_lag: float
+    timeout_rate: float
+    latency_p95: float | None
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    """
+    :param values: non-empty list of samples
+    :param percent: percentile to calculate, 0-100
+    :return: nearest-rank percentile of the samples
+    """
+    ordered = sorted(values)
+    rank = math.ceil(percent / 100 * len(ordered))
+    return ordered[max(rank, 1) - 1]
+
+
+class AdaptiveConcurrency:
+    """
+    Limits the amount of scans in flight and adjusts the limit AIMD-style:
+    the limit grows by a fixed step while the worker keeps up and is cut by
+    a factor as soon as it's overloaded. Overload is detected by event loop
+    lag, the share of timed out requests and latency p95 growing compared to
+    the lowest observed one.
+
+    Adjustments are made by run(), which should be started as a task.
+    """
+
+    def __init__(
+            self,
+            min_limit: int,
+            max_limit: int,
+            initial_limit: int,
+            increase: int,
+            decrease: float,
+            max_loop_lag: float,
+            max_timeout_rate: float,
+            latency_tolerance: float,
+            history_size: int = 20,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max(initial_limit, min_limit), max_limit)
+        self.increase = increase
+        self.decrease = decrease
+        self.max_loop_lag = max_loop_lag
+        self.max_timeout_rate = max_timeout_rate
+        self.latency_tolerance = latency_tolerance
+        self.decisions: deque[ConcurrencyDecision] = deque(maxlen=history_size)
+
+        self._active = 0
+        self._waiting = 0
+        self._slot_freed = asyncio.Condition()
+        self._latency_baseline: float | None = None
+        self._reset_window()
+
+    def _reset_window(self):
+        self._latencies: list[float] = []
+        self._timeouts = 0
+        self._results = 0
+        self._loop_lag = 0.0
+        self._saturated = self._waiting > 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Waits for a free slot under the current limit, holds it until exit
+        """
+        async with self._slot_freed:
+            self._waiting += 1
+            try:
+                await self._slot_freed.wait_for(
+                    lambda: self._active < self.limit
+                )
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            if self._active >= self.limit:
+                self._saturated = True
+
+        try:
+            yield
+        finally:
+            async with self._slot_freed:
+                self._active -= 1
+                # More than one waiter can go on if the limit was raised
+                self._slot_freed.notify(max(self.limit - self._active, 1))
+
+    def record(self, latency: float | None, timed_out: bool = False):
+        """
+        Records the outcome of one request
+        :param latency: response time in seconds, None if there is no response
+        :param timed_out: whether the request has timed out
+        """
+        self._results += 1
+        if timed_out:
+            self._timeouts += 1
+        if latency is not None:
+            self._latencies.append(latency)
+
+    def adjust(self) -> ConcurrencyDecision:
+        """
+        Changes the limit according to the observations since the previous
+        adjustment and starts a new observation window.
+        :return: the made decision
+        """
+        timeout_rate = self._timeouts / self._results if self._results else 0.0
+        latency_p95 = (
+            _percentile(self._latencies, 95)
+            if len(self._latencies) >= MIN_LATENCY_SAMPLES
+            else None
+        )
+
+        latency_limit = None
+        if latency_p95 is not None:
+            if self._latency_baseline is None:
+                self._latency_baseline = latency_p95
+            else:
+                self._latency_baseline = min(
+                    self._latency_baseline * BASELINE_DRIFT, latency_p95
+                )
+            latency_limit = self._latency_baseline * self.latency_tolerance
+
+        previous_limit = self.limit
+        if self._loop_lag > self.max_loop_lag:
+            action, reason = 'decrease', 'event loop lag'
+        elif timeout_rate > self.max_timeout_rate:
+            action, reason = 'decrease', 'timeout rate'
+        elif (
+                latency_p95 is not None
+                and latency_limit is not None
+                and latency_p95 > latency_limit
+        ):
+            action, reason = 'decrease', 'latency p95'
+        elif self._saturated:
+            action, reason = 'increase', 'all slots are busy'
+        else:
+            action, reason = 'hold', 'limit is not reached'
+
+        if action == 'decrease':
+            self.limit = max(math.floor(self.limit * self.decrease), self.min_limit)
+        elif action == 'increase':
+            self.limit = min(self.limit + self.increase, self.max_limit)
+
+        decision = ConcurrencyDecision(
+            ts=time.time(),
+            previous_limit=previous_limit,
+            limit=self.limit,
+            action=action,
+            reason=reason,
+            loop_lag=self._loop_lag,
+            timeout_rate=timeout_rate,
+            latency_p95=latency_p95,
+        )
+        self.decisions.append(decision)
+        DECISIONS.labels(action=action, reason=reason).inc()
+        # Holds are logged too, so every decision can be traced on DEBUG
+        p95 = 'n/a' if latency_p95 is None else f"{latency_p95:.3f}s"
+        logger.log(
+            logging.DEBUG if self.limit == previous_limit else logging.INFO,
+            f"Concurrency limit {previous_limit} -> {self.limit} ({reason}, "
+            f"loop lag {self._loop_lag:.3f}s, timeout rate {timeout_rate:.2f}, "
+            f"latency p95 {p95})",
+        )
+
+        self._reset_window()
+        return decision
+
+    async def _wake_waiters(self):
+        async with self._slot_freed:
+            self._slot_freed.notify(max(self.limit - self._active, 0))
+
+    async def run(self, interval: float):
+        """
+        Probes event loop lag and adjusts the limit every interval seconds
+        :param interval: seconds between adjustments
+        """
+        while True:
+            window_end = time.monotonic() + interval
+            while (now := time.monotonic()) < window_end:
+                delay = min(LAG_PROBE_INTERVAL, window_end - now)
+                await asyncio.sleep(delay)
+                self._loop_lag = max(
+                    self._loop_lag, time.monotonic() - now - delay
+                )
+
+            self.adjust()
+            await self._wake_waiters()
+
+    def snapshot(self) -> dict:
+        """
+        :return: current state and recent decisions, for observability
+        """
+        return {
+            'limit': self.limit,
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'active': self._active,
+            'waiting': self._waiting,
+            'latency_baseline': self._latency_baseline,
+            'decisions': [asdict(decision) for decision in self.decisions],
+        }
@@ -1,18 +1,68 @@
 import logging
+from typing import Awaitable, Callable
 
 import asyncpg
 from asyncpg import Pool, Connection
 
 from mservice import settings
+from mservice.metrics import registry
 
 
 logger = logging.getLogger(__name__)
 
+POOL_SIZE = registry.gauge(
+    'mservice_db_pool_size', 'Open connections of the DB pool'
+)
+POOL_MAX_SIZE = registry.gauge(
+    'mservice_db_pool_max_size', 'Max connections of the DB pool'
+)
+POOL_IN_USE = registry.gauge(
+    'mservice_db_pool_in_use', 'Acquired connections of the DB pool'
+)
 
-async def create_pool() -> Pool:
-    logger.info("Creating database connection pool")
+
+async def create_pool(
+        min_size: int = 10,
+        max_size: int = 10,
+        init: Callable[[Connection], Awaitable[None]] | None = None,
+        max_inactive_connection_lifetime: float = 300.0,
+) -> Pool:
+    """
+    :param min_size: connections opened right away and kept open
+    :param max_size: max amount of connections
+    :param init: [optional] called for every new connection
+    :param max_inactive_connection_lifetime: seconds after which idle
+    connections are closed, 0 - never
+    :return: created pool
+    """
+    logger.info(
+        f"Creating database connection pool ({min_size}-{max_size} connections)"
+    )
     return await asyncpg.create_pool(
-        dsn=settings.DB_CONNECTION_STRING
+        dsn=settings.DB_CONNECTION_STRING,
+        min_size=min_size,
+        max_size=max_size,
+        init=init,
+        max_inactive_connection_lifetime=max_inactive_connection_lifetime,
+    )
+
+
+def observe_pool(pool: Pool | None):
+    """
+    Reports size and usage of the pool in the metrics
+    :param pool: pool to report, None - stop reporting
+    """
+    if pool is None:
+        for gauge in (POOL_SIZE, POOL_MAX_SIZE, POOL_IN_USE):
+            gauge.set_function(None)
+        return
+
+    # Bound to a local, so the function keeps the pool which isn't None
+    observed = pool
+    POOL_SIZE.set_function(observed.get_size)
+    POOL_MAX_SIZE.set_function(observed.get_max_size)
+    POOL_IN_USE.set_function(
+        lambda: observed.get_size() - observed.get_idle_size()
     )
 
 
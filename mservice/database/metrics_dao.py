@@ -0,0 +1,158 @@
+import math
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from asyncpg import Connection
+from pydantic import validate_call, NonNegativeInt
+
+from mservice.database.migration import LOG_OK_SQL, ROLLUPS
+from mservice.database.models import MetricsBucketModel
+from mservice.database.monitor_dao import DB_QUERY_DURATION
+
+RAW_SOURCE = 'monitor_log'
+
+# Bucket sizes to choose from, so buckets are aligned to readable boundaries
+BUCKET_STEPS = [
+    timedelta(seconds=seconds)
+    for seconds in (
+        10, 30, 60, 5 * 60, 15 * 60, 30 * 60, 3600, 3 * 3600, 6 * 3600,
+        12 * 3600, 24 * 3600, 7 * 24 * 3600, 30 * 24 * 3600,
+    )
+]
+
+
+def choose_bucket(
+        start: datetime,
+        end: datetime,
+        max_points: int,
+        requested: timedelta | None = None,
+) -> timedelta:
+    """
+    Chooses a bucket size for the range, so there are at most max_points
+    buckets. Requested bucket is used if it fits the budget, otherwise the
+    smallest fitting step is used.
+    :param start: start of the range
+    :param end: end of the range
+    :param max_points: max amount of buckets
+    :param requested: [optional] bucket size requested by the client
+    :return: bucket size
+    """
+    min_bucket = (end - start) / max_points
+    if requested is not None and requested >= min_bucket:
+        return requested
+
+    for step in BUCKET_STEPS:
+        if step >= min_bucket and (requested is None or step >= requested):
+            return step
+
+    # Ranges longer than the biggest step allows - round up to whole days
+    return timedelta(days=math.ceil(min_bucket / timedelta(days=1)))
+
+
+def choose_source(bucket: timedelta) -> str:
+    """
+    Chooses the biggest rollup which buckets fit into the bucket evenly,
+    raw data if there is none
+    :param bucket: bucket size
+    :return: table or view name
+    """
+    rollups = sorted(
+        ROLLUPS.items(), key=lambda rollup: rollup[1][0], reverse=True
+    )
+    for name, (rollup_bucket, *_) in rollups:
+        if bucket % rollup_bucket == timedelta(0):
+            return name
+
+    return RAW_SOURCE
+
+
+@dataclass
+class MetricsDao:
+    """
+    DAO for reading aggregated scan results of monitors. Buckets which are
+    multiples of a rollup bucket are read from the rollup, smaller ones
+    from raw data.
+    """
+
+    # Relies on the (monitor_id, ts) index, so only rows of the requested
+    # monitor and range are read. Bucket is $4
+    SELECT_RAW_BUCKETS = f"""
+        SELECT
+            time_bucket($4::interval, ts) AS ts,
+            COUNT(*) AS checks,
+            AVG(({LOG_OK_SQL} AND http_status < 400)::int)::float8
+                AS uptime_ratio,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY response_time_ms)
+                FILTER (WHERE {LOG_OK_SQL}) AS response_time_p50_ms,
+            percentile_cont(0.95) WITHIN GROUP (ORDER BY response_time_ms)
+                FILTER (WHERE {LOG_OK_SQL}) AS response_time_p95_ms,
+            MAX(response_time_ms) FILTER (WHERE {LOG_OK_SQL})
+                AS response_time_max_ms,
+            COUNT(*) FILTER (WHERE NOT {LOG_OK_SQL}) AS errors,
+            AVG(regexp_found::int) FILTER (WHERE {LOG_OK_SQL})::float8
+                AS regexp_hit_ratio
+        FROM monitor_log
+            WHERE monitor_id = $1 AND ts >= $2 AND ts < $3
+        GROUP BY 1
+        ORDER BY 1
+    """
+
+    # Counters of rollups are summed up, percentiles are approximated by
+    # averages of rollup percentiles weighted by the amount of checks
+    SELECT_ROLLUP_BUCKETS = {
+        name: f"""
+            SELECT
+                time_bucket($4::interval, bucket) AS ts,
+                SUM(checks)::bigint AS checks,
+                SUM(up_checks)::float8 / SUM(checks) AS uptime_ratio,
+                SUM(response_time_p50_ms * ok_checks)
+                    / NULLIF(SUM(ok_checks), 0) AS response_time_p50_ms,
+                SUM(response_time_p95_ms * ok_checks)
+                    / NULLIF(SUM(ok_checks), 0) AS response_time_p95_ms,
+                MAX(response_time_max_ms) AS response_time_max_ms,
+                SUM(errors)::bigint AS errors,
+                SUM(regexp_hits)::float8 / NULLIF(SUM(ok_checks), 0)
+                    AS regexp_hit_ratio
+            FROM {name}
+                WHERE
+                    monitor_id = $1
+                    AND bucket >= time_bucket($4::interval, $2::timestamptz)
+                    AND bucket < $3
+            GROUP BY 1
+            ORDER BY 1
+        """
+        for name in ROLLUPS
+    }
+
+    connection: Connection
+
+    @DB_QUERY_DURATION.time(method='select_buckets')
+    @validate_call
+    async def select_buckets(
+            self,
+            monitor_id: NonNegativeInt,
+            start: datetime,
+            end: datetime,
+            bucket: timedelta,
+    ) -> list[MetricsBucketModel]:
+        """
+        Aggregates scan results of a monitor by time buckets. Reads from
+        a rollup if the bucket allows it (see choose_source), such buckets are
+        aligned to whole buckets.
+        :param monitor_id: monitor to read results of
+        :param start: start of the range, inclusive
+        :param end: end of the range, exclusive
+        :param bucket: bucket size
+        :return: aggregated buckets, empty buckets are skipped
+        """
+        source = choose_source(bucket)
+        query = (
+            self.SELECT_RAW_BUCKETS
+            if source == RAW_SOURCE
+            else self.SELECT_ROLLUP_BUCKETS[source]
+        )
+        rows = await self.connection.fetch(
+            query, monitor_id, start, end, bucket
+        )
+
+        return [MetricsBucketModel(**row) for row in rows]
@@ -1,10 +1,252 @@
 import logging
+from datetime import timedelta
 
 from asyncpg import Connection
 
+from mservice import settings
+
 logger = logging.getLogger(__name__)
 
 
+# Host of a monitor URL column. Listing by host filters by the same
+# expression, so it's served by the monitors_host_index
+URL_HOST_SQL = r"substring({url} from '^[^:]+://(?:[^@/]*@)?(\[[^]]*\]|[^/:?#]+)')"
+
+# monitor_log row without an error. Failures are coded by error_code, the
+# error text is only set in results saved before codes were introduced
+LOG_OK_SQL = "(error is null and error_code is null)"
+
+
+def _interval(value: timedelta) -> str:
+    """
+    :return: SQL interval literal of the value
+    """
+    return f"interval '{round(value.total_seconds())} seconds'"
+
+
+# Version of the rollup definition. Rollups are read through plain views
+# named after them, the continuous aggregates have the version suffix.
+# Changing the definition needs a new version: aggregates can't be altered
+ROLLUP_VERSION = 2
+
+# Columns of rollups, the same in all the versions
+ROLLUP_COLUMNS = (
+    "monitor_id, bucket, checks, up_checks, ok_checks, errors, regexp_hits, "
+    "response_time_p50_ms, response_time_p95_ms, response_time_max_ms"
+)
+
+
+def _rollup_aggregate(name: str, version: int = ROLLUP_VERSION) -> str:
+    """
+    :param name: rollup name
+    :param version: definition version
+    :return: name of the continuous aggregate of the rollup
+    """
+    return f"{name}_v{version}"
+
+
+def _rollup_view(name: str, bucket: timedelta) -> str:
+    """
+    Continuous aggregate of monitor_log. Keeps counters which can be summed
+    up into bigger buckets. Percentiles are exact for the rollup bucket only.
+    Buckets which aren't materialized yet are computed from raw data on read.
+    :param name: rollup name
+    :param bucket: bucket size
+    :return: statement creating the aggregate
+    """
+    return f"""
+    create materialized view if not exists {_rollup_aggregate(name)}
+    with (timescaledb.continuous, timescaledb.materialized_only = false) as
+    select
+        monitor_id,
+        time_bucket({_interval(bucket)}, ts) as bucket,
+        count(*) as checks,
+        count(*) filter (where {LOG_OK_SQL} and http_status < 400)
+            as up_checks,
+        count(*) filter (where {LOG_OK_SQL}) as ok_checks,
+        count(*) filter (where not {LOG_OK_SQL}) as errors,
+        count(*) filter (where {LOG_OK_SQL} and regexp_found)
+            as regexp_hits,
+        percentile_cont(0.5) within group (order by response_time_ms)
+            filter (where {LOG_OK_SQL}) as response_time_p50_ms,
+        percentile_cont(0.95) within group (order by response_time_ms)
+            filter (where {LOG_OK_SQL}) as response_time_p95_ms,
+        max(response_time_ms) filter (where {LOG_OK_SQL})
+            as response_time_max_ms
+    from monitor_log
+    group by monitor_id, bucket
+    with no data;
+    """
+
+
+# Error details are pruned this long after the raw data retention, so IDs
+# cached by workers (settings.ERROR_DETAIL_CACHE_TTL) and chunks which aren't
+# dropped yet never reference pruned ones
+ERROR_DETAIL_PRUNE_MARGIN = timedelta(days=1)
+
+# Rollups of monitor_log with their bucket size and refresh policy: start
+# and end offsets of the refreshed window and the refresh interval
+ROLLUPS = {
+    'monitor_log_hourly': (
+        timedelta(hours=1),
+        timedelta(hours=3),
+        timedelta(hours=1),
+        timedelta(minutes=30),
+    ),
+    'monitor_log_daily': (
+        timedelta(days=1),
+        timedelta(days=3),
+        timedelta(days=1),
+        timedelta(hours=1),
+    ),
+}
+
+# Idempotent statements applied on top of the initial schema, so already
+# deployed databases get the new columns and indexes as well
+SCHEMA_UPGRADES = [
+    """
+    alter table monitors
+        add column if not exists lease_owner text,
+        add column if not exists lease_expires timestamp with time zone;
+    """,
+    """
+    create index if not exists monitors_claim_index
+        on monitors (next_sync) where active;
+    """,
+    """
+    create index if not exists monitors_url_index
+        on monitors (url) where active;
+    """,
+    """
+    alter table monitor_log
+        add column if not exists from_cache boolean default false not null;
+    """,
+    """
+    alter table monitors
+        add column if not exists host_max_concurrency integer,
+        add column if not exists host_rate_limit double precision;
+    """,
+    f"""
+    create index if not exists monitors_host_index
+        on monitors (({URL_HOST_SQL.format(url='url')}), id);
+    """,
+    """
+    create index if not exists monitors_url_prefix_index
+        on monitors (url text_pattern_ops);
+    """,
+    """
+    alter table monitor_log
+        add column if not exists queue_time_ms integer default 0 not null;
+    """,
+    # Latest result of every monitor, updated in place on every scan. Free
+    # space is left in pages, so updates stay HOT and don't touch the index
+    """
+    create table if not exists monitor_status
+    (
+        monitor_id integer not null
+            constraint monitor_status_pk primary key
+            constraint monitor_status_monitors_fk references monitors
+                on delete cascade,
+        last_ts timestamptz not null,
+        up boolean not null,
+        http_status integer not null,
+        response_time_ms integer not null,
+        regexp_found boolean not null,
+        error text,
+        consecutive_failures integer not null,
+        last_change timestamptz not null
+    ) with (fillfactor = 70);
+    """,
+    # Request phases are only collected with HTTP_TIMINGS, so nullable.
+    # Nullable columns without defaults can be added to compressed chunks
+    """
+    alter table monitor_log
+        add column if not exists dns_ms integer,
+        add column if not exists connect_ms integer,
+        add column if not exists tls_ms integer,
+        add column if not exists ttfb_ms integer,
+        add column if not exists download_ms integer,
+        add column if not exists response_size bigint;
+    """,
+    # Failures are stored as a code and a reference to their deduplicated
+    # text, so an outage doesn't write the same text for every scan
+    """
+    create table if not exists error_details
+    (
+        id serial constraint error_details_pk primary key,
+        detail text not null constraint error_details_detail_key unique
+    );
+    """,
+    """
+    alter table error_details
+        add column if not exists last_seen timestamptz
+            default CURRENT_TIMESTAMP not null;
+    """,
+    # Details which weren't seen for longer than the raw data retention are
+    # only referenced by dropped chunks, unless a monitor status still has
+    # one. Called by a TimescaleDB job, see _apply_data_policies
+    """
+    create or replace procedure prune_error_details(
+        job_id integer, config jsonb
+    )
+    language plpgsql as $$
+    begin
+        delete from error_details
+            where last_seen < CURRENT_TIMESTAMP
+                    - (config->>'unseen_for')::interval
+                and id not in (
+                    select error_detail_id from monitor_status
+                        where error_detail_id is not null
+                );
+    end
+    $$;
+    """,
+    """
+    alter table monitor_log
+        add column if not exists error_code smallint,
+        add column if not exists error_detail_id integer;
+    """,
+    """
+    alter table monitor_status
+        add column if not exists error_code smallint,
+        add column if not exists error_detail_id integer;
+    """,
+    """
+    create index if not exists monitor_log_monitor_ts_index
+        on monitor_log (monitor_id, ts desc);
+    """,
+    """
+    do $$
+    begin
+        if not exists (
+            select 1 from timescaledb_information.hypertables
+                where hypertable_name = 'monitor_log' and compression_enabled
+        ) then
+            alter table monitor_log set (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'monitor_id',
+                timescaledb.compress_orderby = 'ts desc'
+            );
+        end if;
+    end
+    $$;
+    """,
+    *[_rollup_view(name, bucket) for name, (bucket, *_) in ROLLUPS.items()],
+    *[
+        f"""
+        select add_continuous_aggregate_policy(
+            '{_rollup_aggregate(name)}',
+            start_offset => {_interval(start_offset)},
+            end_offset => {_interval(end_offset)},
+            schedule_interval => {_interval(schedule)},
+            if_not_exists => true
+        );
+        """
+        for name, (_, start_offset, end_offset, schedule) in ROLLUPS.items()
+    ],
+]
+
+
 async def create_all_tables(conn: Connection):
     """
     Creates all the tables which are needed for program execution
@@ -22,50 +264,202 @@ async def create_all_tables(conn: Connection):
             ) AS table_existence;
         """)
         if result:
-            logger.debug("Skipping migration - tables are already there")
-            return
+            logger.debug("Skipping initial migration - tables are already there")
+        else:
+            await _create_initial_schema(conn)
 
-        logger.debug("Executing migration")
+        await _freeze_unversioned_rollups(conn)
+        new_aggregates = await _missing_aggregates(
+            conn, [_rollup_aggregate(name) for name in ROLLUPS]
+        )
 
-        await conn.execute("""
-            CREATE EXTENSION IF NOT EXISTS timescaledb CASCADE;
-        """)
+        logger.debug("Applying schema upgrades")
+        for statement in SCHEMA_UPGRADES:
+            await conn.execute(statement)
 
-        await conn.execute("""
-        create table if not exists monitors
-        (
-            id serial constraint monitors_pk primary key,
-            url text not null,
-            regexp text,
-            active boolean default true not null,
-            sync_interval interval default '00:01:00'::interval not null,
-            next_sync timestamp with time zone
-                default CURRENT_TIMESTAMP not null
-        );
-        """)
+        await _create_rollup_views(conn)
+        await _apply_data_policies(conn)
 
-        await conn.execute("""
-        create index if not exists monitors_next_sync_index
-            on monitors (next_sync);
-        """)
+    # New aggregates get all the raw data, their policies only refresh the
+    # latest buckets. Refreshing can't be done in a transaction
+    for name in new_aggregates:
+        logger.info(f"Building {name} from raw data")
+        await conn.execute(
+            f"call refresh_continuous_aggregate('{name}', NULL, NULL)"
+        )
 
-        await conn.execute("""
-        create table if not exists monitor_log
-        (
-            ts timestamptz not null,
-            monitor_id integer not null
-                constraint monitor_log_monitors_scan_fk references monitors,
-            http_status integer not null,
-            regexp_found boolean not null,
-            response_time_ms integer not null,
-            error text
-        );
-        """)
 
-        await conn.execute("""
-            SELECT create_hypertable(
-                'monitor_log',
-                'ts',
-                 chunk_time_interval => interval '1 day'
-             )
-        """)
+async def _missing_aggregates(conn: Connection, names: list[str]) -> list[str]:
+    """
+    :param conn: connection to the DB
+    :param names: continuous aggregates to look for
+    :return: the given aggregates which don't exist
+    """
+    existing = await conn.fetchval(
+        """
+        select coalesce(array_agg(view_name::text), '{}')
+            from timescaledb_information.continuous_aggregates
+            where view_name = any($1::text[])
+        """,
+        names,
+    )
+
+    return [name for name in names if name not in existing]
+
+
+async def _freeze_unversioned_rollups(conn: Connection):
+    """
+    Rollups created before they were versioned are continuous aggregates
+    named after the rollup, and count coded failures as successful checks.
+    They are renamed to version 1 and kept with their buckets as they are,
+    so the history older than the raw data retention isn't lost. Their
+    refresh policies are removed.
+    :param conn: connection to the DB
+    """
+    names = set(ROLLUPS) - set(await _missing_aggregates(conn, list(ROLLUPS)))
+    for name in names:
+        logger.warning(f"Freezing unversioned rollup {name}")
+        await conn.execute(
+            f"select remove_continuous_aggregate_policy('{name}', if_exists => true)"
+        )
+        await conn.execute(
+            f"alter materialized view {name} "
+            f"set (timescaledb.materialized_only = true)"
+        )
+        await conn.execute(
+            f"alter materialized view {name} rename to {_rollup_aggregate(name, 1)}"
+        )
+
+
+async def _create_rollup_views(conn: Connection):
+    """
+    (Re)creates the views rollups are read through. Frozen aggregates of
+    older versions are only read for buckets older than the first bucket of
+    the current version, which has all the raw data available when it was
+    created.
+    :param conn: connection to the DB
+    """
+    for name in ROLLUPS:
+        current = _rollup_aggregate(name)
+        older = [
+            _rollup_aggregate(name, version)
+            for version in range(1, ROLLUP_VERSION)
+        ]
+        missing = await _missing_aggregates(conn, older)
+        sources = [f"select {ROLLUP_COLUMNS} from {current}"] + [
+            f"""
+            select {ROLLUP_COLUMNS} from {aggregate}
+                where bucket < (
+                    select coalesce(min(bucket), 'infinity') from {current}
+                )
+            """
+            for aggregate in older
+            if aggregate not in missing
+        ]
+        await conn.execute(
+            f"create or replace view {name} as {' union all '.join(sources)}"
+        )
+
+
+async def _apply_data_policies(conn: Connection):
+    """
+    (Re)creates compression and retention policies of raw monitor_log data
+    and the pruning job of error details, so changed settings are applied
+    on the next migration
+    :param conn: connection to the DB
+    """
+    logger.debug("Applying compression and retention policies")
+
+    await conn.execute(
+        "select remove_compression_policy('monitor_log', if_exists => true)"
+    )
+    if settings.LOG_COMPRESS_AFTER_DAYS > 0:
+        await conn.execute(
+            "select add_compression_policy('monitor_log', $1::interval)",
+            timedelta(days=settings.LOG_COMPRESS_AFTER_DAYS),
+        )
+
+    await conn.execute(
+        "select remove_retention_policy('monitor_log', if_exists => true)"
+    )
+    if settings.LOG_RETENTION_DAYS > 0:
+        retention = timedelta(days=settings.LOG_RETENTION_DAYS)
+        if any(retention <= start for _, start, _, _ in ROLLUPS.values()):
+            logger.warning(
+                "Raw data is dropped before rollups are refreshed - "
+                "the latest rollup buckets can miss results"
+            )
+        await conn.execute(
+            "select add_retention_policy('monitor_log', $1::interval)",
+            retention,
+        )
+
+    await conn.execute(
+        """
+        select delete_job(job_id) from timescaledb_information.jobs
+            where proc_name = 'prune_error_details'
+        """
+    )
+    if settings.LOG_RETENTION_DAYS > 0:
+        await conn.execute(
+            """
+            select add_job(
+                'prune_error_details',
+                interval '1 day',
+                config => jsonb_build_object('unseen_for', $1::interval)
+            )
+            """,
+            timedelta(days=settings.LOG_RETENTION_DAYS)
+            + ERROR_DETAIL_PRUNE_MARGIN,
+        )
+
+
+async def _create_initial_schema(conn: Connection):
+    """
+    Creates tables and the hypertable from scratch
+    :param conn: connection to the DB
+    """
+    logger.debug("Executing migration")
+
+    await conn.execute("""
+        CREATE EXTENSION IF NOT EXISTS timescaledb CASCADE;
+    """)
+
+    await conn.execute("""
+    create table if not exists monitors
+    (
+        id serial constraint monitors_pk primary key,
+        url text not null,
+        regexp text,
+        active boolean default true not null,
+        sync_interval interval default '00:01:00'::interval not null,
+        next_sync timestamp with time zone
+            default CURRENT_TIMESTAMP not null
+    );
+    """)
+
+    await conn.execute("""
+    create index if not exists monitors_next_sync_index
+        on monitors (next_sync);
+    """)
+
+    await conn.execute("""
+    create table if not exists monitor_log
+    (
+        ts timestamptz not null,
+        monitor_id integer not null
+            constraint monitor_log_monitors_scan_fk references monitors,
+        http_status integer not null,
+        regexp_found boolean not null,
+        response_time_ms integer not null,
+        error text
+    );
+    """)
+
+    await conn.execute("""
+        SELECT create_hypertable(
+            'monitor_log',
+            'ts',
+             chunk_time_interval => interval '1 day'
+         )
+    """)
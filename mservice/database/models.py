@@ -1,14 +1,91 @@
+import dataclasses
 import datetime
+import re
 
 from pydantic import AnyUrl
 from pydantic.dataclasses import dataclass
 
+from mservice.schema.errors import ErrorCode
 
-@dataclass(frozen=True, slots=True)
+
+# Plain record, not validated: it's built from our own DB rows for every
+# claimed monitor (see MonitorDao._db_to_model)
+@dataclasses.dataclass(frozen=True, slots=True)
 class MonitorModel:
+    id: int
+    url: str
+    regexp: str | None
+    active: bool
+    sync_interval: datetime.timedelta
+    next_sync: datetime.datetime
+    # Per-monitor overrides of the per-host request limits
+    host_max_concurrency: int | None
+    host_rate_limit: float | None
+    pattern: re.Pattern | None
+
+
+@dataclass(frozen=True, slots=True)
+class NewMonitorModel:
+    url: AnyUrl
+    sync_interval: datetime.timedelta
+    regexp: str | None
+    host_max_concurrency: int | None
+    host_rate_limit: float | None
+
+
+@dataclass(frozen=True, slots=True)
+class LatestResultModel:
+    ts: datetime.datetime
+    http_status: int
+    response_time_ms: int
+    regexp_found: bool
+    # None if the check succeeded or was saved before codes were introduced
+    error_code: ErrorCode | None
+    error: str | None
+
+
+@dataclass(frozen=True, slots=True)
+class MonitorStatusModel:
+    monitor_id: int
+    # Time of the latest check
+    last_ts: datetime.datetime
+    # The latest check had no error and HTTP status below 400
+    up: bool
+    http_status: int
+    response_time_ms: int
+    regexp_found: bool
+    error_code: ErrorCode | None
+    error: str | None
+    # Failed checks since the last successful one
+    consecutive_failures: int
+    # Time of the check which changed up to its current value
+    last_change: datetime.datetime
+
+
+@dataclass(frozen=True, slots=True)
+class MonitorSummaryModel:
     id: int
     url: AnyUrl
     regexp: str | None
     active: bool
     sync_interval: datetime.timedelta
     next_sync: datetime.datetime
+    host_max_concurrency: int | None
+    host_rate_limit: float | None
+    # The latest scan result, if it was requested and there is one
+    latest: LatestResultModel | None
+
+
+@dataclass(frozen=True, slots=True)
+class MetricsBucketModel:
+    ts: datetime.datetime
+    checks: int
+    # Share of checks without errors and with HTTP status below 400
+    uptime_ratio: float
+    # Response times of successful checks, None if there are none
+    response_time_p50_ms: float | None
+    response_time_p95_ms: float | None
+    response_time_max_ms: int | None
+    errors: int
+    # Share of successful checks with the regexp found
+    regexp_hit_ratio: float | None
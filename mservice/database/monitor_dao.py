@@ -1,31 +1,286 @@
-import re
+import time
 from dataclasses import dataclass
 from datetime import timedelta
 
 from asyncpg import Connection
-from pydantic import validate_call, AnyUrl, NonNegativeInt, PositiveInt
+from pydantic import (
+    validate_call, AnyUrl, NonNegativeInt, PositiveFloat, PositiveInt
+)
 
-from mservice.database.models import MonitorModel
+from mservice import settings
+from mservice.settings import ReschedulePolicy
+from mservice.database.migration import URL_HOST_SQL
+from mservice.database.models import (
+    LatestResultModel,
+    MonitorModel,
+    MonitorStatusModel,
+    MonitorSummaryModel,
+    NewMonitorModel,
+)
+from mservice.metrics import registry
+from mservice.parser import compile_pattern
 from mservice.schema.metrics import SiteMetricSchema
 
 
+MONITOR_COLUMNS = """
+    id, url, regexp, active, sync_interval, next_sync,
+    host_max_concurrency, host_rate_limit
+"""
+
+# Columns of the latest scan result joined to the monitors listing from
+# monitor_status (aliased s) and error_details (aliased d)
+LATEST_COLUMNS = {
+    'ts': 's.last_ts',
+    'http_status': 's.http_status',
+    'response_time_ms': 's.response_time_ms',
+    'regexp_found': 's.regexp_found',
+    'error_code': 's.error_code',
+    # Text of results saved before codes were introduced is kept in place
+    'error': 'coalesce(d.detail, s.error)',
+}
+
+STATUS_COLUMNS = """
+    monitor_id, last_ts, up, http_status, response_time_ms, regexp_found,
+    error_code, error_detail_id, consecutive_failures, last_change
+"""
+
+# Columns of monitor_log written by the worker with their types
+_LOG_COLUMN_TYPES = {
+    'monitor_id': 'integer',
+    'ts': 'timestamptz',
+    'http_status': 'integer',
+    'response_time_ms': 'integer',
+    'regexp_found': 'boolean',
+    'error_code': 'smallint',
+    'error_detail_id': 'integer',
+    'from_cache': 'boolean',
+    'queue_time_ms': 'integer',
+    'dns_ms': 'integer',
+    'connect_ms': 'integer',
+    'tls_ms': 'integer',
+    'ttfb_ms': 'integer',
+    'download_ms': 'integer',
+    'response_size': 'bigint',
+}
+LOG_COLUMNS = tuple(_LOG_COLUMN_TYPES)
+
+DB_QUERY_DURATION = registry.histogram(
+    'mservice_db_query_duration_seconds',
+    'Duration of MonitorDao queries',
+    ('method',),
+)
+
+_INTERVAL_SEC = "EXTRACT(EPOCH FROM sync_interval)::float8"
+# Deterministic offset of every monitor inside of its interval, spread by the
+# golden ratio so consecutive IDs are as far from each other as possible
+_PHASE_SEC = f"({_INTERVAL_SEC} * mod(id * 0.6180339887498949, 1)::float8)"
+
+# Expressions for the next sync time of a scanned monitor:
+# - delay: interval after the scan, schedule drifts by the scan duration
+# - anchor: interval after the previous scheduled time, missed runs of
+#   a lagging worker are skipped instead of being caught up
+# - phase: the next slot of the monitor's own phase, which spreads monitors
+#   created at once evenly over their interval
+NEXT_SYNC: dict[str, str] = {
+    'delay': "CURRENT_TIMESTAMP + sync_interval",
+    'anchor': f"""
+        next_sync + sync_interval * GREATEST(
+            1,
+            CEIL(
+                EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - next_sync)::float8
+                / {_INTERVAL_SEC}
+            )
+        )
+    """,
+    'phase': f"""
+        to_timestamp(
+            (
+                FLOOR(
+                    (EXTRACT(EPOCH FROM CURRENT_TIMESTAMP)::float8 - {_PHASE_SEC})
+                    / {_INTERVAL_SEC}
+                ) + 1
+            ) * {_INTERVAL_SEC} + {_PHASE_SEC}
+        )
+    """,
+}
+
+
+# Scan results passed as arrays in LOG_COLUMNS order
+_NEW_LOG = f"""
+    unnest(
+        {', '.join(
+            f'${i}::{column_type}[]'
+            for i, column_type in enumerate(_LOG_COLUMN_TYPES.values(), 1)
+        )}
+    ) AS new_log({', '.join(LOG_COLUMNS)})
+"""
+
+
+# IDs of error_details by their text with the monotonic time they were
+# resolved at, oldest first. Details never change once inserted, but unused
+# ones are pruned, so the IDs expire after settings.ERROR_DETAIL_CACHE_TTL
+_error_detail_ids: dict[str, tuple[int, float]] = {}
+
+
 class WrongRegexException(Exception):
     pass
 
 
+def _upsert_status_query(source: str) -> str:
+    """
+    Builds the monitor_status upsert. Only the latest result of every monitor
+    in the source is applied, results older than the stored one (e.g. of an
+    expired lease) are skipped. Can be used as a CTE.
+    :param source: FROM item with LOG_COLUMNS up to error_detail_id
+    :return: query
+    """
+    return f"""
+        INSERT INTO
+            monitor_status ({STATUS_COLUMNS})
+        SELECT DISTINCT ON (monitor_id)
+            monitor_id,
+            ts,
+            error_code IS NULL AND http_status < 400,
+            http_status,
+            response_time_ms,
+            regexp_found,
+            error_code,
+            error_detail_id,
+            (error_code IS NOT NULL OR http_status >= 400)::integer,
+            ts
+        FROM {source}
+        ORDER BY monitor_id, ts DESC
+        ON CONFLICT (monitor_id) DO UPDATE SET
+            last_ts = EXCLUDED.last_ts,
+            up = EXCLUDED.up,
+            http_status = EXCLUDED.http_status,
+            response_time_ms = EXCLUDED.response_time_ms,
+            regexp_found = EXCLUDED.regexp_found,
+            error_code = EXCLUDED.error_code,
+            error_detail_id = EXCLUDED.error_detail_id,
+            error = NULL,
+            consecutive_failures = CASE
+                WHEN EXCLUDED.up THEN 0
+                ELSE monitor_status.consecutive_failures + 1
+            END,
+            last_change = CASE
+                WHEN EXCLUDED.up = monitor_status.up
+                    THEN monitor_status.last_change
+                ELSE EXCLUDED.last_ts
+            END
+        WHERE monitor_status.last_ts < EXCLUDED.last_ts
+    """
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _select_page_query(
+        conditions: list[str], limit: str, include_latest: bool
+) -> str:
+    """
+    Builds the monitors listing query. Pages are read by the primary key
+    from the cursor on, so their cost doesn't depend on the page depth.
+    :param conditions: SQL conditions on monitors (aliased m)
+    :param limit: parameter of the page size
+    :param include_latest: whether to join the latest scan result of every
+    monitor, which is one primary key lookup in monitor_status per monitor
+    :return: query
+    """
+    columns = [f'm.{column.strip()}' for column in MONITOR_COLUMNS.split(',')]
+    latest = ''
+    if include_latest:
+        columns += [
+            f'{column} AS latest_{name}'
+            for name, column in LATEST_COLUMNS.items()
+        ]
+        latest = """
+            LEFT JOIN monitor_status s ON s.monitor_id = m.id
+            LEFT JOIN error_details d ON d.id = s.error_detail_id
+        """
+
+    return f"""
+        SELECT {', '.join(columns)}
+            FROM monitors m
+            {latest}
+            WHERE {' AND '.join(conditions) or 'TRUE'}
+        ORDER BY m.id
+            LIMIT {limit}
+    """
+
+
 @dataclass
 class MonitorDao:
     """
-    DAO for working with monitors.
+    DAO for working with monitors. Arguments of the methods used by the API
+    are validated, the worker's hot path methods take trusted data as is.
     """
 
+    # The first sync is delayed by a random part ($4) of the interval
     INSERT = """
         INSERT INTO
-            monitors (url, regexp, sync_interval)
-            VALUES ($1, $2, $3)
+            monitors (
+                url,
+                regexp,
+                sync_interval,
+                next_sync,
+                host_max_concurrency,
+                host_rate_limit
+            )
+            VALUES (
+                $1, $2, $3,
+                CURRENT_TIMESTAMP + $3::interval * random() * $4::float8,
+                $5, $6
+            )
         RETURNING id
     """
 
+    ALLOCATE_IDS = """
+        SELECT nextval(pg_get_serial_sequence('monitors', 'id'))
+            FROM generate_series(1, $1)
+    """
+
+    # First syncs are spread evenly over a part ($8) of every interval in
+    # the order of the items, $7 is the amount of items
+    INSERT_MANY = """
+        INSERT INTO
+            monitors (
+                id,
+                url,
+                regexp,
+                sync_interval,
+                next_sync,
+                host_max_concurrency,
+                host_rate_limit
+            )
+        SELECT
+            id,
+            url,
+            regexp,
+            sync_interval,
+            CURRENT_TIMESTAMP
+                + sync_interval * ((ord - 1)::float8 / $7::float8 * $8::float8),
+            host_max_concurrency,
+            host_rate_limit
+        FROM unnest(
+            $1::integer[],
+            $2::text[],
+            $3::text[],
+            $4::interval[],
+            $5::integer[],
+            $6::float8[]
+        ) WITH ORDINALITY AS t(
+            id,
+            url,
+            regexp,
+            sync_interval,
+            host_max_concurrency,
+            host_rate_limit,
+            ord
+        )
+    """
+
     DELETE = """
         UPDATE monitors SET
             active = FALSE
@@ -33,63 +288,196 @@ class MonitorDao:
         RETURNING id
     """
 
-    SELECT_BY_ID = """
-        SELECT * FROM monitors
+    SELECT_BY_ID = f"""
+        SELECT {MONITOR_COLUMNS} FROM monitors
             WHERE id = $1 AND active
     """
 
-    SELECT_UNLOCKED = """
-        SELECT * FROM monitors
+    SELECT_UNLOCKED = f"""
+        SELECT {MONITOR_COLUMNS} FROM monitors
             WHERE
                 next_sync <= CURRENT_TIMESTAMP
                 AND active
+                AND (lease_expires IS NULL OR lease_expires < CURRENT_TIMESTAMP)
         ORDER BY next_sync
             LIMIT $1
         FOR UPDATE
         SKIP LOCKED
     """
 
-    RESCHEDULE = """
+    # Besides due monitors also claims monitors of the same URLs which are
+    # due within a window ($4), so they can share one request
+    CLAIM = f"""
+        WITH due AS (
+            SELECT id, url FROM monitors
+                WHERE
+                    next_sync <= CURRENT_TIMESTAMP
+                    AND active
+                    AND (
+                        lease_expires IS NULL
+                        OR lease_expires < CURRENT_TIMESTAMP
+                    )
+            ORDER BY next_sync
+                LIMIT $1
+            FOR UPDATE
+            SKIP LOCKED
+        ), coalesced AS (
+            SELECT id FROM monitors
+                WHERE
+                    next_sync <= CURRENT_TIMESTAMP + $4::interval
+                    AND url IN (SELECT url FROM due)
+                    AND active
+                    AND (
+                        lease_expires IS NULL
+                        OR lease_expires < CURRENT_TIMESTAMP
+                    )
+            FOR UPDATE
+            SKIP LOCKED
+        )
         UPDATE monitors SET
-            next_sync = CURRENT_TIMESTAMP + sync_interval
-        WHERE id = any($1::integer[])
-            AND active
-        RETURNING *
+            lease_owner = $2,
+            lease_expires = CURRENT_TIMESTAMP + $3::interval
+        WHERE id IN (SELECT id FROM due UNION SELECT id FROM coalesced)
+        RETURNING {MONITOR_COLUMNS}
     """
 
+    RESCHEDULE = {
+        policy: f"""
+            UPDATE monitors SET
+                next_sync = {next_sync}
+            WHERE id = any($1::integer[])
+                AND active
+            RETURNING {MONITOR_COLUMNS}
+        """
+        for policy, next_sync in NEXT_SYNC.items()
+    }
+
+    RELEASE = {
+        policy: f"""
+            UPDATE monitors SET
+                next_sync = {next_sync},
+                lease_owner = NULL,
+                lease_expires = NULL
+            WHERE id = any($1::integer[])
+                AND lease_owner = $2
+            RETURNING {MONITOR_COLUMNS}
+        """
+        for policy, next_sync in NEXT_SYNC.items()
+    }
+
     COUNT_ACTIVE = """
         SELECT COUNT(*) FROM monitors WHERE active
     """
 
-    INSERT_LOG = """
+    INSERT_LOG = f"""
         INSERT INTO
-            monitor_log (
-                monitor_id, ts, http_status, response_time_ms, regexp_found, error
-            )
-            VALUES ($1, $2, $3, $4, $5, $6)
-        RETURNING monitor_id
+            monitor_log ({', '.join(LOG_COLUMNS)})
+            VALUES ({', '.join(f'${i}' for i in range(1, len(LOG_COLUMNS) + 1))})
+    """
+
+    UPSERT_STATUS = _upsert_status_query(_NEW_LOG)
+
+    # Writes results and updates the status in one statement. The status is
+    # upserted in a CTE, so the hypertable insert stays the top-level one
+    INSERT_LOG_AND_STATUS = f"""
+        WITH status AS ({_upsert_status_query(_NEW_LOG)})
+        INSERT INTO
+            monitor_log ({', '.join(LOG_COLUMNS)})
+        SELECT {', '.join(LOG_COLUMNS)} FROM {_NEW_LOG}
+    """
+
+    SELECT_STATUS = """
+        SELECT
+            s.monitor_id,
+            s.last_ts,
+            s.up,
+            s.http_status,
+            s.response_time_ms,
+            s.regexp_found,
+            s.error_code,
+            coalesce(d.detail, s.error) AS error,
+            s.consecutive_failures,
+            s.last_change
+        FROM monitor_status s
+            LEFT JOIN error_details d ON d.id = s.error_detail_id
+            WHERE s.monitor_id = any($1::integer[])
+        ORDER BY s.monitor_id
+    """
+
+    # Inserts new details and returns IDs of all the given ones. Details
+    # inserted by a concurrent transaction aren't visible to the statement
+    # and are missing from the result. Existing details are locked in ID
+    # order, so pruning can't delete them before the transaction ends, and
+    # their last_seen is updated if it's older than $2
+    RESOLVE_ERROR_DETAILS = """
+        WITH new_details AS (
+            INSERT INTO error_details (detail)
+            SELECT unnest($1::text[])
+            ON CONFLICT (detail) DO NOTHING
+            RETURNING id, detail
+        ), seen_details AS (
+            SELECT id, detail, last_seen FROM error_details
+                WHERE detail = any($1::text[])
+                ORDER BY id
+                FOR UPDATE
+        ), touched AS (
+            UPDATE error_details SET last_seen = CURRENT_TIMESTAMP
+                FROM seen_details
+                WHERE error_details.id = seen_details.id
+                    AND seen_details.last_seen < CURRENT_TIMESTAMP - $2::interval
+        )
+        SELECT id, detail, TRUE AS inserted FROM new_details
+        UNION ALL
+        SELECT id, detail, FALSE FROM seen_details
     """
 
     connection: Connection
 
     @staticmethod
     def _db_to_model(row) -> MonitorModel:
-        return MonitorModel(**row)
+        """
+        Maps a row of MONITOR_COLUMNS without validation, it's our own data
+        """
+        regexp = row['regexp']
+        return MonitorModel(
+            id=row['id'],
+            url=row['url'],
+            regexp=regexp,
+            active=row['active'],
+            sync_interval=row['sync_interval'],
+            next_sync=row['next_sync'],
+            host_max_concurrency=row['host_max_concurrency'],
+            host_rate_limit=row['host_rate_limit'],
+            pattern=None if regexp is None else compile_pattern(regexp),
+        )
 
+    @DB_QUERY_DURATION.time(method='create')
     @validate_call
     async def create(
-            self, url: AnyUrl, interval: timedelta, regexp: str | None
+            self,
+            url: AnyUrl,
+            interval: timedelta,
+            regexp: str | None,
+            initial_jitter: float = settings.INITIAL_SYNC_JITTER,
+            host_max_concurrency: PositiveInt | None = None,
+            host_rate_limit: PositiveFloat | None = None,
     ) -> int:
         """
         Creates one monitor
         :param url: URL for monitoring
         :param interval: Interval for executing checks
         :param regexp: [optional] regular expression to check in response body
+        :param initial_jitter: max part of the interval to delay the first sync
+        by, 0 - sync immediately
+        :param host_max_concurrency: [optional] max simultaneous requests
+        to the monitor's host
+        :param host_rate_limit: [optional] max requests per second to the
+        monitor's host
         :return: ID of the created monitor
         """
         if regexp is not None:
             try:
-                re.compile(regexp)
+                compile_pattern(regexp)
             except Exception as e:
                 raise WrongRegexException(
                     f"Failed to compile RegExp: {regexp}"
@@ -97,11 +485,144 @@ class MonitorDao:
 
         id = await self.connection.fetchval(
             self.INSERT,
-            str(url), regexp, interval
+            str(url), regexp, interval, initial_jitter,
+            host_max_concurrency, host_rate_limit
         )
 
         return id
 
+    @DB_QUERY_DURATION.time(method='create_many')
+    @validate_call
+    async def create_many(
+            self,
+            items: list[NewMonitorModel],
+            spread: float = settings.BULK_SYNC_SPREAD,
+    ) -> list[int]:
+        """
+        Creates monitors with one set-based statement. IDs are allocated
+        beforehand, so they match the items order.
+        :param items: monitors to create
+        :param spread: part of the interval to spread the first syncs over,
+        0 - sync all immediately
+        :return: IDs of the created monitors in the items order
+        """
+        for item in items:
+            if item.regexp is not None:
+                try:
+                    compile_pattern(item.regexp)
+                except Exception as e:
+                    raise WrongRegexException(
+                        f"Failed to compile RegExp: {item.regexp}"
+                    ) from e
+
+        if len(items) == 0:
+            return []
+
+        async with self.connection.transaction():
+            ids = [
+                row[0]
+                for row in await self.connection.fetch(
+                    self.ALLOCATE_IDS, len(items)
+                )
+            ]
+            await self.connection.execute(
+                self.INSERT_MANY,
+                ids,
+                [str(item.url) for item in items],
+                [item.regexp for item in items],
+                [item.sync_interval for item in items],
+                [item.host_max_concurrency for item in items],
+                [item.host_rate_limit for item in items],
+                len(items),
+                spread,
+            )
+
+        return ids
+
+    @DB_QUERY_DURATION.time(method='get')
+    @validate_call
+    async def get(self, id: NonNegativeInt) -> MonitorModel | None:
+        """
+        Gets one active monitor
+        :param id: monitor ID
+        :return: found monitor or None
+        """
+        row = await self.connection.fetchrow(self.SELECT_BY_ID, id)
+
+        return None if row is None else self._db_to_model(row)
+
+    @staticmethod
+    def _row_to_summary(row) -> MonitorSummaryModel:
+        latest = None
+        if row.get('latest_ts') is not None:
+            latest = LatestResultModel(
+                **{name: row[f'latest_{name}'] for name in LATEST_COLUMNS}
+            )
+
+        return MonitorSummaryModel(
+            **{key: row[key] for key in row.keys() if not key.startswith('latest_')},
+            latest=latest,
+        )
+
+    @DB_QUERY_DURATION.time(method='select_page')
+    @validate_call
+    async def select_page(
+            self,
+            limit: PositiveInt,
+            after_id: NonNegativeInt | None = None,
+            active: bool | None = None,
+            host: str | None = None,
+            url_prefix: str | None = None,
+            overdue: bool | None = None,
+            overdue_after: timedelta = timedelta(
+                seconds=settings.MONITOR_OVERDUE_AFTER
+            ),
+            include_latest: bool = False,
+    ) -> list[MonitorSummaryModel]:
+        """
+        Lists monitors ordered by ID with keyset pagination: the next page
+        starts after the last ID of the previous one.
+        :param limit: max amount of monitors to return
+        :param after_id: [optional] return monitors with bigger IDs only
+        :param active: [optional] return active or inactive monitors only
+        :param host: [optional] return monitors of this URL host only
+        :param url_prefix: [optional] return monitors which URLs start with it
+        :param overdue: [optional] return only monitors which are (or aren't)
+        active and not synced for longer than overdue_after after next_sync
+        :param overdue_after: how late a sync should be to be overdue
+        :param include_latest: whether to add the latest scan result
+        :return: found monitors
+        """
+        conditions: list[str] = []
+        args: list = []
+
+        def arg(value) -> str:
+            args.append(value)
+            return f'${len(args)}'
+
+        if after_id is not None:
+            conditions.append(f'm.id > {arg(after_id)}')
+        if active is not None:
+            conditions.append('m.active' if active else 'NOT m.active')
+        if host is not None:
+            conditions.append(
+                f"{URL_HOST_SQL.format(url='m.url')} = {arg(host.lower())}"
+            )
+        if url_prefix is not None:
+            conditions.append(f'm.url LIKE {arg(_escape_like(url_prefix) + "%")}')
+        if overdue is not None:
+            late = (
+                f'm.active AND m.next_sync < '
+                f'CURRENT_TIMESTAMP - {arg(overdue_after)}::interval'
+            )
+            conditions.append(f'({late})' if overdue else f'NOT ({late})')
+
+        query = _select_page_query(conditions, arg(limit), include_latest)
+        rows = await self.connection.fetch(query, *args)
+
+        return [self._row_to_summary(row) for row in rows]
+
+    @DB_QUERY_DURATION.time(method='remove')
     @validate_call
     async def remove(
             self, id: NonNegativeInt
@@ -117,21 +638,24 @@ class MonitorDao:
 
         return removed_id is not None
 
-    @validate_call
+    @DB_QUERY_DURATION.time(method='reschedule')
     async def reschedule(
-            self, ids: list[NonNegativeInt]
+            self,
+            ids: list[NonNegativeInt],
+            policy: ReschedulePolicy = settings.RESCHEDULE_POLICY,
     ):
         """
         Reschedules monitor - bumps up the next_sync time by interval amount.
         :param ids: monitor to reschedule
+        :param policy: how to calculate the next sync time (see NEXT_SYNC)
         """
         rescheduled_list = await self.connection.fetch(
-            self.RESCHEDULE, ids
+            self.RESCHEDULE[policy], ids
         )
 
         return [self._db_to_model(row) for row in rescheduled_list]
 
-    @validate_call
+    @DB_QUERY_DURATION.time(method='select_unlocked')
     async def select_unlocked(
             self, limit: PositiveInt
     ) -> list[MonitorModel]:
@@ -147,6 +671,53 @@ class MonitorDao:
 
         return [self._db_to_model(row) for row in unlocked_list]
 
+    @DB_QUERY_DURATION.time(method='claim')
+    async def claim(
+            self,
+            limit: PositiveInt,
+            owner: str,
+            lease: timedelta,
+            coalesce_window: timedelta = timedelta(0),
+    ) -> list[MonitorModel]:
+        """
+        Claims due monitors by writing a lease on them. Runs as a single
+        statement, so row locks are only held for its duration. Monitors with
+        expired leases (e.g. of a crashed worker) can be claimed again.
+        :param limit: max amount of due monitors to claim
+        :param owner: unique ID of the claiming worker
+        :param lease: how long the claim is valid
+        :param coalesce_window: monitors with the same URL as the claimed ones
+        which are due within this window are claimed as well (on top of limit)
+        :return: claimed monitors
+        """
+        claimed_list = await self.connection.fetch(
+            self.CLAIM, limit, owner, lease, coalesce_window
+        )
+
+        return [self._db_to_model(row) for row in claimed_list]
+
+    @DB_QUERY_DURATION.time(method='release')
+    async def release(
+            self,
+            ids: list[NonNegativeInt],
+            owner: str,
+            policy: ReschedulePolicy = settings.RESCHEDULE_POLICY,
+    ) -> list[MonitorModel]:
+        """
+        Reschedules claimed monitors and removes their leases. Monitors which
+        were re-claimed by someone else after the lease expiration are skipped.
+        :param ids: monitors to release
+        :param owner: unique ID of the worker holding the leases
+        :param policy: how to calculate the next sync time (see NEXT_SYNC)
+        :return: released monitors
+        """
+        released_list = await self.connection.fetch(
+            self.RELEASE[policy], ids, owner
+        )
+
+        return [self._db_to_model(row) for row in released_list]
+
+    @DB_QUERY_DURATION.time(method='count')
     async def count(self) -> int:
         """
         Getting total monitors count
@@ -154,25 +725,144 @@ class MonitorDao:
         """
         return await self.connection.fetchval(self.COUNT_ACTIVE)
 
-    @validate_call
     async def create_log_items_from_schema(
             self, items: list[tuple[int, SiteMetricSchema]]
     ):
         """
-        Batch-insert for monitoring results
+        Batch-insert for monitoring results, also updates monitor_status.
+        Batches bigger than settings.LOG_COPY_THRESHOLD are written with
+        binary COPY and a separate status upsert, smaller ones with a single
+        statement.
         :param items: scan results to insert
         """
-        await self.connection.executemany(
-            self.INSERT_LOG,
-            [
-                (
-                    monitor_id,
-                    item.ts,
-                    item.http_status,
-                    item.response_time_ms,
-                    item.regexp_found,
-                    item.error
-                )
-                for monitor_id, item in items
-            ]
+        details = {
+            item.error_detail
+            for _, item in items
+            if item.error_detail is not None
+        }
+        detail_ids = await self.resolve_error_details(details) if details else {}
+        records = [
+            (
+                monitor_id,
+                item.ts,
+                item.http_status,
+                item.response_time_ms,
+                item.regexp_found,
+                item.error_code,
+                detail_ids.get(item.error_detail),
+                item.from_cache,
+                item.queue_time_ms,
+                item.dns_ms,
+                item.connect_ms,
+                item.tls_ms,
+                item.ttfb_ms,
+                item.download_ms,
+                item.response_size,
+            )
+            for monitor_id, item in items
+        ]
+
+        if len(records) == 0:
+            return
+
+        if len(records) >= settings.LOG_COPY_THRESHOLD:
+            await self.copy_log_records(records)
+            await self.upsert_status(records)
+        else:
+            await self.insert_log_and_status(records)
+
+    @DB_QUERY_DURATION.time(method='resolve_error_details')
+    async def resolve_error_details(self, details: set[str]) -> dict[str, int]:
+        """
+        Gets IDs of error details, new ones are inserted. IDs of committed
+        details are cached in the process for settings.ERROR_DETAIL_CACHE_TTL,
+        so repeated failures don't cost a query. Details inserted here aren't
+        cached: the transaction can still be rolled back.
+        :param details: texts of the details
+        :return: IDs by text, details which couldn't be resolved are skipped
+        """
+        now = time.monotonic()
+        # Oldest entries go first, expired ones and ones over the size
+        while _error_detail_ids and (
+                len(_error_detail_ids) > settings.ERROR_DETAIL_CACHE_SIZE
+                or now - next(iter(_error_detail_ids.values()))[1]
+                >= settings.ERROR_DETAIL_CACHE_TTL
+        ):
+            del _error_detail_ids[next(iter(_error_detail_ids))]
+
+        ids = {
+            detail: _error_detail_ids[detail][0]
+            for detail in details
+            if detail in _error_detail_ids
+        }
+        # The second attempt sees details of concurrent transactions which
+        # were committed in the meantime
+        for _ in range(2):
+            missing = sorted(detail for detail in details if detail not in ids)
+            if not missing:
+                break
+            for row in await self.connection.fetch(
+                    self.RESOLVE_ERROR_DETAILS,
+                    missing,
+                    timedelta(seconds=settings.ERROR_DETAIL_CACHE_TTL),
+            ):
+                ids[row['detail']] = row['id']
+                if not row['inserted']:
+                    _error_detail_ids.pop(row['detail'], None)
+                    _error_detail_ids[row['detail']] = (row['id'], now)
+
+        return ids
+
+    @DB_QUERY_DURATION.time(method='insert_log_and_status')
+    async def insert_log_and_status(self, records: list[tuple]):
+        """
+        Inserts monitor_log records and upserts monitor_status in one
+        statement
+        :param records: tuples in LOG_COLUMNS order
+        """
+        await self.connection.execute(
+            self.INSERT_LOG_AND_STATUS, *map(list, zip(*records))
+        )
+
+    @DB_QUERY_DURATION.time(method='upsert_status')
+    async def upsert_status(self, records: list[tuple]):
+        """
+        Applies the latest result of every monitor in records to monitor_status
+        :param records: tuples in LOG_COLUMNS order
+        """
+        await self.connection.execute(
+            self.UPSERT_STATUS, *map(list, zip(*records))
+        )
+
+    @DB_QUERY_DURATION.time(method='select_status')
+    @validate_call
+    async def select_status(
+            self, ids: list[NonNegativeInt]
+    ) -> list[MonitorStatusModel]:
+        """
+        Gets current statuses of monitors, one primary key lookup per monitor
+        :param ids: monitor IDs
+        :return: statuses ordered by monitor ID, monitors without scan results
+        are skipped
+        """
+        rows = await self.connection.fetch(self.SELECT_STATUS, ids)
+
+        return [MonitorStatusModel(**row) for row in rows]
+
+    @DB_QUERY_DURATION.time(method='insert_log_records')
+    async def insert_log_records(self, records: list[tuple]):
+        """
+        Inserts raw monitor_log records with one INSERT per record
+        :param records: tuples in LOG_COLUMNS order
+        """
+        await self.connection.executemany(self.INSERT_LOG, records)
+
+    @DB_QUERY_DURATION.time(method='copy_log_records')
+    async def copy_log_records(self, records: list[tuple]):
+        """
+        Writes raw monitor_log records with a single binary COPY
+        :param records: tuples in LOG_COLUMNS order
+        """
+        await self.connection.copy_records_to_table(
+            'monitor_log', records=records, columns=LOG_COLUMNS
         )
@@ -1,24 +1,103 @@
-from dataclasses import dataclass
+import asyncio
+import logging
+import time
 from typing import Annotated
 
-from asyncpg import Pool
-from fastapi import Depends
+from asyncpg import Connection, Pool, PostgresError
+from fastapi import Depends, HTTPException
+from starlette import status
 
-from mservice.database.base import create_pool
+from mservice import settings
+from mservice.database.base import create_pool, observe_pool
+from mservice.database.metrics_dao import MetricsDao
+from mservice.database.monitor_dao import MonitorDao
+from mservice.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+POOL_ACQUIRE_DURATION = registry.histogram(
+    'mservice_db_pool_acquire_seconds',
+    'Time API requests wait for a DB connection',
+)
+POOL_ACQUIRE_TIMEOUTS = registry.counter(
+    'mservice_db_pool_acquire_timeouts_total',
+    'API requests which have not got a DB connection in time',
+)
+
+# Statements of the API hot paths, prepared on every new connection
+PREPARED_STATEMENTS = (
+    MonitorDao.INSERT,
+    MonitorDao.DELETE,
+    MonitorDao.SELECT_BY_ID,
+    MonitorDao.SELECT_STATUS,
+    MetricsDao.SELECT_RAW_BUCKETS,
+    *MetricsDao.SELECT_ROLLUP_BUCKETS.values(),
+)
+
+
+async def prepare_statements(connection: Connection):
+    """
+    Puts PREPARED_STATEMENTS into the statement cache of the connection, so
+    the first requests don't pay for parsing and planning them
+    :param connection: new connection of the pool
+    """
+    for statement in PREPARED_STATEMENTS:
+        try:
+            # executemany without arguments only prepares the statement,
+            # it's cached by text and reused by fetch/execute
+            await connection.executemany(statement, [])
+        except PostgresError as e:
+            # E.g. the schema isn't migrated yet
+            logger.warning(f"Failed to prepare a statement: {e}")
+            return
 
 
 class DatabasePoolHolder:
 
     def __init__(self):
-        self._pool = None
+        self._pool: Pool | None = None
+        self._lock = asyncio.Lock()
 
-    async def provide_pool(self):
+    async def open(self) -> Pool:
         """
-        Lazily initializes and returns pool of connections
+        Creates the pool with settings.DB_MIN_POOL_SIZE warmed up connections.
+        Called on the app startup.
+        :return: initialized pool
+        """
+        async with self._lock:
+            if self._pool is None:
+                self._pool = await create_pool(
+                    min_size=min(
+                        settings.DB_MIN_POOL_SIZE, settings.DB_MAX_POOL_SIZE
+                    ),
+                    max_size=settings.DB_MAX_POOL_SIZE,
+                    init=prepare_statements,
+                    max_inactive_connection_lifetime=(
+                        settings.DB_POOL_IDLE_LIFETIME
+                    ),
+                )
+                observe_pool(self._pool)
+
+        return self._pool
+
+    async def close(self):
+        """
+        Closes the pool, called on the app shutdown
+        """
+        async with self._lock:
+            if self._pool is not None:
+                observe_pool(None)
+                await self._pool.close()
+                self._pool = None
+
+    async def provide_pool(self) -> Pool:
+        """
+        Returns the pool, opens it if the app was started without its
+        lifespan (e.g. mounted into another app)
         :return: initialized pool
         """
         if self._pool is None:
-            self._pool = await create_pool()
+            return await self.open()
 
         return self._pool
 
@@ -36,9 +115,23 @@ async def db_pool():
 
 async def db_connection(pool: Annotated[Pool, Depends(db_pool)]):
     """
-    Returns one connection from pool
+    Returns one connection from pool. Requests which don't get a connection
+    within settings.DB_ACQUIRE_TIMEOUT are answered with 503.
     :param pool: injected pool
     :return: working DB connection
     """
-    async with pool.acquire() as conn:
+    start = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=settings.DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError as e:
+        POOL_ACQUIRE_TIMEOUTS.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="All database connections are busy"
+        ) from e
+    POOL_ACQUIRE_DURATION.observe(time.perf_counter() - start)
+
+    try:
         yield conn
+    finally:
+        await pool.release(conn)
@@ -0,0 +1,91 @@
+import logging
+import time
+from collections import Counter
+
+from mservice.metrics import registry
+from mservice.schema.errors import ErrorCode
+
+logger = logging.getLogger(__name__)
+
+REQUEST_FAILURES = registry.counter(
+    'mservice_request_failures_total',
+    'Failed HTTP requests of the worker by error code',
+    ('code',),
+)
+
+
+class FailureLog:
+    """
+    Aggregates failed requests instead of logging every one of them, so an
+    outage of a popular host costs counters, not tracebacks. Failures are
+    counted by code and host and logged as one summary at most once per
+    interval. Every failure is still logged on DEBUG level.
+
+    Unclassified errors can be bugs, so one traceback of them is logged per
+    interval.
+    """
+
+    def __init__(self, interval: float, top_hosts: int = 3):
+        """
+        :param interval: seconds between summaries
+        :param top_hosts: most failing hosts named in the summary per code
+        """
+        self._interval = interval
+        self._top_hosts = top_hosts
+        self._counts: Counter[tuple[ErrorCode, str]] = Counter()
+        self._examples: dict[ErrorCode, str] = {}
+        self._started = time.monotonic()
+        self._unknown_logged = False
+
+    def record(self, code: ErrorCode, host: str, error: Exception):
+        """
+        :param code: class of the failure
+        :param host: requested host
+        :param error: raised exception
+        """
+        REQUEST_FAILURES.labels(code=code.name.lower()).inc()
+        logger.debug(f"Failed requesting {host}: {code.name}", exc_info=error)
+        if code is ErrorCode.UNKNOWN and not self._unknown_logged:
+            self._unknown_logged = True
+            logger.error(f"Unclassified error requesting {host}", exc_info=error)
+
+        self._counts[code, host] += 1
+        self._examples.setdefault(code, f"{host}: {error!r}")
+        if time.monotonic() - self._started >= self._interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Logs the summary of failures since the previous one and starts
+        a new interval
+        """
+        if self._counts:
+            logger.warning(self._summary(time.monotonic() - self._started))
+
+        self._counts.clear()
+        self._examples.clear()
+        self._started = time.monotonic()
+        self._unknown_logged = False
+
+    def _summary(self, elapsed: float) -> str:
+        by_code: dict[ErrorCode, Counter[str]] = {}
+        for (code, host), count in self._counts.items():
+            by_code.setdefault(code, Counter())[host] = count
+
+        parts = []
+        for code, hosts in sorted(
+                by_code.items(), key=lambda item: -item[1].total()
+        ):
+            top = ', '.join(
+                f"{host} {count}"
+                for host, count in hosts.most_common(self._top_hosts)
+            )
+            parts.append(
+                f"{code.name.lower()} {hosts.total()} on {len(hosts)} hosts "
+                f"({top}; e.g. {self._examples[code]})"
+            )
+
+        return (
+            f"{self._counts.total()} requests failed in the last "
+            f"{elapsed:.0f}s: " + '; '.join(parts)
+        )
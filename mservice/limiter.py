@@ -0,0 +1,200 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+from typing import AsyncIterator
+
+
+@dataclass(frozen=True, slots=True)
+class HostLimits:
+    # Max simultaneous requests to the host
+    max_concurrency: int
+    # Requests per second, 0 - unlimited
+    rate: float
+    # Requests which can be sent at once after an idle period
+    burst: int
+
+    def restrict(
+            self, max_concurrency: int | None = None, rate: float | None = None
+    ) -> 'HostLimits':
+        """
+        Applies overrides which can only make the limits stricter, so
+        a monitor can't raise the limits of a host for the others
+        :param max_concurrency: max concurrency override, None - no override
+        :param rate: rate override, None or 0 - no override
+        :return: the strictest of the current and the given limits
+        """
+        if max_concurrency is not None:
+            max_concurrency = min(self.max_concurrency, max_concurrency)
+        if rate is not None and (rate <= 0 or 0 < self.rate <= rate):
+            rate = None
+
+        return replace(
+            self,
+            max_concurrency=(
+                self.max_concurrency if max_concurrency is None
+                else max_concurrency
+            ),
+            rate=self.rate if rate is None else rate,
+        )
+
+
+class QueueTimeoutException(Exception):
+    pass
+
+
+class HostLimiter:
+    """
+    Limits requests to one host by concurrency and by a token bucket rate.
+    Requests over the limits wait in FIFO order instead of failing. Limits
+    can be changed on the fly, the change applies to waiting requests too.
+
+    A request can carry stricter limits of its own: it waits until fewer
+    requests than its own max concurrency are active and keeps at least
+    1 / rate seconds from the previous request to the host. Other requests
+    of the host aren't affected.
+
+    A freed slot is handed over to the first waiting request it admits, so
+    only that one is woken up.
+    """
+
+    def __init__(self, limits: HostLimits):
+        self.limits = limits
+        self._active = 0
+        # Futures of waiting requests with their max concurrency overrides
+        self._waiters: deque[tuple[asyncio.Future, int | None]] = deque()
+        self._tokens = float(limits.burst)
+        self._tokens_updated = time.monotonic()
+        # Start time of the latest admitted request, may be in the future
+        self._last_start = float('-inf')
+        # Time when the token bucket is full and the per-request rates of the
+        # latest requests are kept, from then on the state doesn't matter
+        self._settled_at = float('-inf')
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def idle(self) -> bool:
+        """
+        :return: True if no request is active or waiting and the limiter
+        behaves like a new one, so it can be dropped
+        """
+        return (
+            self._active == 0
+            and len(self._waiters) == 0
+            and time.monotonic() >= self._settled_at
+        )
+
+    def _reserve_token(self, rate: float) -> float:
+        """
+        Takes a token from the bucket, the bucket can go into debt
+        :param rate: rate of the request, stricter than the host one or equal
+        :return: seconds to wait until the taken token is available
+        """
+        now = time.monotonic()
+        delay = 0.0
+        if self.limits.rate > 0:
+            self._tokens = min(
+                float(self.limits.burst),
+                self._tokens + (now - self._tokens_updated) * self.limits.rate,
+            )
+            self._tokens_updated = now
+            self._tokens -= 1
+            delay = max(-self._tokens / self.limits.rate, 0.0)
+        if rate > 0 and rate != self.limits.rate:
+            delay = max(delay, self._last_start + 1 / rate - now)
+
+        self._last_start = max(self._last_start, now + delay)
+        if self.limits.rate > 0:
+            full_at = now + (self.limits.burst - self._tokens) / self.limits.rate
+            self._settled_at = max(self._settled_at, full_at)
+        if rate > 0:
+            self._settled_at = max(self._settled_at, self._last_start + 1 / rate)
+        return delay
+
+    def _refund_token(self):
+        if self.limits.rate > 0:
+            self._tokens += 1
+
+    def _admits(self, max_concurrency: int | None) -> bool:
+        limits = self.limits.restrict(max_concurrency)
+        return self._active < limits.max_concurrency
+
+    def _release(self):
+        self._active -= 1
+        # Waiters have own limits, the ones which don't fit are skipped. No
+        # one fits once the host limit is reached
+        index = 0
+        while (
+                index < len(self._waiters)
+                and self._active < self.limits.max_concurrency
+        ):
+            future, max_concurrency = self._waiters[index]
+            if future.done() or not self._admits(max_concurrency):
+                index += 1
+                continue
+            del self._waiters[index]
+            self._active += 1
+            future.set_result(None)
+
+    def _abandon(self, waiter: tuple[asyncio.Future, int | None]):
+        future, _ = waiter
+        if future.done() and not future.cancelled():
+            # The slot was handed over right before the waiter gave up
+            self._release()
+        else:
+            self._waiters.remove(waiter)
+
+    async def _acquire(self, max_concurrency: int | None, deadline: float | None):
+        if self._admits(max_concurrency):
+            self._active += 1
+            return
+
+        waiter = (asyncio.get_running_loop().create_future(), max_concurrency)
+        self._waiters.append(waiter)
+        try:
+            async with asyncio.timeout_at(deadline):
+                await waiter[0]
+        except TimeoutError as e:
+            self._abandon(waiter)
+            raise QueueTimeoutException(
+                "No free slot for the host until the deadline"
+            ) from e
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    @asynccontextmanager
+    async def slot(
+            self,
+            max_concurrency: int | None = None,
+            rate: float | None = None,
+            deadline: float | None = None,
+    ) -> AsyncIterator[None]:
+        """
+        Waits for a free concurrency slot and a rate token, holds the slot
+        until exit
+        :param max_concurrency: [optional] max concurrency of this request,
+        only a stricter one than the host limit is applied
+        :param rate: [optional] rate of this request, only a stricter one than
+        the host limit is applied
+        :param deadline: [optional] loop time to give up waiting at
+        :raise QueueTimeoutException: the request would wait past the deadline
+        """
+        loop = asyncio.get_running_loop()
+        await self._acquire(max_concurrency, deadline)
+        try:
+            delay = self._reserve_token(self.limits.restrict(rate=rate).rate)
+            if delay > 0 and deadline is not None and loop.time() + delay > deadline:
+                self._refund_token()
+                raise QueueTimeoutException(
+                    "No rate token for the host until the deadline"
+                )
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield
+        finally:
+            self._release()
@@ -0,0 +1,306 @@
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Generic, Iterable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Default histogram buckets in seconds, from a fast DB query to a timeout
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # The last one is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+_Child = TypeVar('_Child')
+
+
+class _Metric(Generic[_Child]):
+    """
+    Base of all metric types. A metric without labels is its own single
+    child, so it can be updated directly.
+    """
+    type = ''
+
+    def __init__(
+            self, name: str, documentation: str, label_names: tuple[str, ...] = ()
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._children: dict[tuple[str, ...], _Child] = {}
+        self._default = None if label_names else self.labels()
+
+    def _new_child(self) -> _Child:
+        raise NotImplementedError
+
+    def _unlabeled(self) -> _Child:
+        """
+        :return: the single child of a metric without labels
+        :raises ValueError: if the metric has labels
+        """
+        if self._default is None:
+            raise ValueError(f"Metric {self.name} has labels, use labels()")
+
+        return self._default
+
+    def labels(self, **labels) -> _Child:
+        """
+        :param labels: values of all the label names
+        :return: child metric for these label values
+        """
+        key = tuple(str(labels[name]) for name in self.label_names)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+
+        return child
+
+    def _render_samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        """
+        :return: lines of the Prometheus text format
+        """
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type}',
+            *self._render_samples(),
+        ]
+
+
+class Counter(_Metric[_CounterValue]):
+    type = 'counter'
+
+    def _new_child(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabeled().inc(amount)
+
+    @property
+    def value(self) -> float:
+        return self._unlabeled().value
+
+    def _render_samples(self) -> list[str]:
+        return [
+            f'{self.name}{_format_labels(self.label_names, key)} '
+            f'{_format_value(child.value)}'
+            for key, child in self._children.items()
+        ]
+
+
+class Histogram(_Metric[_HistogramValue]):
+    type = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            label_names: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, label_names)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabeled().observe(value)
+
+    def time(self, **labels):
+        """
+        Decorator which observes durations of an async function
+        :param labels: label values to observe the durations with
+        """
+        child = self.labels(**labels)
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - start)
+
+            return wrapper
+
+        return decorator
+
+    def _render_samples(self) -> list[str]:
+        lines = []
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.label_names + ('le',), key + (_format_value(bound),)
+                )
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(child.sum)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+
+        return lines
+
+
+class Gauge(_Metric[None]):
+    """
+    Gauge without labels, which reads its value from a function on rendering
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._function: Callable[[], float] | None = None
+
+    def _new_child(self) -> None:
+        return None
+
+    def set_function(self, function: Callable[[], float] | None):
+        """
+        :param function: returns the current value, None - no value
+        """
+        self._function = function
+
+    def _render_samples(self) -> list[str]:
+        if self._function is None:
+            return []
+        return [f'{self.name} {_format_value(self._function())}']
+
+
+class MetricsRegistry:
+    """
+    Keeps metrics of the current process and renders them in the Prometheus
+    text format. Updates are plain attribute changes, so metrics can be
+    collected on hot paths.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+            self, name: str, documentation: str, label_names: tuple[str, ...] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            label_names: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(
+            Histogram(name, documentation, label_names, buckets)
+        )
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+
+    def render(self) -> str:
+        """
+        :return: all the metrics in the Prometheus text format
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    Answers one HTTP request with the rendered metrics
+    """
+    try:
+        request_line = await reader.readline()
+        # Headers aren't needed, but have to be read before answering
+        while (await reader.readline()).strip():
+            pass
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1] == '/metrics':
+            status, content_type = '200 OK', CONTENT_TYPE
+            body = registry.render().encode()
+        else:
+            status, content_type = '404 Not Found', 'text/plain'
+            body = b'Not found\n'
+
+        writer.write(
+            f'HTTP/1.1 {status}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port: int, host: str = '0.0.0.0') -> asyncio.Server:
+    """
+    Starts a minimal HTTP listener serving GET /metrics
+    :param port: port to listen on
+    :param host: interface to listen on
+    :return: started server, should be closed on exit
+    """
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    logger.info(f"Serving metrics on {host}:{port}/metrics")
+    return server
@@ -0,0 +1,144 @@
+import asyncio
+import socket
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator
+
+import httpcore
+
+
+@dataclass(slots=True)
+class NetworkTimings:
+    """
+    Durations of the request phases in seconds. None - the phase hasn't
+    happened, e.g. a reused connection has no DNS, connect and TLS.
+    """
+    dns: float | None = None
+    # TCP connect, without DNS
+    connect: float | None = None
+    tls: float | None = None
+    # From sending the request until the response headers are received
+    ttfb: float | None = None
+    # Reading the body, as far as it's read
+    download: float | None = None
+
+
+# Phases which are timed from the started to the complete trace event
+_TRACED_PHASES = {
+    'connection.connect_tcp': 'connect',
+    'connection.start_tls': 'tls',
+}
+
+# Timings of the request made in the current task, DNS is timed by the
+# network backend which doesn't see the request
+_current_timings: ContextVar[NetworkTimings | None] = ContextVar(
+    'network_timings', default=None
+)
+
+
+class RequestTracer:
+    """
+    httpcore trace extension of one request, fills its timings from the
+    started/complete events of the request phases
+    """
+
+    def __init__(self):
+        self.timings = NetworkTimings()
+        self._started: dict[str, float] = {}
+
+    async def __call__(self, event: str, info: dict):
+        now = time.perf_counter()
+        name, _, stage = event.rpartition('.')
+        if stage == 'started':
+            self._started[name] = now
+            return
+        if stage != 'complete':
+            return
+
+        if name.endswith('.receive_response_headers'):
+            sent = self._started.get(
+                name.replace('receive_response_headers', 'send_request_headers')
+            )
+            if sent is not None:
+                self.timings.ttfb = now - sent
+        elif name in _TRACED_PHASES and name in self._started:
+            elapsed = now - self._started[name]
+            if name == 'connection.connect_tcp' and self.timings.dns is not None:
+                elapsed = max(elapsed - self.timings.dns, 0.0)
+            setattr(self.timings, _TRACED_PHASES[name], elapsed)
+
+    @contextmanager
+    def active(self) -> Iterator[None]:
+        """
+        Makes the timings available to TimedNetworkBackend while the request
+        is made in the current task
+        """
+        token = _current_timings.set(self.timings)
+        try:
+            yield
+        finally:
+            _current_timings.reset(token)
+
+
+class TimedNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    Wraps the network backend of an httpcore pool to time DNS separately
+    from TCP connect: the host is resolved here and its addresses are tried
+    one by one. Requests without active timings are passed through as is.
+    """
+
+    def __init__(self, backend: httpcore.AsyncNetworkBackend):
+        self._backend = backend
+
+    async def connect_tcp(
+            self,
+            host: str,
+            port: int,
+            timeout: float | None = None,
+            local_address: str | None = None,
+            socket_options=None,
+    ) -> httpcore.AsyncNetworkStream:
+        timings = _current_timings.get()
+        if timings is None:
+            return await self._backend.connect_tcp(
+                host, port, timeout, local_address, socket_options
+            )
+
+        start = time.perf_counter()
+        try:
+            addresses = await asyncio.wait_for(
+                asyncio.get_running_loop().getaddrinfo(
+                    host, port, type=socket.SOCK_STREAM
+                ),
+                timeout,
+            )
+        except asyncio.TimeoutError as e:
+            raise httpcore.ConnectTimeout(f"Resolving {host} timed out") from e
+        except OSError as e:
+            raise httpcore.ConnectError(str(e)) from e
+        timings.dns = time.perf_counter() - start
+        if timeout is not None:
+            timeout = max(timeout - timings.dns, 0.0)
+
+        error = httpcore.ConnectError(f"No addresses found for {host}")
+        for *_, address in addresses:
+            try:
+                return await self._backend.connect_tcp(
+                    address[0], port, timeout, local_address, socket_options
+                )
+            except httpcore.ConnectError as e:
+                error = e
+
+        raise error
+
+    async def connect_unix_socket(
+            self, path: str, timeout: float | None = None, socket_options=None
+    ) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(
+            path, timeout, socket_options
+        )
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
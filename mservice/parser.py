@@ -1,16 +1,494 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
 import re
+from collections import OrderedDict
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+# The regexp parser isn't public, but it's the only way to look into a pattern
+from re import (  # type: ignore[attr-defined]
+    _constants as sre_constants,
+    _parser as sre_parser,
+)
 
+from mservice import settings
+from mservice.metrics import registry
 
-def find_pattern(source: str, regexp: str) -> bool:
+logger = logging.getLogger(__name__)
+
+REGEXP_CACHE_HITS = registry.counter(
+    'mservice_regexp_cache_hits_total', 'Regexps found compiled in the cache'
+)
+REGEXP_CACHE_MISSES = registry.counter(
+    'mservice_regexp_cache_misses_total', 'Regexps compiled on a cache miss'
+)
+
+
+class RegexpTimeoutException(Exception):
+    pass
+
+
+class PatternCache:
+    """
+    Bounded LRU cache of compiled regular expressions. Python's own cache
+    is small and gets thrashed by thousands of distinct monitor patterns.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._patterns: OrderedDict[tuple[str, int], re.Pattern] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def compile(self, regexp: str, flags: int = re.MULTILINE) -> re.Pattern:
+        """
+        Returns a compiled pattern, compiling it only on a cache miss.
+        :param regexp: regular expression
+        :param flags: regular expression flags
+        :return: compiled pattern
+        :raises re.error: if regexp is malformed
+        """
+        key = (regexp, flags)
+        pattern = self._patterns.get(key)
+        if pattern is not None:
+            self.hits += 1
+            REGEXP_CACHE_HITS.inc()
+            self._patterns.move_to_end(key)
+            return pattern
+
+        self.misses += 1
+        REGEXP_CACHE_MISSES.inc()
+        pattern = re.compile(regexp, flags)
+        self._patterns[key] = pattern
+        if len(self._patterns) > self.max_size:
+            self._patterns.popitem(last=False)
+
+        return pattern
+
+    def clear(self):
+        """
+        Removes all cached patterns and resets counters
+        """
+        self._patterns.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+pattern_cache = PatternCache(settings.REGEXP_CACHE_SIZE)
+
+
+def compile_pattern(regexp: str) -> re.Pattern:
+    """
+    Compiles a monitor regexp through the shared cache.
+    :param regexp: regular expression
+    :return: compiled pattern
+    :raises re.error: if regexp is malformed
+    """
+    return pattern_cache.compile(regexp, re.MULTILINE)
+
+
+def find_pattern(source: str, regexp: str | re.Pattern) -> bool:
     """
     Searches source for regexp.
 
-    WARNING. Python regexp support is quite slow, but assuming there won't be
-    tens of thousands of chars to search in it is fast enough for async
-    environment. In other cases multiprocessing should be considered.
+    WARNING. Python regexp support is quite slow and can't be interrupted,
+    so it should only be used directly for small texts. Use RegexpEvaluator
+    for everything else.
 
     :param source: source text to search in
-    :param regexp: search request
+    :param regexp: search request, either raw or already compiled
     :return: True if found any items
     """
-    return re.search(regexp, source, re.MULTILINE) is not None
+    if isinstance(regexp, str):
+        regexp = compile_pattern(regexp)
+
+    return regexp.search(source) is not None
+
+
+_REPEATS = {
+    sre_constants.MAX_REPEAT,
+    sre_constants.MIN_REPEAT,
+    getattr(sre_constants, 'POSSESSIVE_REPEAT', sre_constants.MAX_REPEAT),
+}
+_BACKREFERENCES = {sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS}
+
+
+def _subpatterns(value):
+    """
+    :return: subpatterns nested into the argument of a parsed pattern item
+    """
+    if isinstance(value, sre_parser.SubPattern):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _subpatterns(item)
+
+
+def _can_backtrack_exponentially(
+        subpattern: sre_parser.SubPattern, in_repeat: bool = False
+) -> bool:
+    for op, value in subpattern:
+        if op in _BACKREFERENCES:
+            return True
+        repeat = op in _REPEATS and value[1] > 1
+        if in_repeat and (repeat or op is sre_constants.BRANCH):
+            return True
+        for nested in _subpatterns(value):
+            if _can_backtrack_exponentially(nested, in_repeat or repeat):
+                return True
+
+    return False
+
+
+def _count_variable_repeats(subpattern: sre_parser.SubPattern) -> int:
+    """
+    :return: number of repeats which can match a varying number of times
+    """
+    count = 0
+    for op, value in subpattern:
+        if op in _REPEATS and value[0] != value[1]:
+            count += 1
+        for nested in _subpatterns(value):
+            count += _count_variable_repeats(nested)
+
+    return count
+
+
+@functools.lru_cache(maxsize=settings.REGEXP_CACHE_SIZE)
+def is_inline_safe(pattern: re.Pattern) -> bool:
+    """
+    Checks a pattern for the usual causes of catastrophic backtracking:
+    repeats or alternations nested into repeats, backreferences and several
+    variable repeats in a row, like .*.*z (polynomial backtracking). Patterns
+    with at most one variable repeat take roughly linear time, so short texts
+    can be searched with them right in the event loop.
+    :param pattern: compiled pattern
+    :return: True if the pattern can't backtrack catastrophically
+    """
+    try:
+        parsed = sre_parser.parse(pattern.pattern, pattern.flags)
+    except re.error:
+        return False
+
+    return (
+        not _can_backtrack_exponentially(parsed)
+        and _count_variable_repeats(parsed) <= 1
+    )
+
+
+def search_settled(
+        pattern: re.Pattern, source: str, pos: int = 0, margin: int = 0
+) -> bool:
+    """
+    Searches source for pattern. Text before pos is only seen by anchors and
+    lookbehinds. Source can be followed by more text, which can change a match
+    ending within the last margin chars ($, lookaheads and the like), so such
+    matches are ignored. The ones starting within the last margin * 2 chars
+    are expected to be searched again with the next text, the search is
+    retried after the others.
+    :param pattern: compiled pattern
+    :param source: source text to search in
+    :param pos: index to start the search from
+    :param margin: number of unsettled chars at the end of source
+    :return: True if found any settled items
+    """
+    settled = len(source) - margin
+    match = pattern.search(source, pos)
+    while match is not None and match.end() > settled:
+        if match.start() >= settled - margin:
+            return False
+        match = pattern.search(source, match.start() + 1)
+
+    return match is not None
+
+
+def _search_in_process(
+        regexp: str, flags: int, source: str, pos: int, margin: int
+) -> bool:
+    """
+    Searches source for regexp inside of a pool process
+    :param regexp: regular expression
+    :param flags: regular expression flags
+    :param source: source text to search in
+    :param pos: index to start the search from
+    :param margin: number of unsettled chars at the end of source
+    :return: True if found any settled items
+    """
+    return search_settled(pattern_cache.compile(regexp, flags), source, pos, margin)
+
+
+def _warm_up_process():
+    """
+    Does nothing, makes the pool start a process
+    """
+
+
+class RegexpEvaluator:
+    """
+    Evaluates regexps without blocking the event loop for long. Texts up to
+    inline_limit chars are searched right away with inline safe patterns (see
+    is_inline_safe). Bigger texts and the other patterns are sent to a process
+    pool and have time_budget seconds to finish.
+
+    A process stuck on a catastrophic pattern can't be interrupted, so the
+    whole pool is killed and recreated on a timeout. Only as many searches as
+    there are processes are sent to the pool at once, and the pool is warmed
+    up before use, so the budget isn't spent on queueing or process start.
+    """
+
+    def __init__(
+            self,
+            processes: int = settings.REGEXP_PROCESSES,
+            inline_limit: int = settings.REGEXP_INLINE_LIMIT,
+            time_budget: float = settings.REGEXP_TIME_BUDGET,
+    ):
+        self.processes = processes
+        self.inline_limit = inline_limit
+        self.time_budget = time_budget
+        self._pool: ProcessPoolExecutor | None = None
+        self._pool_lock = asyncio.Lock()
+        self._process_slots = asyncio.Semaphore(max(processes, 1))
+
+    async def _get_pool(self) -> ProcessPoolExecutor:
+        async with self._pool_lock:
+            if self._pool is None:
+                pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                loop = asyncio.get_running_loop()
+                await asyncio.gather(*[
+                    loop.run_in_executor(pool, _warm_up_process)
+                    for _ in range(self.processes)
+                ])
+                self._pool = pool
+
+        return self._pool
+
+    def _kill_pool(self):
+        if self._pool is None:
+            return
+
+        pool, self._pool = self._pool, None
+        # Executor doesn't allow to stop running calls, so processes
+        # have to be terminated directly
+        for process in list(pool._processes.values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        """
+        Stops pool processes
+        """
+        self._kill_pool()
+
+    async def _search_in_pool(
+            self, pattern: re.Pattern, source: str, pos: int, margin: int
+    ) -> bool:
+        async with self._process_slots:
+            return await self._search_in_free_process(pattern, source, pos, margin)
+
+    async def _search_in_free_process(
+            self, pattern: re.Pattern, source: str, pos: int, margin: int
+    ) -> bool:
+        pool = await self._get_pool()
+        future = asyncio.get_running_loop().run_in_executor(
+            pool,
+            _search_in_process,
+            pattern.pattern,
+            pattern.flags,
+            source,
+            pos,
+            margin,
+        )
+        try:
+            return await asyncio.wait_for(future, self.time_budget)
+        except asyncio.TimeoutError as e:
+            logger.warning(f"Regexp {pattern.pattern!r} is out of its time budget")
+            if self._pool is pool:
+                self._kill_pool()
+            raise RegexpTimeoutException(
+                f"Regexp evaluation took more than {self.time_budget} seconds"
+            ) from e
+        except BrokenProcessPool:
+            if self._pool is pool:
+                self._kill_pool()
+            raise
+
+    def searches_inline(self, pattern: re.Pattern) -> bool:
+        """
+        :param pattern: compiled pattern
+        :return: True if texts up to inline_limit chars are searched with the
+        pattern in the event loop
+        """
+        if self.processes <= 0:
+            return True
+
+        return self.inline_limit > 0 and is_inline_safe(pattern)
+
+    async def search(
+            self, pattern: re.Pattern, source: str, pos: int = 0, margin: int = 0
+    ) -> bool:
+        """
+        Searches source for pattern (see search_settled)
+        :param pattern: compiled pattern
+        :param source: source text to search in
+        :param pos: index to start the search from
+        :param margin: number of unsettled chars at the end of source
+        :return: True if found any settled items
+        :raises RegexpTimeoutException: if the search took longer than the
+        time budget
+        """
+        if self.processes <= 0 or (
+                len(source) <= self.inline_limit and self.searches_inline(pattern)
+        ):
+            return search_settled(pattern, source, pos, margin)
+
+        try:
+            return await self._search_in_pool(pattern, source, pos, margin)
+        except BrokenProcessPool:
+            # The pool could be killed by a timeout of a concurrent search
+            return await self._search_in_pool(pattern, source, pos, margin)
+
+
+class StreamMatcher:
+    """
+    Searches patterns in a text which arrives in chunks. Patterns which are
+    searched inline (see RegexpEvaluator.searches_inline) are searched in
+    every chunk as soon as it arrives, by slices of up to the inline limit.
+    Text for the other patterns is buffered and sent to the process pool by
+    windows of settings.REGEXP_WINDOW chars.
+
+    Until the last chunk arrives, matches ending within the last overlap
+    (settings.REGEXP_OVERLAP chars) of a text are ignored, as the next text
+    can change them ($, lookaheads). The tail of twice the overlap is
+    searched again together with the next text, so such matches and matches
+    spanning two chunks, slices or windows are found as long as they are
+    shorter than the overlap. One more char of the tail is kept before the
+    searched text, so ^, \b and lookbehinds see what precedes it.
+
+    Patterns are identified by their source text, so the same regexp of
+    several monitors is only searched once.
+    """
+
+    def __init__(
+            self,
+            patterns: Iterable[re.Pattern],
+            evaluator: RegexpEvaluator,
+            overlap: int = settings.REGEXP_OVERLAP,
+            window: int = settings.REGEXP_WINDOW,
+    ):
+        self.pending = {pattern.pattern: pattern for pattern in patterns}
+        self.evaluator = evaluator
+        self.overlap = overlap
+        self.window = window
+        self.found: set[str] = set()
+        self.timed_out: set[str] = set()
+        self._inline = {
+            regexp
+            for regexp, pattern in self.pending.items()
+            if evaluator.searches_inline(pattern)
+        }
+        self._slice = max(evaluator.inline_limit - 2 * overlap - 1, overlap, 1)
+        self._inline_tail = ''
+        self._pool_tail = ''
+        self._buffer: list[str] = []
+        self._buffered = 0
+
+    @property
+    def done(self) -> bool:
+        """
+        :return: True if there is nothing left to search for
+        """
+        return len(self.pending) == 0
+
+    def _tail(self, text: str) -> str:
+        return text[-(2 * self.overlap + 1):]
+
+    def _start(self, tail: str) -> int:
+        """
+        :return: index of the text after tail to search from, every char of
+        the tail but the one kept for anchors is searched again
+        """
+        return max(len(tail) - 2 * self.overlap, 0)
+
+    def _search_inline(self, chunk: str, final: bool = False):
+        regexps = [regexp for regexp in self.pending if regexp in self._inline]
+        # The last text is searched even if it's only the tail, to settle the
+        # matches ignored at its end
+        end = len(chunk) if len(chunk) > 0 or not final else 1
+        for start in range(0, end, self._slice):
+            if not regexps:
+                return
+            text = self._inline_tail + chunk[start:start + self._slice]
+            pos = self._start(self._inline_tail)
+            margin = 0 if final and start + self._slice >= end else self.overlap
+            for regexp in list(regexps):
+                if search_settled(self.pending[regexp], text, pos, margin):
+                    self.found.add(regexp)
+                    del self.pending[regexp]
+                    regexps.remove(regexp)
+            self._inline_tail = self._tail(text)
+
+    async def _search(self, text: str, pos: int, margin: int, regexp: str):
+        try:
+            if await self.evaluator.search(self.pending[regexp], text, pos, margin):
+                self.found.add(regexp)
+                del self.pending[regexp]
+        except RegexpTimeoutException:
+            self.timed_out.add(regexp)
+            del self.pending[regexp]
+
+    async def _evaluate(self, final: bool = False):
+        text = self._pool_tail + ''.join(self._buffer)
+        pos = self._start(self._pool_tail)
+        margin = 0 if final else self.overlap
+        self._buffer.clear()
+        self._buffered = 0
+
+        await asyncio.gather(*[
+            self._search(text, pos, margin, regexp)
+            for regexp in list(self.pending)
+            if regexp not in self._inline
+        ])
+        self._pool_tail = self._tail(text)
+
+    def _waits_for_pool(self) -> bool:
+        return any(regexp not in self._inline for regexp in self.pending)
+
+    async def feed(self, chunk: str) -> bool:
+        """
+        Adds the next chunk of text. Searches it right away with inline
+        patterns, with the others once a window is filled
+        :param chunk: decoded text
+        :return: True if every pattern is found or timed out
+        """
+        if self.done:
+            return True
+
+        self._search_inline(chunk)
+        if self._waits_for_pool():
+            self._buffer.append(chunk)
+            self._buffered += len(chunk)
+            if self._buffered >= self.window:
+                await self._evaluate()
+
+        return self.done
+
+    async def finish(self, chunk: str = ''):
+        """
+        Searches the rest of the text
+        :param chunk: the last chunk of decoded text
+        """
+        if self.done:
+            return
+
+        self._search_inline(chunk, final=True)
+        if self._waits_for_pool():
+            self._buffer.append(chunk)
+            await self._evaluate(final=True)
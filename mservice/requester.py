@@ -1,47 +1,465 @@
+import asyncio
+import codecs
 import datetime
 import logging
+import re
+import socket
+import ssl
+import time
+from collections import defaultdict
+from contextlib import AbstractAsyncContextManager, AsyncExitStack, asynccontextmanager
 from dataclasses import dataclass
+from typing import AsyncIterator, Callable
 
 import httpx
-from pydantic import AnyUrl, validate_call, NonNegativeInt
+from pydantic import NonNegativeInt
 
 from mservice import settings
+from mservice.failure_log import FailureLog
+from mservice.limiter import HostLimits, HostLimiter, QueueTimeoutException
+from mservice.network_timings import (
+    NetworkTimings, RequestTracer, TimedNetworkBackend
+)
+from mservice.parser import StreamMatcher, RegexpEvaluator
+from mservice.schema.errors import ErrorCode
+from mservice.validator_cache import CachedValidators, ValidatorCache
 
 logger = logging.getLogger(__name__)
 
+# Limiters of hosts without requests are dropped this often, seconds
+HOST_LIMITERS_PRUNE_INTERVAL = 60.0
+
 
 @dataclass(frozen=True, slots=True)
 class RequestSuccessSchema:
     response_time: datetime.timedelta
     http_status: NonNegativeInt
-    body: str
+    # Source texts of patterns which are found or out of their time budget
+    found_patterns: frozenset[str] = frozenset()
+    timed_out_patterns: frozenset[str] = frozenset()
+    # True if the server responded with 304 and results are taken from cache
+    from_cache: bool = False
+    # Time spent waiting for the per-host limits and a send slot, not part of
+    # response_time
+    queue_time: datetime.timedelta = datetime.timedelta(0)
+    # Phases of the request, only if timings are collected
+    timings: NetworkTimings | None = None
+    # Bytes received over the wire, Content-Length if the body isn't read
+    response_size: int | None = None
 
 
 @dataclass(frozen=True, slots=True)
 class RequestFailedSchema:
-    error: str
+    code: ErrorCode
+    # Short text of the exception, None if the code says it all
+    detail: str | None = None
+
+    @property
+    def timed_out(self) -> bool:
+        """
+        True if the request ran out of settings.REQUEST_TIMEOUT
+        """
+        return self.code is ErrorCode.TIMEOUT
+
+
+class BodyTooLargeException(Exception):
+    pass
+
+
+def _caused_by(error: BaseException, exception_type: type) -> bool:
+    """
+    :return: whether the exception or any of its causes (including exception
+    groups of several connection attempts) is of the type
+    """
+    seen = set()
+    stack = [error]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        if isinstance(current, exception_type):
+            return True
+        seen.add(id(current))
+        stack += [
+            cause
+            for cause in (current.__cause__, current.__context__)
+            if cause is not None
+        ]
+        stack += getattr(current, 'exceptions', ())
+
+    return False
+
+
+def classify_error(error: Exception) -> ErrorCode:
+    """
+    :param error: exception raised by a request
+    :return: class of the failure
+    """
+    if isinstance(error, httpx.TimeoutException):
+        return ErrorCode.TIMEOUT
+    if isinstance(error, BodyTooLargeException):
+        return ErrorCode.TOO_LARGE
+    if isinstance(error, (httpx.InvalidURL, httpx.UnsupportedProtocol)):
+        return ErrorCode.INVALID_URL
+    if isinstance(error, (httpx.ProtocolError, httpx.DecodingError)):
+        return ErrorCode.PROTOCOL
+    if _caused_by(error, socket.gaierror):
+        return ErrorCode.DNS
+    if _caused_by(error, ssl.SSLError):
+        return ErrorCode.TLS
+    if _caused_by(error, ConnectionRefusedError):
+        return ErrorCode.CONNECT_REFUSED
+    if isinstance(error, httpx.ConnectError):
+        return ErrorCode.CONNECT
+    if isinstance(error, httpx.NetworkError):
+        return ErrorCode.NETWORK
+
+    return ErrorCode.UNKNOWN
+
 
+def _error_detail(error: Exception) -> str:
+    """
+    :return: text of the exception cut to settings.ERROR_DETAIL_MAX_LENGTH,
+    its type if it has no text
+    """
+    return (str(error) or type(error).__name__)[:settings.ERROR_DETAIL_MAX_LENGTH]
 
-@validate_call
-async def request_url(url: AnyUrl) -> RequestSuccessSchema | RequestFailedSchema:
+
+def _text_decoder(response: httpx.Response) -> codecs.IncrementalDecoder:
     """
-    Makes a request to the provided URL and returns all needed metadata.
-    :param url: URL to look at
-    :return: RequestSuccessSchema if everything is fine or RequestFailedSchema
-    when encountered an error
+    Creates an incremental decoder for response body chunks
+    :param response: response with headers received
+    :return: decoder for the response charset, UTF-8 if it is unknown
     """
     try:
-        async with httpx.AsyncClient() as client:
-            r = await client.get(
-                str(url),
-                timeout=settings.REQUEST_TIMEOUT
-            )
+        decoder_class = codecs.getincrementaldecoder(response.encoding or 'utf-8')
+    except LookupError:
+        decoder_class = codecs.getincrementaldecoder('utf-8')
+
+    return decoder_class(errors='replace')
+
+
+def _response_size(response: httpx.Response, body_complete: bool) -> int | None:
+    """
+    :param response: response with headers received
+    :param body_complete: if the body was read to its end
+    :return: declared size, bytes read if it isn't declared and the body was
+    read in full
+    """
+    try:
+        return int(response.headers['content-length'])
+    except (KeyError, ValueError):
+        return response.num_bytes_downloaded if body_complete else None
+
+
+def url_host(url: str) -> str:
+    """
+    Cheap host extraction for URLs which are already normalized by pydantic,
+    called for every request
+    :param url: absolute URL
+    :return: host, IPv6 addresses are kept in brackets
+    """
+    netloc = url.split('/', 3)[2].partition('?')[0].partition('#')[0]
+    host = netloc.rpartition('@')[2]
+    if host.startswith('['):
+        return host[:host.find(']') + 1]
+
+    return host.partition(':')[0]
+
+
+@asynccontextmanager
+async def _send_slot(
+        slot: Callable[[], AbstractAsyncContextManager[None]] | None,
+        deadline: float | None,
+) -> AsyncIterator[None]:
+    """
+    Waits for a slot until the deadline, holds it until exit
+    :param slot: [optional] factory of the slot context manager
+    :param deadline: [optional] loop time to give up waiting at
+    :raise QueueTimeoutException: no free slot until the deadline
+    """
+    async with AsyncExitStack() as stack:
+        if slot is not None:
+            try:
+                async with asyncio.timeout_at(deadline):
+                    await stack.enter_async_context(slot())
+            except TimeoutError as e:
+                raise QueueTimeoutException(
+                    "No free send slot until the deadline"
+                ) from e
+        yield
+
+
+class Requester:
+    """
+    Long-lived HTTP requester. Owns one pooled httpx client, so connections
+    (and TLS sessions) are reused between scans of the same host. Requests to
+    every host are limited by concurrency and rate, requests over the limits
+    are queued.
+
+    Should be used as an async context manager, which closes the pool on exit.
+    """
+
+    def __init__(
+            self,
+            max_connections: int = settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections: int = settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry: float = settings.HTTP_KEEPALIVE_EXPIRY,
+            max_connections_per_host: int = settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+            host_rate_limit: float = settings.HTTP_HOST_RATE_LIMIT,
+            host_rate_burst: int = settings.HTTP_HOST_RATE_BURST,
+            max_body_size: int = settings.MAX_BODY_SIZE,
+            max_drain_size: int = settings.HTTP_MAX_DRAIN_SIZE,
+            regexp_window: int = settings.REGEXP_WINDOW,
+            regexp_overlap: int = settings.REGEXP_OVERLAP,
+            evaluator: RegexpEvaluator | None = None,
+            validator_cache: ValidatorCache | None = None,
+            validator_cache_path: str | None = settings.VALIDATOR_CACHE_PATH,
+            collect_timings: bool = settings.HTTP_TIMINGS,
+    ):
+        self._max_body_size = max_body_size
+        self._max_drain_size = max_drain_size
+        self._regexp_window = regexp_window
+        self._regexp_overlap = regexp_overlap
+        self._evaluator = evaluator or RegexpEvaluator()
+        self._validator_cache = validator_cache or ValidatorCache(
+            settings.VALIDATOR_CACHE_SIZE
+        )
+        self._validator_cache_path = validator_cache_path
+        if validator_cache_path is not None:
+            self._validator_cache.load(validator_cache_path)
+        self._collect_timings = collect_timings
+        self._failures = FailureLog(settings.FAILURE_LOG_INTERVAL)
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+        if collect_timings:
+            # httpx 0.24 doesn't accept a network backend, so the one of the
+            # underlying httpcore pool is wrapped to time DNS
+            pool = transport._pool
+            pool._network_backend = TimedNetworkBackend(pool._network_backend)
+        self._client = httpx.AsyncClient(
+            timeout=settings.REQUEST_TIMEOUT, transport=transport
+        )
+        # httpx only limits the pool as a whole, so connections per host
+        # are bounded by the amount of simultaneous requests to it
+        self.default_limits = HostLimits(
+            max_concurrency=max_connections_per_host,
+            rate=host_rate_limit,
+            burst=host_rate_burst,
+        )
+        self._host_limiters: defaultdict[str, HostLimiter] = defaultdict(
+            lambda: HostLimiter(self.default_limits)
+        )
+        self._limiters_pruned_at = time.monotonic()
+
+    async def __aenter__(self) -> 'Requester':
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """
+        Closes all pooled connections
+        """
+        logger.info("Closing HTTP connection pool")
+        self._failures.flush()
+        await self._client.aclose()
+        self._evaluator.close()
+        if self._validator_cache_path is not None:
+            self._validator_cache.save(self._validator_cache_path)
+
+    def _prune_host_limiters(self):
+        """
+        Drops limiters of idle hosts every HOST_LIMITERS_PRUNE_INTERVAL
+        seconds, so hosts which aren't requested anymore don't pile up
+        """
+        now = time.monotonic()
+        if now - self._limiters_pruned_at < HOST_LIMITERS_PRUNE_INTERVAL:
+            return
+
+        self._limiters_pruned_at = now
+        idle = [host for host, limiter in self._host_limiters.items() if limiter.idle]
+        for host in idle:
+            del self._host_limiters[host]
+
+    @asynccontextmanager
+    async def _stream(
+            self,
+            url: str,
+            cached: CachedValidators | None,
+            tracer: RequestTracer | None,
+    ) -> AsyncIterator[httpx.Response]:
+        """
+        Opens a streaming GET request, traced if the tracer is given
+        :param url: URL to request
+        :param cached: [optional] validators to make a conditional request
+        :param tracer: [optional] tracer to collect timings of the request
+        :return: response with headers received
+        """
+        headers = cached.headers() if cached else None
+        if tracer is None:
+            async with self._client.stream('GET', url, headers=headers) as r:
+                yield r
+            return
+
+        with tracer.active():
+            async with self._client.stream(
+                'GET', url, headers=headers, extensions={'trace': tracer}
+            ) as r:
+                yield r
+
+    async def _drain(self, chunks: AsyncIterator[bytes]) -> bool:
+        """
+        Reads the rest of a body without looking at it. A connection is only
+        returned to the pool once its response is read to the end, bodies
+        over the max drain size aren't worth it and the connection is closed.
+        :param chunks: body chunks which are left
+        :return: whether the body was read to its end
+        """
+        drained = 0
+        async for chunk in chunks:
+            drained += len(chunk)
+            if drained > self._max_drain_size:
+                return False
+
+        return True
+
+    async def _search_body(
+            self, response: httpx.Response, patterns: tuple[re.Pattern, ...]
+    ) -> tuple[set[str], set[str], bool]:
+        """
+        Streams the response body through the patterns search. Stops
+        searching as soon as every pattern is found, so the full body is never
+        kept. The rest of the body (or the whole one if there are no patterns)
+        is drained up to the max drain size to keep the connection.
+        :param response: opened streaming response
+        :param patterns: patterns to search for
+        :return: found and timed out patterns, whether the body was read to
+        its end
+        :raises BodyTooLargeException: if the body exceeds the max size before
+        all the patterns are found
+        """
+        if len(patterns) == 0:
+            return set(), set(), await self._drain(response.aiter_bytes())
+
+        matcher = StreamMatcher(
+            patterns,
+            self._evaluator,
+            overlap=self._regexp_overlap,
+            window=self._regexp_window,
+        )
+        decoder = _text_decoder(response)
+        body_size = 0
+
+        chunks = response.aiter_bytes()
+        async for chunk in chunks:
+            if await matcher.feed(decoder.decode(chunk)):
+                complete = await self._drain(chunks)
+                return matcher.found, matcher.timed_out, complete
+
+            body_size += len(chunk)
+            if body_size > self._max_body_size:
+                raise BodyTooLargeException(
+                    f"Response body exceeds {self._max_body_size} bytes"
+                )
+
+        await matcher.finish(decoder.decode(b'', final=True))
+
+        return matcher.found, matcher.timed_out, True
+
+    async def request_url(
+            self,
+            url: str,
+            patterns: tuple[re.Pattern, ...] = (),
+            max_concurrency: int | None = None,
+            rate_limit: float | None = None,
+            queue_deadline: float | None = None,
+            send_slot: Callable[[], AbstractAsyncContextManager[None]] | None = None,
+    ) -> RequestSuccessSchema | RequestFailedSchema:
+        """
+        Makes a request to the provided URL and returns all needed metadata.
+        Several patterns can be checked against one response, so monitors of
+        the same URL share a single request.
+
+        Known validators of the URL are sent as a conditional request. On 304
+        regexp results and the status of the cached response are reused
+        without searching a body.
+
+        The request waits for the limits of its host first, and only then
+        for the send slot, so requests queued behind a slow host don't hold
+        send slots. Given overrides apply to this request only and can't
+        raise the limits of the host.
+
+        Arguments aren't validated: they come from validated monitors.
+        :param url: URL to look at
+        :param patterns: patterns to search in the response body
+        :param max_concurrency: max simultaneous requests to the host
+        :param rate_limit: max requests per second to the host
+        :param queue_deadline: [optional] loop time to stop waiting for the
+        host limits and the send slot at
+        :param send_slot: [optional] factory of a slot held while the request
+        is sent, e.g. a slot of the global concurrency limit
+        :return: RequestSuccessSchema if everything is fine or
+        RequestFailedSchema when encountered an error
+        :raise QueueTimeoutException: the request wasn't sent until
+        the queue deadline
+        """
+        url_key = str(url)
+        regexps = {pattern.pattern for pattern in patterns}
+        cached = self._validator_cache.get(url_key, regexps)
+        host = url_host(url_key)
+        self._prune_host_limiters()
+        limiter = self._host_limiters[host]
+
+        tracer = RequestTracer() if self._collect_timings else None
+        try:
+            queued_at = time.monotonic()
+            async with (
+                limiter.slot(max_concurrency, rate_limit, queue_deadline),
+                _send_slot(send_slot, queue_deadline),
+            ):
+                queue_time = time.monotonic() - queued_at
+                async with self._stream(url_key, cached, tracer) as r:
+                    headers_at = time.perf_counter()
+                    if cached is not None and r.status_code == 304:
+                        from_cache = True
+                        http_status = cached.http_status
+                        found = set(cached.found_patterns & regexps)
+                        timed_out: set[str] = set()
+                        complete = await self._drain(r.aiter_bytes())
+                    else:
+                        from_cache = False
+                        http_status = r.status_code
+                        found, timed_out, complete = await self._search_body(
+                            r, patterns
+                        )
+                        self._validator_cache.put(
+                            url_key, r, regexps - timed_out, found
+                        )
+                    if tracer is not None:
+                        tracer.timings.download = (
+                            time.perf_counter() - headers_at
+                        )
 
             return RequestSuccessSchema(
                 response_time=r.elapsed,
-                http_status=r.status_code,
-                body=r.text,
+                http_status=http_status,
+                found_patterns=frozenset(found),
+                timed_out_patterns=frozenset(timed_out),
+                from_cache=from_cache,
+                queue_time=datetime.timedelta(seconds=queue_time),
+                timings=None if tracer is None else tracer.timings,
+                response_size=_response_size(r, complete),
             )
-    except Exception as e:
-        logger.exception(f"Failed getting {url} page")
-        return RequestFailedSchema(error=str(e))
+        except QueueTimeoutException:
+            raise
+        except Exception as e:
+            code = classify_error(e)
+            self._failures.record(code, host, e)
+            return RequestFailedSchema(code, _error_detail(e))
@@ -1,108 +1,588 @@
 import asyncio
 import logging
+import os
 import time
 from asyncio import CancelledError
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 
-from asyncpg import Connection
+from asyncpg import Pool
 
 from mservice import settings
-from mservice.database.base import create_connection
+from mservice.concurrency import AdaptiveConcurrency
+from mservice.database.base import create_pool, observe_pool
 from mservice.database.models import MonitorModel
 from mservice.database.monitor_dao import MonitorDao
-from mservice.parser import find_pattern
-from mservice.requester import request_url, RequestFailedSchema
+from mservice.limiter import QueueTimeoutException
+from mservice.metrics import registry
+from mservice.network_timings import NetworkTimings
+from mservice.requester import (
+    Requester, RequestFailedSchema, RequestSuccessSchema
+)
+from mservice.schema.errors import ErrorCode
 from mservice.schema.metrics import SiteMetricSchema
-from mservice.utils import utc_tz_now
+from mservice.utils import utc_tz_now, unique_worker_id
 
 logger = logging.getLogger(__name__)
 
 
-async def _sync_item(item: MonitorModel) -> tuple[int, SiteMetricSchema]:
+SCANS = registry.counter(
+    'mservice_scans_total', 'Monitor scan results saved by the worker'
+)
+REQUESTS = registry.counter(
+    'mservice_requests_total', 'HTTP requests made by the worker'
+)
+SCAN_DURATION = registry.histogram(
+    'mservice_scan_duration_seconds',
+    'Duration of one URL request, including queueing and the body search',
+)
+QUEUE_TIMEOUTS = registry.counter(
+    'mservice_queue_timeouts_total',
+    'Monitor scans skipped after waiting in queues until their lease margin',
+)
+SCHEDULE_LAG = registry.histogram(
+    'mservice_schedule_lag_seconds',
+    'Delay between the scheduled and the actual claim time of monitors',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+BATCH_SIZE = registry.histogram(
+    'mservice_batch_size',
+    'Monitors claimed at once',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+BATCH_DURATION = registry.histogram(
+    'mservice_batch_duration_seconds',
+    'Duration of one sync batch, including claiming and persisting',
+)
+CONCURRENCY_LIMIT = registry.gauge(
+    'mservice_concurrency_limit', 'Current limit of scans in flight'
+)
+SCANS_IN_FLIGHT = registry.gauge(
+    'mservice_scans_in_flight', 'Scans which are currently in flight'
+)
+SCANS_WAITING = registry.gauge(
+    'mservice_scans_waiting', 'Scans waiting for a slot under the concurrency limit'
+)
+CONCURRENCY_LOOP_LAG = registry.gauge(
+    'mservice_concurrency_loop_lag_seconds',
+    'Max event loop lag seen by the latest concurrency adjustment',
+)
+CONCURRENCY_TIMEOUT_RATE = registry.gauge(
+    'mservice_concurrency_timeout_rate',
+    'Share of timed out requests seen by the latest concurrency adjustment',
+)
+
+
+NO_TIMINGS = NetworkTimings()
+
+
+def _ms(seconds: float | None) -> int | None:
+    return None if seconds is None else round(seconds * 1000)
+
+
+def _scan_result(
+        item: MonitorModel,
+        request_result: RequestSuccessSchema | RequestFailedSchema,
+        request_time: datetime,
+) -> SiteMetricSchema:
     """
-    Makes a request to the server and returns a populated metric.
+    Converts a request result into a metric of one monitor.
     :param item: monitor to work with
+    :param request_result: result of the monitor URL request
+    :param request_time: time of the request
     :return: populated metric
     """
-    request_result = await request_url(item.url)
-    request_time = utc_tz_now()
-
     if isinstance(request_result, RequestFailedSchema):
-        return item.id, SiteMetricSchema.from_error(request_result.error)
-
-    regexp_found = (
-        False
-        if item.regexp is None
-        else find_pattern(request_result.body, item.regexp)
-    )
+        return SiteMetricSchema.from_error(
+            request_result.code, request_result.detail
+        )
 
+    regexp = None if item.pattern is None else item.pattern.pattern
     response_time_ms = round(request_result.response_time.total_seconds() * 1000)
-    scan_result_item = SiteMetricSchema(
+    queue_time_ms = round(request_result.queue_time.total_seconds() * 1000)
+    timings = request_result.timings or NO_TIMINGS
+
+    return SiteMetricSchema(
         ts=request_time,
         response_time_ms=response_time_ms,
         http_status=request_result.http_status,
-        regexp_found=regexp_found,
-        error=None
+        regexp_found=regexp in request_result.found_patterns,
+        error_code=(
+            ErrorCode.REGEXP_TIMEOUT
+            if regexp in request_result.timed_out_patterns
+            else None
+        ),
+        from_cache=request_result.from_cache,
+        queue_time_ms=queue_time_ms,
+        dns_ms=_ms(timings.dns),
+        connect_ms=_ms(timings.connect),
+        tls_ms=_ms(timings.tls),
+        ttfb_ms=_ms(timings.ttfb),
+        download_ms=_ms(timings.download),
+        response_size=request_result.response_size,
+    )
+
+
+async def _sync_group(
+        items: list[MonitorModel],
+        requester: Requester,
+        concurrency: AdaptiveConcurrency | None = None,
+        queue_deadline: float | None = None,
+) -> list[tuple[int, SiteMetricSchema]]:
+    """
+    Makes one request for monitors of the same URL and returns a populated
+    metric for every monitor. The strictest per-host limits overrides of the
+    monitors are applied to the request.
+    :param items: monitors with the same URL
+    :param requester: shared HTTP requester
+    :param concurrency: [optional] controller to take a scan slot from once
+    the host limits let the request go, and to report its outcome to
+    :param queue_deadline: [optional] loop time to stop waiting for the host
+    limits and the scan slot at, no metrics are returned if the request isn't
+    sent until then
+    :return: populated metrics
+    """
+    patterns = {
+        item.pattern.pattern: item.pattern
+        for item in items
+        if item.pattern is not None
+    }
+    max_concurrency = [
+        item.host_max_concurrency
+        for item in items
+        if item.host_max_concurrency is not None
+    ]
+    rate_limit = [
+        item.host_rate_limit
+        for item in items
+        if item.host_rate_limit is not None
+    ]
+    request_start = time.perf_counter()
+    try:
+        request_result = await requester.request_url(
+            items[0].url,
+            tuple(patterns.values()),
+            min(max_concurrency, default=None),
+            min(rate_limit, default=None),
+            queue_deadline,
+            None if concurrency is None else concurrency.slot,
+        )
+    except QueueTimeoutException:
+        logger.debug(f"Skipped {len(items)} monitors of {items[0].url}: queued")
+        QUEUE_TIMEOUTS.inc(len(items))
+        return []
+    SCAN_DURATION.observe(time.perf_counter() - request_start)
+    request_time = utc_tz_now()
+    REQUESTS.inc()
+
+    if concurrency is not None:
+        if isinstance(request_result, RequestFailedSchema):
+            concurrency.record(None, request_result.timed_out)
+        else:
+            concurrency.record(request_result.response_time.total_seconds())
+
+    return [
+        (item.id, _scan_result(item, request_result, request_time))
+        for item in items
+    ]
+
+
+async def _sync_item(
+        item: MonitorModel, requester: Requester
+) -> tuple[int, SiteMetricSchema]:
+    """
+    Makes a request to the server and returns a populated metric.
+    :param item: monitor to work with
+    :param requester: shared HTTP requester
+    :return: populated metric
+    """
+    [result] = await _sync_group([item], requester)
+    return result
+
+
+def _queue_deadline() -> float:
+    """
+    :return: loop time until which monitors claimed now may wait in queues,
+    so their scans finish before the leases expire
+    """
+    return (
+        asyncio.get_running_loop().time()
+        + settings.LEASE_DURATION
+        - settings.LEASE_SCAN_MARGIN
     )
 
-    return item.id, scan_result_item
+
+def _group_by_url(items: list[MonitorModel]) -> list[list[MonitorModel]]:
+    """
+    Groups monitors by URL, so every URL is requested only once.
+    :param items: monitors to group
+    :return: groups of monitors with the same URL
+    """
+    groups: dict[str, list[MonitorModel]] = defaultdict(list)
+    for item in items:
+        groups[str(item.url)].append(item)
+
+    return list(groups.values())
+
+
+@dataclass(frozen=True, slots=True)
+class WorkerContext:
+    """
+    Resources shared by all sync pipelines of one worker process
+    """
+    pool: Pool
+    requester: Requester
+    # Unique ID of this worker, used as the lease owner
+    owner: str
+    # Limits requests in flight across all the pipelines
+    concurrency: AdaptiveConcurrency
+
+
+async def _claim_items(context: WorkerContext, limit: int) -> list[MonitorModel]:
+    """
+    Claims due monitors by leasing them for settings.LEASE_DURATION.
+    The lease is written in its own short statement, so no transaction
+    is left open while the scans are running. Monitors of the same URLs due
+    within settings.COALESCE_WINDOW are claimed too.
+    :param context: worker resources
+    :param limit: max amount of monitors to claim
+    :return: claimed monitors
+    """
+    async with context.pool.acquire() as connection:
+        mdao = MonitorDao(connection)
+
+        claimed_items = await mdao.claim(
+            limit,
+            context.owner,
+            timedelta(seconds=settings.LEASE_DURATION),
+            timedelta(seconds=settings.COALESCE_WINDOW),
+        )
+
+    if len(claimed_items) > 0:
+        BATCH_SIZE.observe(len(claimed_items))
+        now = utc_tz_now()
+        for item in claimed_items:
+            # Coalesced monitors can be claimed before their time
+            SCHEDULE_LAG.observe(
+                max((now - item.next_sync).total_seconds(), 0)
+            )
+
+    return claimed_items
 
 
-async def _sync_batch(connection: Connection) -> int:
+async def _persist_results(
+        context: WorkerContext, results: list[tuple[int, SiteMetricSchema]]
+):
+    """
+    Saves scan results, reschedules scanned monitors and releases their
+    leases in one short transaction. Results of monitors whose lease was
+    lost to another worker aren't saved, that worker scans them again.
+    :param context: worker resources
+    :param results: scan results
+    """
+    if len(results) == 0:
+        return
+
+    async with context.pool.acquire() as connection:
+        async with connection.transaction():
+            mdao = MonitorDao(connection)
+
+            released = {
+                item.id
+                for item in await mdao.release(
+                    [monitor_id for monitor_id, _ in results], context.owner
+                )
+            }
+            results = [result for result in results if result[0] in released]
+            if len(results) > 0:
+                await mdao.create_log_items_from_schema(results)
+
+    SCANS.inc(len(results))
+
+
+async def _bounded_sync_group(
+        context: WorkerContext,
+        items: list[MonitorModel],
+        queue_deadline: float | None = None,
+) -> list[tuple[int, SiteMetricSchema]]:
+    """
+    Syncs a group of monitors under the current concurrency limit. A scan
+    slot is only taken once the host limits let the request go, so scans
+    queued behind a slow host don't starve the other hosts.
+    :param context: worker resources
+    :param items: monitors with the same URL
+    :param queue_deadline: [optional] loop time to stop waiting for slots at,
+    no metrics are returned if the request isn't sent until then
+    :return: populated metrics
+    """
+    return await _sync_group(
+        items, context.requester, context.concurrency, queue_deadline
+    )
+
+
+async def _sync_batch(context: WorkerContext) -> int:
     """
     Runs one batch of monitors, persists collected metrics and reschedules
     monitors for the next run.
     Uses settings.BATCH_FETCH_AMOUNT in order to determine size of the batch.
-    :param connection: database connection
+    :param context: worker resources
     :return: amount of updated items
     """
-    async with connection.transaction():
-        mdao = MonitorDao(connection)
+    batch_start = time.perf_counter()
+    queue_deadline = _queue_deadline()
+    claimed_items = await _claim_items(context, settings.BATCH_FETCH_AMOUNT)
+
+    if len(claimed_items) == 0:
+        logger.info("No items to sync - skipping")
+        return 0
+
+    groups = _group_by_url(claimed_items)
+    logger.info(f"Syncing {len(claimed_items)} monitors of {len(groups)} URLs")
+
+    group_results = await asyncio.gather(
+        *[
+            _bounded_sync_group(context, group, queue_deadline)
+            for group in groups
+        ]
+    )
+
+    await _persist_results(
+        context, [result for group in group_results for result in group]
+    )
+
+    BATCH_DURATION.observe(time.perf_counter() - batch_start)
+    logger.info("Sync finished")
+
+    return len(claimed_items)
+
+
+async def _sync_pipeline(context: WorkerContext):
+    """
+    Runs monitors as a continuous pipeline. Keeps up to
+    settings.PIPELINE_CONCURRENCY claimed monitors in flight, refills free
+    slots with newly claimed monitors and persists every scan as soon as it
+    finishes, so one slow site doesn't hold results of the others. A failed
+    scan or save is logged, its monitors are picked up again once the leases
+    expire.
+    :param context: worker resources
+    """
+    # Scan tasks with the amount of monitors they hold, coalesced monitors
+    # of one URL share a task
+    in_flight: dict[asyncio.Task, int] = {}
+    next_claim_time = 0.0
 
-        unlocked_items = await mdao.select_unlocked(settings.BATCH_FETCH_AMOUNT)
+    try:
+        while True:
+            free_slots = settings.PIPELINE_CONCURRENCY - sum(in_flight.values())
+            if free_slots > 0 and time.monotonic() >= next_claim_time:
+                queue_deadline = _queue_deadline()
+                claimed_items = await _claim_items(context, free_slots)
+                if len(claimed_items) > 0:
+                    logger.debug(f"Claimed {len(claimed_items)} monitors")
+                for group in _group_by_url(claimed_items):
+                    task = asyncio.create_task(
+                        _bounded_sync_group(context, group, queue_deadline)
+                    )
+                    in_flight[task] = len(group)
+                # Nothing else is due yet - don't hit the DB on every scan
+                if len(claimed_items) < free_slots:
+                    next_claim_time = time.monotonic() + settings.POLL_INTERVAL
+                free_slots -= len(claimed_items)
 
-        if len(unlocked_items) == 0:
-            logger.info("No items to sync - skipping")
+            # Free slots are refilled on the next claim time, full ones are
+            # checked at least every poll interval
+            timeout = (
+                max(next_claim_time - time.monotonic(), 0)
+                if free_slots > 0
+                else settings.POLL_INTERVAL
+            )
+            if len(in_flight) == 0:
+                await asyncio.sleep(timeout)
+                continue
 
-        logger.info(f"Syncing {len(unlocked_items)} monitors")
+            done, _ = await asyncio.wait(
+                in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
 
-        results = await asyncio.gather(
-            *[_sync_item(item) for item in unlocked_items]
+            results = []
+            for task in done:
+                del in_flight[task]
+                try:
+                    results.extend(task.result())
+                except Exception:
+                    logger.exception("Scan failed, its monitors will be retried")
+            if len(results) > 0:
+                try:
+                    await _persist_results(context, results)
+                except Exception:
+                    logger.exception(
+                        f"Failed to persist {len(results)} scan results, "
+                        f"their monitors will be retried"
+                    )
+                else:
+                    logger.debug(f"Persisted {len(results)} scan results")
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+
+async def _run_batches(context: WorkerContext):
+    """
+    Runs batches one after another, sleeping for settings.POLL_INTERVAL
+    between sync cycles.
+    :param context: worker resources
+    """
+    while True:
+        task_start_time = time.time()
+        logger.debug("Starting a new monitor sync cycle")
+        while (sync_count := await _sync_batch(context)) > 0:
+            logger.debug(f"Synced {sync_count} items")
+        task_elapsed_time = time.time() - task_start_time
+        logger.debug(
+            f"Finishing monitor sync cycle "
+            f"(it took {task_elapsed_time} seconds)"
         )
 
-        await mdao.create_log_items_from_schema(results)
+        if sync_count >= settings.BATCH_FETCH_AMOUNT:
+            logger.debug("Skipping waiting - max amount")
+        if task_elapsed_time < settings.POLL_INTERVAL:
+            sleep_time = settings.POLL_INTERVAL - task_elapsed_time
+            logger.debug(f"Going to sleep for {sleep_time} seconds")
+            await asyncio.sleep(sleep_time)
+
 
-        await mdao.reschedule([item.id for item in unlocked_items])
+async def _log_throughput(interval: float, concurrency: AdaptiveConcurrency):
+    """
+    Periodically logs throughput of this worker process, so scaling with
+    several processes can be checked.
+    :param interval: seconds between log messages
+    :param concurrency: controller to report the concurrency limit of
+    """
+    last_time = time.monotonic()
+    last_scans, last_requests = SCANS.value, REQUESTS.value
+
+    while True:
+        await asyncio.sleep(interval)
+
+        now = time.monotonic()
+        elapsed = now - last_time
+        logger.info(
+            f"Worker process {os.getpid()} throughput: "
+            f"{(SCANS.value - last_scans) / elapsed:.1f} scans/sec, "
+            f"{(REQUESTS.value - last_requests) / elapsed:.1f} requests/sec, "
+            f"concurrency limit {concurrency.limit} "
+            f"({concurrency.active} in flight)"
+        )
+        last_time = now
+        last_scans, last_requests = SCANS.value, REQUESTS.value
 
-        logger.info("Sync finished")
 
-    return len(unlocked_items)
+def _latest_decision(concurrency: AdaptiveConcurrency, field: str) -> float:
+    """
+    :param concurrency: controller to read the decision of
+    :param field: ConcurrencyDecision field
+    :return: value of the field in the latest decision, 0 if there is none
+    """
+    if not concurrency.decisions:
+        return 0.0
+    return getattr(concurrency.decisions[-1], field)
 
 
-async def monitors_update_task():
+def _create_concurrency() -> AdaptiveConcurrency:
+    """
+    :return: scans concurrency controller configured by settings, with a fixed
+    limit if settings.ADAPTIVE_CONCURRENCY is disabled
+    """
+    return AdaptiveConcurrency(
+        min_limit=settings.CONCURRENCY_MIN,
+        max_limit=settings.WORKER_MAX_IN_FLIGHT,
+        initial_limit=(
+            settings.CONCURRENCY_INITIAL
+            if settings.ADAPTIVE_CONCURRENCY
+            else settings.WORKER_MAX_IN_FLIGHT
+        ),
+        increase=settings.CONCURRENCY_INCREASE,
+        decrease=settings.CONCURRENCY_DECREASE,
+        max_loop_lag=settings.CONCURRENCY_MAX_LOOP_LAG,
+        max_timeout_rate=settings.CONCURRENCY_MAX_TIMEOUT_RATE,
+        latency_tolerance=settings.CONCURRENCY_LATENCY_TOLERANCE,
+    )
+
+
+SYNC_MODES = {
+    'batch': _run_batches,
+    'pipeline': _sync_pipeline,
+}
+
+
+async def monitors_update_task(
+        validator_cache_path: str | None = settings.VALIDATOR_CACHE_PATH,
+):
     """
     Task for periodical monitor updates.
-    Uses only one connection. Can be furter
+    Runs settings.WORKER_PIPELINES sync pipelines concurrently, so DB and HTTP
+    latencies overlap. All of them share one connection pool and one pooled
+    HTTP requester, which are closed when the task exits. Sync mode is
+    selected by settings.SYNC_MODE.
+    :param validator_cache_path: [optional] file to keep validators in
     """
-    connection = await create_connection()
+    run_sync = SYNC_MODES[settings.SYNC_MODE]
+    pool = await create_pool(
+        min_size=settings.WORKER_DB_POOL_SIZE,
+        max_size=settings.WORKER_DB_POOL_SIZE,
+    )
+    context = WorkerContext(
+        pool=pool,
+        requester=Requester(validator_cache_path=validator_cache_path),
+        owner=unique_worker_id(),
+        concurrency=_create_concurrency(),
+    )
+    CONCURRENCY_LIMIT.set_function(lambda: context.concurrency.limit)
+    SCANS_IN_FLIGHT.set_function(lambda: context.concurrency.active)
+    SCANS_WAITING.set_function(lambda: context.concurrency.waiting)
+    CONCURRENCY_LOOP_LAG.set_function(
+        lambda: _latest_decision(context.concurrency, 'loop_lag')
+    )
+    CONCURRENCY_TIMEOUT_RATE.set_function(
+        lambda: _latest_decision(context.concurrency, 'timeout_rate')
+    )
+    observe_pool(pool)
 
-    try:
-        while True:
-            task_start_time = time.time()
-            logger.debug("Starting a new monitor sync cycle")
-            while (sync_count := await _sync_batch(connection)) > 0:
-                logger.debug(f"Synced {sync_count} items")
-            task_elapsed_time = time.time() - task_start_time
-            logger.debug(
-                f"Finishing monitor sync cycle "
-                f"(it took {task_elapsed_time} seconds)"
-            )
+    logger.info(
+        f"Running {settings.WORKER_PIPELINES} monitors sync pipelines "
+        f"in {settings.SYNC_MODE} mode as {context.owner}"
+    )
 
-            if sync_count >= settings.BATCH_FETCH_AMOUNT:
-                logger.debug("Skipping waiting - max amount")
-            if task_elapsed_time < settings.POLL_INTERVAL:
-                sleep_time = settings.POLL_INTERVAL - task_elapsed_time
-                logger.debug(f"Going to sleep for {sleep_time} seconds")
-                await asyncio.sleep(sleep_time)
+    background_tasks = [
+        asyncio.create_task(
+            _log_throughput(settings.THROUGHPUT_LOG_INTERVAL, context.concurrency)
+        ),
+    ]
+    if settings.ADAPTIVE_CONCURRENCY:
+        background_tasks.append(asyncio.create_task(
+            context.concurrency.run(settings.CONCURRENCY_ADJUST_INTERVAL)
+        ))
+
+    try:
+        await asyncio.gather(
+            *[run_sync(context) for _ in range(settings.WORKER_PIPELINES)]
+        )
     except CancelledError:
         logger.info("The task is cancelled - application is aborting")
-        await connection.close()
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        for gauge in (
+                CONCURRENCY_LIMIT,
+                SCANS_IN_FLIGHT,
+                SCANS_WAITING,
+                CONCURRENCY_LOOP_LAG,
+                CONCURRENCY_TIMEOUT_RATE,
+        ):
+            gauge.set_function(None)
+        observe_pool(None)
+        try:
+            await context.requester.close()
+        finally:
+            await pool.close()
@@ -0,0 +1,29 @@
+from enum import IntEnum
+
+
+class ErrorCode(IntEnum):
+    """
+    Classes of failed scans, stored as monitor_log.error_code. Values are
+    persisted, so they must never be changed or reused.
+    """
+    UNKNOWN = 0
+    # Host can't be resolved
+    DNS = 1
+    # Host is resolved, but nothing listens on the port
+    CONNECT_REFUSED = 2
+    # Other errors of opening a connection, e.g. no route to host
+    CONNECT = 3
+    # Any of connect, read, write or pool timeouts
+    TIMEOUT = 4
+    # Handshake or certificate verification failed
+    TLS = 5
+    # Malformed HTTP response
+    PROTOCOL = 6
+    # Connection broken while the request was in progress
+    NETWORK = 7
+    # Body exceeds MAX_BODY_SIZE without a match
+    TOO_LARGE = 8
+    # Regexp search exceeded REGEXP_TIME_BUDGET
+    REGEXP_TIMEOUT = 9
+    # URL can't be requested, e.g. unsupported scheme
+    INVALID_URL = 10
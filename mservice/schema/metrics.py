@@ -1,10 +1,11 @@
 import datetime
+from dataclasses import dataclass
 from typing import Annotated
 
 from pydantic import NonNegativeInt, conint
-from pydantic.dataclasses import dataclass
 
 from mservice import settings
+from mservice.schema.errors import ErrorCode
 from mservice.utils import utc_tz_now
 
 FrequencySec = Annotated[
@@ -12,21 +13,43 @@ FrequencySec = Annotated[
 ]
 
 
+# Not validated - it's built by the worker for every scan from trusted results
 @dataclass(frozen=True, slots=True)
 class SiteMetricSchema:
 
     @staticmethod
-    def from_error(error: str) -> 'SiteMetricSchema':
+    def from_error(
+            code: ErrorCode, detail: str | None = None
+    ) -> 'SiteMetricSchema':
         return SiteMetricSchema(
             ts=utc_tz_now(),
             response_time_ms=0,
             http_status=0,
             regexp_found=False,
-            error=error
+            error_code=code,
+            from_cache=False,
+            queue_time_ms=0,
+            error_detail=detail,
         )
 
     ts: datetime.datetime
     response_time_ms: NonNegativeInt
     http_status: NonNegativeInt
     regexp_found: bool
-    error: str | None
+    # None if the scan succeeded
+    error_code: ErrorCode | None
+    # True if the result is reused after a 304 response
+    from_cache: bool
+    # Time spent waiting for the per-host limits before the request
+    queue_time_ms: NonNegativeInt
+    # Request phases, only if settings.HTTP_TIMINGS is on and the phase
+    # happened: a reused connection has no DNS, connect and TLS
+    dns_ms: NonNegativeInt | None = None
+    connect_ms: NonNegativeInt | None = None
+    tls_ms: NonNegativeInt | None = None
+    ttfb_ms: NonNegativeInt | None = None
+    download_ms: NonNegativeInt | None = None
+    # Bytes received, Content-Length if the body wasn't read
+    response_size: NonNegativeInt | None = None
+    # Short text of the failure, stored once in error_details
+    error_detail: str | None = None
@@ -1,17 +1,166 @@
 import os
+from typing import Literal, cast, get_args
+
+ReschedulePolicy = Literal["delay", "anchor", "phase"]
 
 # SHARED SETTINGS
 DB_CONNECTION_STRING = os.environ.get("DB_CONNECTION_STRING")
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# Raw monitor_log chunks older than these days are compressed and dropped,
+# 0 - never. Hourly and daily rollups are kept forever
+LOG_COMPRESS_AFTER_DAYS = int(os.environ.get("LOG_COMPRESS_AFTER_DAYS", 7))
+LOG_RETENTION_DAYS = int(os.environ.get("LOG_RETENTION_DAYS", 30))
 
 
 # API-SPECIFIC SETTINGS
+# API connection pool. MIN_POOL_SIZE connections are opened and warmed up on
+# startup, and idle ones aren't closed unless POOL_IDLE_LIFETIME is set
 DB_MAX_POOL_SIZE = int(os.environ.get("MAX_POOL_SIZE", 5))
+DB_MIN_POOL_SIZE = int(os.environ.get("MIN_POOL_SIZE", DB_MAX_POOL_SIZE))
+DB_POOL_IDLE_LIFETIME = float(os.environ.get("POOL_IDLE_LIFETIME", 0))
+# Seconds a request waits for a free connection before it's answered with 503
+DB_ACQUIRE_TIMEOUT = float(os.environ.get("DB_ACQUIRE_TIMEOUT", 5))
 MIN_PING_INTERVAL = int(os.environ.get("MIN_PING_INTERVAL", 5))
 MAX_PING_INTERVAL = int(os.environ.get("MIN_PING_INTERVAL", 300))
+# Max part of the interval to delay the first sync of a new monitor by
+INITIAL_SYNC_JITTER = float(os.environ.get("INITIAL_SYNC_JITTER", 0))
+# Part of the interval the first syncs of monitors created by one bulk request
+# are spread over
+BULK_SYNC_SPREAD = float(os.environ.get("BULK_SYNC_SPREAD", 1.0))
+# Max amount of monitors in one bulk creation request
+BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", 50000))
+# Max size of one bulk creation request body, bytes
+BULK_MAX_BODY_SIZE = int(
+    os.environ.get("BULK_MAX_BODY_SIZE", 32 * 1024 * 1024)
+)
+# Max amount of buckets returned by the monitor metrics query, bigger ranges
+# get bigger buckets
+METRICS_MAX_POINTS = int(os.environ.get("METRICS_MAX_POINTS", 500))
+# Range of the monitor metrics query if it isn't set, seconds
+METRICS_DEFAULT_RANGE = int(os.environ.get("METRICS_DEFAULT_RANGE", 24 * 3600))
+# Page size of the monitors listing if it isn't set and its max
+LIST_DEFAULT_LIMIT = int(os.environ.get("LIST_DEFAULT_LIMIT", 100))
+LIST_MAX_LIMIT = int(os.environ.get("LIST_MAX_LIMIT", 1000))
+# Max amount of monitors in one status request
+STATUS_MAX_IDS = int(os.environ.get("STATUS_MAX_IDS", 1000))
+# Active monitors with next_sync older than these seconds are listed as overdue
+MONITOR_OVERDUE_AFTER = int(os.environ.get("MONITOR_OVERDUE_AFTER", 60))
 
 
 # WORKER-SPECIFIC SETTINGS
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", 1))
+WORKER_UVLOOP = os.environ.get("WORKER_UVLOOP", "false").lower() == "true"
+# Seconds to wait before restarting a crashed worker process
+WORKER_RESTART_DELAY = float(os.environ.get("WORKER_RESTART_DELAY", 1))
+# Seconds worker processes have to stop before they are killed
+WORKER_SHUTDOWN_TIMEOUT = float(os.environ.get("WORKER_SHUTDOWN_TIMEOUT", 30))
+# Port of the worker metrics listener, 0 - disabled. Worker processes of
+# a supervisor listen on consecutive ports starting from this one
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", 9100))
+# Seconds between throughput log messages of every worker process
+THROUGHPUT_LOG_INTERVAL = float(os.environ.get("THROUGHPUT_LOG_INTERVAL", 60))
 POLL_INTERVAL = float(os.environ.get("POLL_INTERVAL", 1))
 BATCH_FETCH_AMOUNT = int(os.environ.get("BATCH_FETCH_AMOUNT", 100))
 REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", 5.0))
+# "batch" waits for the whole batch, "pipeline" persists every scan on finish
+SYNC_MODE = os.environ.get("SYNC_MODE", "batch")
+PIPELINE_CONCURRENCY = int(os.environ.get("PIPELINE_CONCURRENCY", 100))
+# Sync pipelines (batch loops or continuous pipelines) run by one worker
+WORKER_PIPELINES = int(os.environ.get("WORKER_PIPELINES", 2))
+# DB connections of one worker, should be enough for all of its pipelines
+WORKER_DB_POOL_SIZE = int(os.environ.get("WORKER_DB_POOL_SIZE", 4))
+# Max requests in flight across all pipelines of one worker
+WORKER_MAX_IN_FLIGHT = int(os.environ.get("WORKER_MAX_IN_FLIGHT", 200))
+# The amount of requests in flight is adjusted between CONCURRENCY_MIN and
+# WORKER_MAX_IN_FLIGHT according to event loop lag, timeouts and latency.
+# If disabled, it's fixed to WORKER_MAX_IN_FLIGHT
+ADAPTIVE_CONCURRENCY = (
+    os.environ.get("ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+)
+CONCURRENCY_MIN = int(os.environ.get("CONCURRENCY_MIN", 10))
+CONCURRENCY_INITIAL = int(os.environ.get("CONCURRENCY_INITIAL", 50))
+# Seconds between adjustments
+CONCURRENCY_ADJUST_INTERVAL = float(
+    os.environ.get("CONCURRENCY_ADJUST_INTERVAL", 5)
+)
+# Additive increase step and multiplicative decrease factor
+CONCURRENCY_INCREASE = int(os.environ.get("CONCURRENCY_INCREASE", 5))
+CONCURRENCY_DECREASE = float(os.environ.get("CONCURRENCY_DECREASE", 0.75))
+# Overload thresholds: event loop lag in seconds, share of timed out
+# requests and latency p95 as a multiple of the lowest observed p95
+CONCURRENCY_MAX_LOOP_LAG = float(os.environ.get("CONCURRENCY_MAX_LOOP_LAG", 0.1))
+CONCURRENCY_MAX_TIMEOUT_RATE = float(
+    os.environ.get("CONCURRENCY_MAX_TIMEOUT_RATE", 0.05)
+)
+CONCURRENCY_LATENCY_TOLERANCE = float(
+    os.environ.get("CONCURRENCY_LATENCY_TOLERANCE", 2.0)
+)
+# Seconds a claimed monitor stays reserved for one worker
+LEASE_DURATION = float(os.environ.get("LEASE_DURATION", 60))
+# Seconds of the lease kept for the request itself and saving its results:
+# scans which wait in queues longer than the rest are skipped until the lease
+# expires, so results of a lost lease aren't saved
+LEASE_SCAN_MARGIN = float(os.environ.get("LEASE_SCAN_MARGIN", 15))
+# Monitors of one URL due within this amount of seconds share one request
+COALESCE_WINDOW = float(os.environ.get("COALESCE_WINDOW", 5))
+# How the next sync time is calculated: "delay", "anchor" or "phase"
+_reschedule_policy = os.environ.get("RESCHEDULE_POLICY", "delay")
+# Checked here, so a worker doesn't start with it instead of failing after scans
+if _reschedule_policy not in get_args(ReschedulePolicy):
+    raise ValueError(
+        f"RESCHEDULE_POLICY should be one of {get_args(ReschedulePolicy)}, "
+        f"got {_reschedule_policy!r}"
+    )
+RESCHEDULE_POLICY = cast(ReschedulePolicy, _reschedule_policy)
+# Scan results batches of this size and bigger are written with binary COPY
+LOG_COPY_THRESHOLD = int(os.environ.get("LOG_COPY_THRESHOLD", 50))
+
+# Max amount of compiled monitor regexps kept in memory
+REGEXP_CACHE_SIZE = int(os.environ.get("REGEXP_CACHE_SIZE", 10000))
+# Chars of the previous body chunk searched again with the next one
+REGEXP_OVERLAP = int(os.environ.get("REGEXP_OVERLAP", 1024))
+# Text for the process pool is sent by windows of this amount of chars
+REGEXP_WINDOW = int(os.environ.get("REGEXP_WINDOW", 256 * 1024))
+# Texts up to this size are searched inline with patterns which can't
+# backtrack exponentially, bigger ones and other patterns in a process pool
+REGEXP_INLINE_LIMIT = int(os.environ.get("REGEXP_INLINE_LIMIT", 16 * 1024))
+# Process pool size for regexp evaluation, 0 - always search inline
+REGEXP_PROCESSES = int(os.environ.get("REGEXP_PROCESSES", 2))
+# Seconds one evaluation in the process pool may take
+REGEXP_TIME_BUDGET = float(os.environ.get("REGEXP_TIME_BUDGET", 1.0))
+# Bodies are read in a streaming way up to this amount of bytes
+MAX_BODY_SIZE = int(os.environ.get("MAX_BODY_SIZE", 10 * 1024 * 1024))
+# Bodies which aren't searched are still read up to this amount of bytes, so
+# the connection can be reused. Bigger ones close the connection
+HTTP_MAX_DRAIN_SIZE = int(os.environ.get("HTTP_MAX_DRAIN_SIZE", 64 * 1024))
+
+# ETag/Last-Modified validators kept for conditional requests
+VALIDATOR_CACHE_SIZE = int(os.environ.get("VALIDATOR_CACHE_SIZE", 100000))
+# [optional] file to keep the validators between restarts
+VALIDATOR_CACHE_PATH = os.environ.get("VALIDATOR_CACHE_PATH")
+
+# HTTP client pool shared by all scans of one worker
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 200))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 100)
+)
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 30.0))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(
+    os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", 10)
+)
+# Per-host token bucket: requests per second (0 - unlimited) and burst size.
+# Requests over the per-host limits are queued, not failed
+HTTP_HOST_RATE_LIMIT = float(os.environ.get("HTTP_HOST_RATE_LIMIT", 0))
+HTTP_HOST_RATE_BURST = int(os.environ.get("HTTP_HOST_RATE_BURST", 5))
+# Collect DNS/connect/TLS/TTFB/download timings of every request
+HTTP_TIMINGS = os.environ.get("HTTP_TIMINGS", "false").lower() == "true"
+
+# Failure texts longer than that are truncated before they are stored
+ERROR_DETAIL_MAX_LENGTH = int(os.environ.get("ERROR_DETAIL_MAX_LENGTH", 200))
+# IDs of stored failure texts kept in memory by every worker
+ERROR_DETAIL_CACHE_SIZE = int(os.environ.get("ERROR_DETAIL_CACHE_SIZE", 10000))
+# Seconds the IDs are kept, must be well below a day: details unseen for
+# a day longer than LOG_RETENTION_DAYS are pruned
+ERROR_DETAIL_CACHE_TTL = float(os.environ.get("ERROR_DETAIL_CACHE_TTL", 3600))
+# Failed requests are logged as one summary per interval, seconds
+FAILURE_LOG_INTERVAL = float(os.environ.get("FAILURE_LOG_INTERVAL", 60))
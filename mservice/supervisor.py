@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+
+from mservice import settings
+from mservice.metrics import start_metrics_server
+from mservice.scheduler import monitors_update_task
+from mservice.utils import prepare_logger
+
+logger = logging.getLogger(__name__)
+
+# Shortest wait between checks of the worker processes, so the supervisor
+# doesn't spin while nothing can be waited for
+MIN_POLL_INTERVAL = 0.1
+
+
+def _install_event_loop_policy(use_uvloop: bool):
+    """
+    Switches asyncio to uvloop if it is requested and installed
+    :param use_uvloop: True if uvloop should be used
+    """
+    if not use_uvloop:
+        return
+
+    try:
+        import uvloop
+    except ImportError:
+        logger.warning("uvloop is not installed - using default event loop")
+        return
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logger.info("Using uvloop event loop")
+
+
+async def _run_until_signal(
+        metrics_port: int = 0,
+        validator_cache_path: str | None = settings.VALIDATOR_CACHE_PATH,
+):
+    """
+    Runs the monitoring task until SIGTERM or SIGINT is received, then
+    cancels it so all the connections are closed cleanly.
+    :param metrics_port: port to serve metrics on, 0 - don't serve them
+    :param validator_cache_path: [optional] file to keep validators in
+    """
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    stopping = False
+
+    def stop():
+        nonlocal stopping
+        # Cancelling twice would break the cleanup of the task
+        if not stopping and task is not None:
+            stopping = True
+            task.cancel()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop)
+
+    metrics_server = (
+        await start_metrics_server(metrics_port) if metrics_port else None
+    )
+
+    logger.info("Starting monitoring worker")
+    try:
+        await monitors_update_task(validator_cache_path)
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+    logger.info("Stopping monitoring worker")
+
+
+def run_worker(
+        use_uvloop: bool = settings.WORKER_UVLOOP,
+        metrics_port: int = settings.WORKER_METRICS_PORT,
+        validator_cache_path: str | None = settings.VALIDATOR_CACHE_PATH,
+):
+    """
+    Runs one worker with its own event loop and DB connection in the
+    current process.
+    :param use_uvloop: True if uvloop should be used
+    :param metrics_port: port to serve metrics on, 0 - don't serve them
+    :param validator_cache_path: [optional] file to keep validators in
+    """
+    prepare_logger()
+    _install_event_loop_policy(use_uvloop)
+    asyncio.run(_run_until_signal(metrics_port, validator_cache_path))
+
+
+class WorkerSupervisor:
+    """
+    Runs several worker processes, restarts crashed ones and forwards
+    shutdown signals to them.
+    """
+
+    def __init__(
+            self,
+            processes: int,
+            use_uvloop: bool = settings.WORKER_UVLOOP,
+            restart_delay: float = settings.WORKER_RESTART_DELAY,
+            shutdown_timeout: float = settings.WORKER_SHUTDOWN_TIMEOUT,
+            metrics_port: int = settings.WORKER_METRICS_PORT,
+    ):
+        self.processes = processes
+        self.use_uvloop = use_uvloop
+        self.restart_delay = restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        self.metrics_port = metrics_port
+        self._context = multiprocessing.get_context('spawn')
+        self._children: dict[int, BaseProcess] = {}
+        self._stopping = False
+
+    def _start_child(self, slot: int):
+        child = self._context.Process(
+            target=run_worker,
+            # Every worker process serves its own metrics on a separate port
+            # and keeps its validators in a separate file
+            args=(
+                self.use_uvloop,
+                self.metrics_port + slot if self.metrics_port else 0,
+                (
+                    f"{settings.VALIDATOR_CACHE_PATH}.{slot}"
+                    if settings.VALIDATOR_CACHE_PATH
+                    else None
+                ),
+            ),
+            name=f"monitoring-worker-{slot}",
+        )
+        child.start()
+        self._children[slot] = child
+        logger.info(f"Started worker {child.name} with pid {child.pid}")
+
+    def _handle_signal(self, signum, frame):
+        logger.info(f"Received signal {signum} - stopping workers")
+        self._stopping = True
+
+    def _stop_children(self):
+        for child in self._children.values():
+            if child.is_alive():
+                child.terminate()
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        for child in self._children.values():
+            child.join(max(deadline - time.monotonic(), 0))
+            if child.is_alive():
+                logger.warning(f"Worker {child.name} didn't stop in time - killing")
+                child.kill()
+                child.join()
+
+    def run(self):
+        """
+        Starts worker processes and supervises them until SIGTERM or SIGINT
+        """
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+        logger.info(f"Starting {self.processes} worker processes")
+        for slot in range(self.processes):
+            self._start_child(slot)
+
+        # Slots of crashed workers with their restart time
+        restarts: dict[int, float] = {}
+
+        try:
+            while not self._stopping:
+                wait(
+                    [child.sentinel for child in self._children.values()],
+                    max(min(self.restart_delay, 1), MIN_POLL_INTERVAL),
+                )
+
+                for slot, child in list(self._children.items()):
+                    if child.is_alive() or self._stopping:
+                        continue
+
+                    logger.error(
+                        f"Worker {child.name} exited with code "
+                        f"{child.exitcode} - restarting in "
+                        f"{self.restart_delay} seconds"
+                    )
+                    child.close()
+                    del self._children[slot]
+                    restarts[slot] = time.monotonic() + self.restart_delay
+
+                for slot, restart_time in list(restarts.items()):
+                    if not self._stopping and time.monotonic() >= restart_time:
+                        del restarts[slot]
+                        self._start_child(slot)
+        finally:
+            self._stop_children()
+            logger.info("All worker processes are stopped")
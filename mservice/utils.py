@@ -1,5 +1,8 @@
 import datetime
 import logging
+import os
+import socket
+import uuid
 
 from mservice import settings
 
@@ -11,6 +14,13 @@ def utc_tz_now() -> datetime.datetime:
     return datetime.datetime.now(tz=datetime.timezone.utc)
 
 
+def unique_worker_id() -> str:
+    """
+    :return: ID which is unique for every running worker process
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
 def prepare_logger():
     """
     Sets logger format and level.
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class CachedValidators:
+    etag: str | None
+    last_modified: str | None
+    http_status: int
+    # Source texts of patterns which were searched in the cached body and
+    # which of them were found there
+    searched_patterns: frozenset[str]
+    found_patterns: frozenset[str]
+
+    def headers(self) -> dict[str, str]:
+        """
+        :return: headers for a conditional request
+        """
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+
+        return headers
+
+
+class ValidatorCache:
+    """
+    Bounded LRU cache of ETag/Last-Modified validators and regexp results of
+    the last response for every URL. Can be saved to a file and loaded back,
+    so the cache stays warm between restarts.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, CachedValidators] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, url: str, patterns: set[str]) -> CachedValidators | None:
+        """
+        Returns validators of the URL if results of every pattern are known
+        :param url: requested URL
+        :param patterns: source texts of patterns to check
+        :return: cached validators or None if a full request is needed
+        """
+        entry = self._entries.get(url)
+        if entry is None or not patterns <= entry.searched_patterns:
+            return None
+
+        self._entries.move_to_end(url)
+        return entry
+
+    def put(
+            self,
+            url: str,
+            response: httpx.Response,
+            searched_patterns: set[str],
+            found_patterns: set[str],
+    ):
+        """
+        Remembers validators of the response. Responses without validators
+        remove the URL from the cache.
+        :param url: requested URL
+        :param response: response with headers received
+        :param searched_patterns: patterns searched in the whole body
+        :param found_patterns: patterns found in the body
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag is None and last_modified is None:
+            self._entries.pop(url, None)
+            return
+
+        self._entries[url] = CachedValidators(
+            etag=etag,
+            last_modified=last_modified,
+            http_status=response.status_code,
+            searched_patterns=frozenset(searched_patterns),
+            found_patterns=frozenset(found_patterns),
+        )
+        self._entries.move_to_end(url)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def save(self, path: str):
+        """
+        Writes the cache to a JSON file
+        :param path: file path
+        """
+        data = {
+            url: {
+                **asdict(entry),
+                'searched_patterns': sorted(entry.searched_patterns),
+                'found_patterns': sorted(entry.found_patterns),
+            }
+            for url, entry in self._entries.items()
+        }
+        # Other processes can save to the same path at the same time
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved {len(data)} cached validators to {path}")
+
+    def load(self, path: str):
+        """
+        Reads the cache from a JSON file, if it exists. A malformed file is
+        ignored, the cache stays empty then
+        :param path: file path
+        """
+        entries: OrderedDict[str, CachedValidators] = OrderedDict()
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            for url, entry in data.items():
+                entries[url] = CachedValidators(
+                    etag=entry['etag'],
+                    last_modified=entry['last_modified'],
+                    http_status=entry['http_status'],
+                    searched_patterns=frozenset(entry['searched_patterns']),
+                    found_patterns=frozenset(entry['found_patterns']),
+                )
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            logger.warning(f"Failed loading cached validators from {path}")
+            return
+
+        self._entries = entries
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        logger.info(f"Loaded {len(self._entries)} cached validators from {path}")
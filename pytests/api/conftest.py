@@ -8,6 +8,18 @@ from app import create_application
 
 @pytest_asyncio.fixture
 async def client(event_loop) -> AsyncGenerator[AsyncClient, None]:
+    app = create_application()
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(app=app, base_url="http://testserver") as cl:
+            yield cl
+
+
+@pytest_asyncio.fixture
+async def client_without_db(event_loop) -> AsyncGenerator[AsyncClient, None]:
+    """
+    Client of the app which doesn't run its lifespan, so the DB pool isn't
+    opened, for routes which don't use the DB
+    """
     async with AsyncClient(
             app=create_application(), base_url="http://testserver"
     ) as cl:
@@ -0,0 +1,16 @@
+import pytest
+from httpx import AsyncClient
+
+
+@pytest.mark.asyncio
+async def test_metrics(client_without_db: AsyncClient):
+    for _ in range(2):
+        rv = await client_without_db.get('/metrics')
+        rv.raise_for_status()
+
+    assert rv.headers['content-type'].startswith('text/plain')
+    assert 'mservice_db_query_duration_seconds' in rv.text
+    assert (
+        'mservice_api_request_duration_seconds_count'
+        '{method="GET",route="/metrics",status="200"}'
+    ) in rv.text, "Previous request must be measured per route"
@@ -5,6 +5,8 @@ from httpx import AsyncClient
 from pydantic_core import Url
 
 from mservice.database.monitor_dao import MonitorDao
+from mservice.schema.errors import ErrorCode
+from mservice.schema.metrics import SiteMetricSchema
 
 
 @pytest.mark.asyncio
@@ -26,6 +28,103 @@ async def test_creation(client: AsyncClient, monitor_dao: MonitorDao):
     assert len(present_items) == 1, 'Item should be in the database and returned'
 
 
+@pytest.mark.asyncio
+async def test_bulk_creation(client: AsyncClient, monitor_dao: MonitorDao):
+    rv = await client.post(
+        '/monitors/bulk',
+        json=[
+            {"url": "https://test1.com", "frequency_sec": 100, "regexp": None},
+            {"url": "not a url", "frequency_sec": 100, "regexp": None},
+            {"url": "https://test2.com", "frequency_sec": 100, "regexp": "[a"},
+            {"url": "https://test3.com", "frequency_sec": 100, "regexp": "a+"},
+        ]
+    )
+    rv.raise_for_status()
+
+    result: dict = rv.json()
+    assert result['created'] == 2
+    assert result['failed'] == 2
+    assert [item['id'] is not None for item in result['items']] == [
+        True, False, False, True
+    ], 'Only valid items should be created'
+
+    present_items = await monitor_dao.select_unlocked(1000)
+    assert len(present_items) == 2
+
+
+@pytest.mark.asyncio
+async def test_bulk_creation_ndjson(client: AsyncClient, monitor_dao: MonitorDao):
+    body = (
+        '{"url": "https://test1.com", "frequency_sec": 100, "regexp": null}\n'
+        '{"url": \n'
+        '\n'
+        '{"url": "https://test2.com", "frequency_sec": 100, "regexp": null}\n'
+    )
+    rv = await client.post(
+        '/monitors/bulk',
+        content=body,
+        headers={'Content-Type': 'application/x-ndjson'},
+    )
+    rv.raise_for_status()
+
+    result: dict = rv.json()
+    assert result['created'] == 2
+    assert result['items'][1]['error'], 'Malformed line should be reported'
+
+    rv = await client.post('/monitors/bulk', json={"url": "https://test.com"})
+    assert rv.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_list(client: AsyncClient, monitor_dao: MonitorDao):
+    ids = [
+        await monitor_dao.create(
+            Url(f"http://someurl{i}.com"), datetime.timedelta(seconds=10), None
+        )
+        for i in range(3)
+    ]
+
+    rv = await client.get('/monitors/', params={'limit': 2})
+    rv.raise_for_status()
+    first_page: dict = rv.json()
+    assert [item['id'] for item in first_page['items']] == ids[:2]
+    assert first_page['items'][0]['frequency_sec'] == 10
+
+    rv = await client.get(
+        '/monitors/', params={'limit': 2, 'cursor': first_page['next_cursor']}
+    )
+    rv.raise_for_status()
+    last_page: dict = rv.json()
+    assert [item['id'] for item in last_page['items']] == ids[2:]
+    assert last_page['next_cursor'] is None, 'Should be the last page'
+
+
+@pytest.mark.asyncio
+async def test_status(client: AsyncClient, monitor_dao: MonitorDao):
+    ids = [
+        await monitor_dao.create(
+            Url(f"http://someurl{i}.com"), datetime.timedelta(seconds=10), None
+        )
+        for i in range(2)
+    ]
+    await monitor_dao.create_log_items_from_schema(
+        [(
+            ids[0],
+            SiteMetricSchema.from_error(ErrorCode.CONNECT_REFUSED, "error"),
+        )]
+    )
+
+    rv = await client.get('/monitors/status', params={'ids': ids})
+    rv.raise_for_status()
+
+    result: dict = rv.json()
+    assert [item['monitor_id'] for item in result['items']] == ids[:1]
+    assert result['items'][0]['up'] is False
+    assert result['items'][0]['error_code'] == ErrorCode.CONNECT_REFUSED
+    assert result['items'][0]['error'] == "error"
+    assert result['missing'] == ids[1:], 'Monitors without scans are missing'
+
+
 @pytest.mark.asyncio
 async def test_deletion(client: AsyncClient, monitor_dao: MonitorDao):
     id = await monitor_dao.create(
@@ -40,3 +139,23 @@ async def test_deletion(client: AsyncClient, monitor_dao: MonitorDao):
 
     present_items = await monitor_dao.select_unlocked(1000)
     assert len(present_items) == 0, 'All items should be removed and not found'
+
+
+@pytest.mark.asyncio
+async def test_metrics(client: AsyncClient, monitor_dao: MonitorDao):
+    id = await monitor_dao.create(
+        Url("http://someurl.com"), datetime.timedelta(seconds=1), None
+    )
+
+    rv = await client.get(
+        f'/monitors/{id}/metrics',
+        params={'from': '2023-07-01T00:00:00Z', 'to': '2023-07-02T00:00:00Z'},
+    )
+    rv.raise_for_status()
+
+    result: dict = rv.json()
+    assert result['bucket_sec'] == 300, 'Bucket should fit the point budget'
+    assert result['buckets'] == []
+
+    rv = await client.get(f'/monitors/{id + 1}/metrics')
+    assert rv.status_code == 404
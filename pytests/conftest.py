@@ -12,6 +12,7 @@ from pytest_mock import MockerFixture
 from mservice.database.base import create_pool
 from mservice.database.migration import create_all_tables
 from mservice.database.monitor_dao import MonitorDao
+from mservice.requester import Requester
 
 
 @pytest.yield_fixture(scope='session')
@@ -25,8 +26,11 @@ def event_loop(request):
 @pytest.fixture(scope="session")
 def database_pool(event_loop: AbstractEventLoop):
     async def drop_tables(conn):
-        await conn.execute('DROP TABLE IF EXISTS monitor_log;')
+        # Rollups depend on monitor_log and are dropped with it
+        await conn.execute('DROP TABLE IF EXISTS monitor_log CASCADE;')
+        await conn.execute('DROP TABLE IF EXISTS monitor_status;')
         await conn.execute('DROP TABLE IF EXISTS monitors;')
+        await conn.execute('DROP TABLE IF EXISTS error_details;')
 
     async def base_db_init() -> Pool:
         db_pool = await create_pool()
@@ -70,16 +74,22 @@ def monitor_dao(db_connection: Connection):
     return MonitorDao(db_connection)
 
 
+@pytest_asyncio.fixture
+async def requester():
+    async with Requester() as shared_requester:
+        yield shared_requester
+
+
 @pytest.fixture
 def mock_httpx_get(mocker: MockerFixture):
     async_mock = AsyncMock()
     mocker.patch(
-        'httpx.AsyncClient.get',
+        'httpx.AsyncClient.send',
         side_effect=async_mock
     )
 
-    def set_mock_params(status_code: int, json: dict):
-        response = Response(status_code=status_code, json=json)
+    def set_mock_params(status_code: int, json: dict | None = None, content=None):
+        response = Response(status_code=status_code, json=json, content=content)
         response._elapsed = timedelta(seconds=1)
         async_mock.return_value = response
 
@@ -92,7 +102,7 @@ def mock_httpx_get(mocker: MockerFixture):
 def mock_httpx_get_failed(mocker: MockerFixture):
     async_mock = AsyncMock()
     mocker.patch(
-        'httpx.AsyncClient.get',
+        'httpx.AsyncClient.send',
         side_effect=async_mock
     )
 
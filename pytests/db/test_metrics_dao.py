@@ -0,0 +1,122 @@
+from datetime import timedelta, datetime, timezone
+
+import pytest
+from pydantic_core import Url
+
+from mservice.database.metrics_dao import (
+    MetricsDao, choose_bucket, choose_source, RAW_SOURCE
+)
+from mservice.database.monitor_dao import MonitorDao
+from mservice.schema.errors import ErrorCode
+from mservice.schema.metrics import SiteMetricSchema
+
+START = datetime(2023, 7, 1, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    'range_, requested, bucket',
+    [
+        pytest.param(timedelta(hours=1), None, timedelta(seconds=10), id='small range'),
+        pytest.param(timedelta(days=1), None, timedelta(minutes=5), id='day'),
+        pytest.param(
+            timedelta(days=1),
+            timedelta(hours=1),
+            timedelta(hours=1),
+            id='requested',
+        ),
+        pytest.param(
+            timedelta(days=1),
+            timedelta(seconds=1),
+            timedelta(minutes=5),
+            id='too small',
+        ),
+        pytest.param(timedelta(days=5000), None, timedelta(days=30), id='month'),
+        pytest.param(timedelta(days=50000), None, timedelta(days=100), id='huge range'),
+    ]
+)
+def test_choose_bucket(
+        range_: timedelta, requested: timedelta | None, bucket: timedelta
+):
+    assert choose_bucket(START, START + range_, 500, requested) == bucket
+
+
+@pytest.mark.parametrize(
+    'bucket, source',
+    [
+        pytest.param(timedelta(minutes=5), RAW_SOURCE, id='raw'),
+        pytest.param(timedelta(minutes=90), RAW_SOURCE, id='not whole hours'),
+        pytest.param(timedelta(hours=3), 'monitor_log_hourly', id='hourly'),
+        pytest.param(timedelta(days=7), 'monitor_log_daily', id='daily'),
+    ]
+)
+def test_choose_source(bucket: timedelta, source: str):
+    assert choose_source(bucket) == source
+
+
+def _metric(
+        ts: datetime, response_time_ms: int, error: ErrorCode | None = None
+):
+    return SiteMetricSchema(
+        ts=ts,
+        response_time_ms=response_time_ms,
+        http_status=0 if error else 200,
+        regexp_found=error is None,
+        error_code=error,
+        from_cache=False,
+        queue_time_ms=0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_select_buckets(monitor_dao: MonitorDao):
+    monitor_id = await monitor_dao.create(
+        Url("http://test.url"), timedelta(seconds=30), r"some"
+    )
+    await monitor_dao.create_log_items_from_schema([
+        (monitor_id, _metric(START, 100)),
+        (monitor_id, _metric(START + timedelta(seconds=10), 300)),
+        (monitor_id, _metric(START + timedelta(seconds=20), 0, ErrorCode.TIMEOUT)),
+        (monitor_id, _metric(START + timedelta(minutes=5), 200)),
+    ])
+
+    buckets = await MetricsDao(monitor_dao.connection).select_buckets(
+        monitor_id, START, START + timedelta(hours=1), timedelta(minutes=5)
+    )
+
+    assert [bucket.ts for bucket in buckets] == [START, START + timedelta(minutes=5)]
+    first = buckets[0]
+    assert first.checks == 3
+    assert first.errors == 1
+    assert first.uptime_ratio == pytest.approx(2 / 3)
+    assert first.response_time_max_ms == 300
+    assert first.response_time_p50_ms == pytest.approx(200)
+    assert first.regexp_hit_ratio == 1.0, "Failed checks aren't counted"
+
+
+@pytest.mark.asyncio
+async def test_select_rollup_buckets(monitor_dao: MonitorDao):
+    monitor_id = await monitor_dao.create(
+        Url("http://test.url"), timedelta(seconds=30), None
+    )
+    await monitor_dao.create_log_items_from_schema([
+        (monitor_id, _metric(START + timedelta(minutes=10), 100)),
+        (monitor_id, _metric(START + timedelta(hours=1), 300)),
+        (monitor_id, _metric(START + timedelta(hours=2), 0, ErrorCode.UNKNOWN)),
+        (monitor_id, _metric(START + timedelta(hours=3), 200)),
+    ])
+
+    # Not materialized buckets are read from raw data through the rollup
+    buckets = await MetricsDao(monitor_dao.connection).select_buckets(
+        monitor_id,
+        START + timedelta(minutes=30),
+        START + timedelta(days=1),
+        timedelta(hours=3),
+    )
+
+    assert [bucket.ts for bucket in buckets] == [START, START + timedelta(hours=3)]
+    first = buckets[0]
+    assert first.checks == 3, "Start is aligned to whole buckets"
+    assert first.errors == 1
+    assert first.uptime_ratio == pytest.approx(2 / 3)
+    assert first.response_time_max_ms == 300
+    assert first.response_time_p50_ms == pytest.approx(200)
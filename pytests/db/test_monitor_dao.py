@@ -1,3 +1,4 @@
+from dataclasses import fields
 from datetime import timedelta
 
 import pytest
@@ -5,7 +6,13 @@ import pytest_asyncio
 from asyncpg import Pool
 from pydantic_core import Url
 
-from mservice.database.monitor_dao import MonitorDao, WrongRegexException
+from mservice import settings
+from mservice.database.models import MonitorModel, NewMonitorModel
+from mservice.database.monitor_dao import (
+    MONITOR_COLUMNS, MonitorDao, WrongRegexException
+)
+from mservice.schema.errors import ErrorCode
+from mservice.schema.metrics import SiteMetricSchema
 from mservice.utils import utc_tz_now
 
 
@@ -32,6 +39,21 @@ async def generate_items(monitor_dao: MonitorDao):
         await monitor_dao.remove(item)
 
 
+def test_db_to_model():
+    columns = [column.strip() for column in MONITOR_COLUMNS.split(',')]
+    row = dict(zip(columns, (
+        1, "http://test.url/", r".*", True, timedelta(seconds=30),
+        utc_tz_now(), 2, 0.5,
+    )))
+
+    item = MonitorDao._db_to_model(row)
+
+    assert [field.name for field in fields(MonitorModel)] == columns + ['pattern'], \
+        "Every column must be mapped"
+    assert (item.id, item.url, item.host_rate_limit) == (1, "http://test.url/", 0.5)
+    assert item.pattern.pattern == r".*", "Regexp should be compiled"
+
+
 @pytest.mark.asyncio
 async def test_creation(monitor_dao: MonitorDao):
     created_id = await monitor_dao.create(
@@ -43,6 +65,22 @@ async def test_creation(monitor_dao: MonitorDao):
     assert value == 1, f"1 item should be created, not {value}"
 
 
+@pytest.mark.asyncio
+async def test_creation_host_limits(monitor_dao: MonitorDao):
+    created_id = await monitor_dao.create(
+        Url("http://test.url"),
+        timedelta(seconds=30),
+        None,
+        host_max_concurrency=2,
+        host_rate_limit=0.5,
+    )
+
+    [item] = await monitor_dao.select_unlocked(10)
+    assert item.id == created_id
+    assert item.host_max_concurrency == 2
+    assert item.host_rate_limit == 0.5
+
+
 @pytest.mark.asyncio
 async def test_creation_malformed_regexp(monitor_dao: MonitorDao):
     with pytest.raises(WrongRegexException):
@@ -51,6 +89,56 @@ async def test_creation_malformed_regexp(monitor_dao: MonitorDao):
         )
 
 
+@pytest.mark.asyncio
+async def test_create_many(monitor_dao: MonitorDao):
+    interval = timedelta(seconds=100)
+    items = [
+        NewMonitorModel(
+            url=Url(f"http://test{i}.url"),
+            sync_interval=interval,
+            regexp=None,
+            host_max_concurrency=None,
+            host_rate_limit=None,
+        )
+        for i in range(10)
+    ]
+
+    ids = await monitor_dao.create_many(items, spread=1.0)
+    assert len(ids) == 10
+    assert await monitor_dao.count() == 10
+
+    for i, item_id in enumerate(ids):
+        item = await monitor_dao.get(item_id)
+        assert str(item.url) == f"http://test{i}.url/", \
+            "IDs should match the items order"
+
+    syncs = await monitor_dao.connection.fetch(
+        "SELECT next_sync FROM monitors WHERE id = any($1::integer[])"
+        " ORDER BY next_sync",
+        ids
+    )
+    spread = (syncs[-1][0] - syncs[0][0]).total_seconds()
+    assert spread == pytest.approx(90), "First syncs should be spread over the interval"
+
+
+@pytest.mark.asyncio
+async def test_create_many_malformed_regexp(monitor_dao: MonitorDao):
+    items = [
+        NewMonitorModel(
+            url=Url("http://test.url"),
+            sync_interval=timedelta(seconds=30),
+            regexp=regexp,
+            host_max_concurrency=None,
+            host_rate_limit=None,
+        )
+        for regexp in (None, r".+@^[A")
+    ]
+
+    with pytest.raises(WrongRegexException):
+        await monitor_dao.create_many(items)
+    assert await monitor_dao.count() == 0, "Nothing should be created"
+
+
 @pytest.mark.asyncio
 async def test_list(monitor_dao: MonitorDao, generate_items):
     await generate_items(50)
@@ -72,6 +160,65 @@ async def test_reschedule(monitor_dao: MonitorDao, generate_items):
         assert r_item.next_sync > current_time, "Schedule must be in the future"
 
 
+@pytest.mark.asyncio
+async def test_reschedule_anchor(monitor_dao: MonitorDao):
+    item_id = await monitor_dao.create(
+        Url("http://test.url"), timedelta(seconds=30), None
+    )
+    lagging_sync = await monitor_dao.connection.fetchval(
+        "UPDATE monitors SET next_sync = next_sync - interval '95 seconds'"
+        " WHERE id = $1 RETURNING next_sync",
+        item_id
+    )
+
+    current_time = utc_tz_now()
+    [r_item] = await monitor_dao.reschedule([item_id], 'anchor')
+
+    assert r_item.next_sync > current_time, "Missed runs must be skipped"
+    assert (r_item.next_sync - lagging_sync).total_seconds() == 120, \
+        "Schedule must stay on the original anchor"
+
+
+@pytest.mark.asyncio
+async def test_reschedule_phase(monitor_dao: MonitorDao):
+    interval = timedelta(seconds=100)
+    ids = [
+        await monitor_dao.create(Url(f"http://test{i}.url"), interval, None)
+        for i in range(10)
+    ]
+
+    current_time = utc_tz_now()
+    rescheduled_items = await monitor_dao.reschedule(ids, 'phase')
+    repeated_items = await monitor_dao.reschedule(ids, 'phase')
+
+    next_syncs = sorted(item.next_sync for item in rescheduled_items)
+    assert next_syncs[0] > current_time, "Schedule must be in the future"
+    assert next_syncs[-1] <= current_time + interval, "Only one interval ahead"
+    assert len(set(next_syncs)) == len(ids), "Monitors must be spread apart"
+    assert sorted(item.next_sync for item in repeated_items) == next_syncs, \
+        "Phase must be deterministic"
+
+
+@pytest.mark.asyncio
+async def test_creation_jitter(monitor_dao: MonitorDao):
+    current_time = utc_tz_now()
+    interval = timedelta(seconds=100)
+    for i in range(10):
+        await monitor_dao.create(
+            Url(f"http://test{i}.url"), interval, None, initial_jitter=1.0
+        )
+
+    next_syncs = await monitor_dao.connection.fetch(
+        "SELECT next_sync FROM monitors"
+    )
+    assert all(
+        current_time <= row['next_sync'] <= utc_tz_now() + interval
+        for row in next_syncs
+    ), "First sync must be within one interval"
+    assert len({row['next_sync'] for row in next_syncs}) > 1, \
+        "First syncs must be spread"
+
+
 @pytest.mark.asyncio
 async def test_list_mt(database: Pool, generate_items):
     await generate_items(50)
@@ -93,6 +240,124 @@ async def test_list_mt(database: Pool, generate_items):
     assert len(items3) == 50, "Must have all items unlocked after the transactions"
 
 
+@pytest.mark.asyncio
+async def test_claim(monitor_dao: MonitorDao, generate_items):
+    await generate_items(50)
+
+    items1 = await monitor_dao.claim(30, "worker-1", timedelta(minutes=1))
+    assert len(items1) == 30, "Not all items are claimed"
+
+    items2 = await monitor_dao.claim(30, "worker-2", timedelta(minutes=1))
+    assert len(items2) == 20, "Should get only 20 which are left unclaimed"
+
+    assert not {item.id for item in items1} & {item.id for item in items2}, \
+        "Leased items must not be claimed twice"
+
+
+@pytest.mark.asyncio
+async def test_claim_expired_lease(monitor_dao: MonitorDao, generate_items):
+    await generate_items(10)
+
+    items1 = await monitor_dao.claim(10, "crashed", timedelta(seconds=-1))
+    assert len(items1) == 10
+
+    items2 = await monitor_dao.claim(10, "worker", timedelta(minutes=1))
+    assert len(items2) == 10, "Expired leases must be claimed again"
+
+    released = await monitor_dao.release([item.id for item in items1], "crashed")
+    assert len(released) == 0, "Lost leases must not be released"
+
+
+@pytest.mark.asyncio
+async def test_claim_coalesced(monitor_dao: MonitorDao):
+    due_id = await monitor_dao.create(
+        Url("http://same.url"), timedelta(seconds=30), None
+    )
+    soon_id = await monitor_dao.create(
+        Url("http://same.url"), timedelta(seconds=30), r".*"
+    )
+    await monitor_dao.create(Url("http://other.url"), timedelta(seconds=30), None)
+    await monitor_dao.connection.execute(
+        "UPDATE monitors SET next_sync = next_sync - interval '1 minute'"
+        " WHERE id = $1",
+        due_id
+    )
+    await monitor_dao.connection.execute(
+        "UPDATE monitors SET next_sync = next_sync + interval '3 seconds'"
+        " WHERE id = $1",
+        soon_id
+    )
+
+    items = await monitor_dao.claim(
+        1, "worker", timedelta(minutes=1), timedelta(seconds=5)
+    )
+    assert {item.id for item in items} == {due_id, soon_id}, \
+        "Monitors of the same URL due soon must be claimed together"
+
+
+@pytest.mark.asyncio
+async def test_release(monitor_dao: MonitorDao, generate_items):
+    await generate_items(10)
+
+    current_time = utc_tz_now()
+    items = await monitor_dao.claim(10, "worker", timedelta(minutes=1))
+    released = await monitor_dao.release([item.id for item in items], "worker")
+
+    assert len(released) == len(items), "Not all items are released"
+    for r_item in released:
+        assert r_item.next_sync > current_time, "Schedule must be in the future"
+
+
+@pytest.mark.parametrize(
+    'amount',
+    [
+        pytest.param(1, id='insert'),
+        pytest.param(settings.LOG_COPY_THRESHOLD, id='copy'),
+    ]
+)
+@pytest.mark.asyncio
+async def test_create_log_items(monitor_dao: MonitorDao, generate_items, amount: int):
+    [item_id] = await generate_items(1)
+
+    await monitor_dao.create_log_items_from_schema(
+        [(item_id, SiteMetricSchema.from_error(ErrorCode.DNS)) for _ in range(amount)]
+    )
+
+    logged = await monitor_dao.connection.fetchval(
+        'SELECT COUNT(*) FROM monitor_log WHERE monitor_id = $1', item_id
+    )
+    assert logged == amount, "All results must be saved"
+
+
+@pytest.mark.asyncio
+async def test_create_log_items_timings(monitor_dao: MonitorDao, generate_items):
+    [item_id] = await generate_items(1)
+    metric = SiteMetricSchema(
+        ts=utc_tz_now(),
+        response_time_ms=100,
+        http_status=200,
+        regexp_found=True,
+        error_code=None,
+        from_cache=False,
+        queue_time_ms=0,
+        connect_ms=10,
+        ttfb_ms=50,
+        download_ms=40,
+        response_size=1024,
+    )
+
+    await monitor_dao.create_log_items_from_schema([(item_id, metric)])
+
+    row = await monitor_dao.connection.fetchrow(
+        '''
+        SELECT dns_ms, connect_ms, tls_ms, ttfb_ms, download_ms, response_size
+            FROM monitor_log WHERE monitor_id = $1
+        ''',
+        item_id,
+    )
+    assert tuple(row) == (None, 10, None, 50, 40, 1024), "Missing phases are NULL"
+
+
 @pytest.mark.asyncio
 async def test_removal(monitor_dao: MonitorDao):
     pre_test_count = await monitor_dao.count()
@@ -110,3 +375,138 @@ async def test_removal(monitor_dao: MonitorDao):
 
     result = await monitor_dao.remove(created_id)
     assert not result, "Item should not be found"
+
+
+@pytest.mark.asyncio
+async def test_select_page(monitor_dao: MonitorDao, generate_items):
+    ids = await generate_items(25)
+
+    pages = []
+    after_id = None
+    while page := await monitor_dao.select_page(10, after_id=after_id):
+        pages.append([item.id for item in page])
+        after_id = page[-1].id
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert sum(pages, []) == sorted(ids), "Pages should cover all monitors in order"
+
+
+@pytest.mark.asyncio
+async def test_select_page_filters(monitor_dao: MonitorDao):
+    first = await monitor_dao.create(
+        Url("http://first.url/path"), timedelta(seconds=30), None
+    )
+    second = await monitor_dao.create(
+        Url("https://user@second.url:8080/path"), timedelta(seconds=30), None
+    )
+    await monitor_dao.remove(second)
+    await monitor_dao.connection.execute(
+        "UPDATE monitors SET next_sync = next_sync - interval '1 hour'"
+        " WHERE id = $1",
+        first
+    )
+
+    async def select_ids(**filters) -> list[int]:
+        return [item.id for item in await monitor_dao.select_page(10, **filters)]
+
+    assert await select_ids(active=False) == [second]
+    assert await select_ids(host='SECOND.url') == [second]
+    assert await select_ids(url_prefix='http://first') == [first]
+    assert await select_ids(url_prefix='http://first%') == [], \
+        "Prefix should be matched literally"
+    assert await select_ids(overdue=True) == [first]
+    assert await select_ids(overdue=False) == [second]
+
+
+@pytest.mark.asyncio
+async def test_select_page_latest(monitor_dao: MonitorDao, generate_items):
+    with_results, without_results = await generate_items(2)
+    await monitor_dao.create_log_items_from_schema(
+        [
+            (with_results, SiteMetricSchema.from_error(ErrorCode.TLS, f"error {i}"))
+            for i in range(3)
+        ]
+    )
+
+    items = await monitor_dao.select_page(10, include_latest=True)
+    latest = {item.id: item.latest for item in items}
+
+    assert latest[without_results] is None
+    assert latest[with_results].error == "error 2", "The latest result should be added"
+    assert latest[with_results].error_code is ErrorCode.TLS
+
+
+@pytest.mark.asyncio
+async def test_status(monitor_dao: MonitorDao, generate_items):
+    [item_id] = await generate_items(1)
+
+    def result(minute: int, http_status: int) -> SiteMetricSchema:
+        return SiteMetricSchema(
+            ts=utc_tz_now().replace(hour=0, minute=minute),
+            response_time_ms=10,
+            http_status=http_status,
+            regexp_found=False,
+            error_code=None,
+            from_cache=False,
+            queue_time_ms=0,
+        )
+
+    for minute, http_status in ((1, 200), (2, 500), (3, 503)):
+        await monitor_dao.create_log_items_from_schema(
+            [(item_id, result(minute, http_status))]
+        )
+
+    [status] = await monitor_dao.select_status([item_id, item_id + 1])
+    assert not status.up
+    assert status.http_status == 503
+    assert status.consecutive_failures == 2
+    assert status.last_change.minute == 2, "Should be the time of the first failure"
+
+    # Results older than the status don't change it
+    await monitor_dao.create_log_items_from_schema([(item_id, result(0, 200))])
+    [status] = await monitor_dao.select_status([item_id])
+    assert status.http_status == 503
+
+    await monitor_dao.create_log_items_from_schema([(item_id, result(4, 200))])
+    [status] = await monitor_dao.select_status([item_id])
+    assert status.up
+    assert status.consecutive_failures == 0
+    assert status.last_change.minute == 4
+
+
+@pytest.mark.asyncio
+async def test_status_copy(monitor_dao: MonitorDao, generate_items):
+    item_ids = await generate_items(3)
+
+    await monitor_dao.create_log_items_from_schema([
+        (item_id, SiteMetricSchema.from_error(ErrorCode.TIMEOUT, "timed out"))
+        for item_id in item_ids
+        for _ in range(settings.LOG_COPY_THRESHOLD)
+    ])
+
+    statuses = await monitor_dao.select_status(item_ids)
+    assert [status.monitor_id for status in statuses] == sorted(item_ids)
+    assert all(status.consecutive_failures == 1 for status in statuses), \
+        "Only the latest result of a batch should be applied"
+
+
+@pytest.mark.asyncio
+async def test_prune_error_details(monitor_dao: MonitorDao, generate_items):
+    [item_id] = await generate_items(1)
+    await monitor_dao.create_log_items_from_schema([
+        (item_id, SiteMetricSchema.from_error(ErrorCode.TIMEOUT, "in status"))
+    ])
+    await monitor_dao.resolve_error_details({"unused"})
+    await monitor_dao.connection.execute(
+        "UPDATE error_details SET last_seen = CURRENT_TIMESTAMP - interval '1 day'"
+    )
+
+    await monitor_dao.connection.execute(
+        """CALL prune_error_details(0, '{"unseen_for": "1 hour"}')"""
+    )
+
+    details = await monitor_dao.connection.fetchval(
+        "SELECT array_agg(detail) FROM error_details"
+    )
+    assert "in status" in details, "Details of statuses should be kept"
+    assert "unused" not in details
@@ -1,24 +1,37 @@
+import asyncio
 import datetime
 from unittest.mock import AsyncMock
 
 import pytest
-from pydantic_core import Url
 
+from mservice.concurrency import AdaptiveConcurrency
 from mservice.database.models import MonitorModel
-from mservice.scheduler import _sync_item
+from mservice.parser import compile_pattern
+from mservice.requester import Requester
+from mservice.scheduler import (
+    WorkerContext,
+    _bounded_sync_group,
+    _group_by_url,
+    _sync_group,
+    _sync_item,
+)
+from mservice.schema.errors import ErrorCode
 from mservice.utils import utc_tz_now
 
 
 @pytest.fixture
 def monitor_model_generator():
-    def generate_mm(url: str, regexp: str | None):
+    def generate_mm(url: str, regexp: str | None, id: int = 0):
         return MonitorModel(
-            id=0,
-            url=Url(url),
+            id=id,
+            url=url,
             regexp=regexp,
+            pattern=None if regexp is None else compile_pattern(regexp),
             active=True,
             sync_interval=datetime.timedelta(seconds=1),
-            next_sync=utc_tz_now()
+            next_sync=utc_tz_now(),
+            host_max_concurrency=None,
+            host_rate_limit=None,
         )
 
     return generate_mm
@@ -48,25 +61,114 @@ def monitor_model_generator():
 async def test_normal_sync(
         mock_httpx_get,
         monitor_model_generator,
+        requester: Requester,
         regexp: str | None,
         has_regexp
 ):
     mon_model: MonitorModel = monitor_model_generator("http://someurl.com", regexp)
     async_mock: AsyncMock = mock_httpx_get(status_code=200, json={"some": "True"})
 
-    model_id, result = await _sync_item(mon_model)
+    model_id, result = await _sync_item(mon_model, requester)
     async_mock.assert_awaited_once()
     assert model_id == mon_model.id
     assert result.http_status == 200
     assert result.regexp_found == has_regexp
-    assert result.error is None
+    assert result.error_code is None
 
 
 @pytest.mark.asyncio
-async def test_failed_sync(mock_httpx_get_failed: AsyncMock, monitor_model_generator):
+async def test_failed_sync(
+        mock_httpx_get_failed: AsyncMock,
+        monitor_model_generator,
+        requester: Requester,
+):
     mon_model: MonitorModel = monitor_model_generator("http://someurl.com", None)
-    model_id, result = await _sync_item(mon_model)
+    model_id, result = await _sync_item(mon_model, requester)
     mock_httpx_get_failed.assert_awaited_once()
     assert model_id == mon_model.id
     assert result.http_status == 0
-    assert result.error is not None
+    assert result.error_code is ErrorCode.UNKNOWN
+    assert result.error_detail == "Mocked exception"
+
+
+@pytest.mark.asyncio
+async def test_group_sync(
+        mock_httpx_get,
+        monitor_model_generator,
+        requester: Requester,
+):
+    items = [
+        monitor_model_generator("http://someurl.com", r"some", id=1),
+        monitor_model_generator("http://someurl.com", r"other", id=2),
+        monitor_model_generator("http://someurl.com", None, id=3),
+        monitor_model_generator("http://someurl.com", r"some", id=4),
+    ]
+    async_mock: AsyncMock = mock_httpx_get(status_code=200, json={"some": "True"})
+
+    results = dict(await _sync_group(items, requester))
+    async_mock.assert_awaited_once()
+    assert results.keys() == {1, 2, 3, 4}, "Every monitor must get a result"
+    assert results[1].regexp_found and results[4].regexp_found
+    assert not results[2].regexp_found and not results[3].regexp_found
+
+
+@pytest.mark.asyncio
+async def test_group_sync_queue_deadline(
+        mock_httpx_get,
+        monitor_model_generator,
+):
+    items = [monitor_model_generator("http://someurl.com", None, id=1)]
+    async_mock: AsyncMock = mock_httpx_get(status_code=200)
+    loop = asyncio.get_running_loop()
+
+    async with Requester(max_connections_per_host=1) as requester:
+        async with requester._host_limiters['someurl.com'].slot():
+            results = await _sync_group(
+                items, requester, queue_deadline=loop.time() + 0.01
+            )
+
+    assert results == [], "Monitors queued past the deadline must be skipped"
+    async_mock.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_group_sync_host_queue_keeps_scan_slot(
+        mock_httpx_get,
+        monitor_model_generator,
+):
+    mock_httpx_get(status_code=200)
+    concurrency = AdaptiveConcurrency(
+        min_limit=1,
+        max_limit=1,
+        initial_limit=1,
+        increase=1,
+        decrease=0.5,
+        max_loop_lag=1.0,
+        max_timeout_rate=1.0,
+        latency_tolerance=2.0,
+    )
+
+    async with Requester(max_connections_per_host=1) as requester:
+        context = WorkerContext(AsyncMock(), requester, 'test', concurrency)
+        async with requester._host_limiters['slow.com'].slot():
+            queued = asyncio.create_task(_bounded_sync_group(
+                context, [monitor_model_generator("http://slow.com", None, id=1)]
+            ))
+            await asyncio.sleep(0)
+            assert concurrency.active == 0, \
+                "Scans queued behind a busy host must not hold scan slots"
+            results = await asyncio.wait_for(_bounded_sync_group(
+                context, [monitor_model_generator("http://other.com", None, id=2)]
+            ), 1)
+            assert [monitor_id for monitor_id, _ in results] == [2]
+            assert not queued.done()
+        assert [monitor_id for monitor_id, _ in await queued] == [1]
+
+
+def test_group_by_url(monitor_model_generator):
+    groups = _group_by_url([
+        monitor_model_generator("http://someurl.com", None, id=1),
+        monitor_model_generator("http://otherurl.com", None, id=2),
+        monitor_model_generator("http://someurl.com", None, id=3),
+    ])
+    assert [[item.id for item in group] for group in groups] == [[1, 3], [2]]
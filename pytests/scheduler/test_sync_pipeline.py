@@ -0,0 +1,123 @@
+import asyncio
+from datetime import timedelta
+from types import SimpleNamespace
+from typing import cast
+
+import pytest
+from asyncpg import Pool
+from pydantic_core import Url
+from pytest_mock import MockerFixture
+
+from mservice import settings
+from mservice.concurrency import AdaptiveConcurrency
+from mservice.database.monitor_dao import MonitorDao
+from mservice.requester import Requester
+from mservice.scheduler import WorkerContext, _sync_pipeline
+
+
+async def _wait_for_logs(database: Pool, amount: int, timeout: float = 5.0):
+    async with database.acquire() as connection:
+        async with asyncio.timeout(timeout):
+            while await connection.fetchval(
+                'SELECT COUNT(*) FROM monitor_log'
+            ) < amount:
+                await asyncio.sleep(0.05)
+
+
+@pytest.mark.asyncio
+async def test_pipeline_persists_scans(
+        mock_httpx_get,
+        database: Pool,
+        monitor_dao: MonitorDao,
+        requester: Requester,
+):
+    mock_httpx_get(status_code=200, json={"some": "True"})
+    for i in range(5):
+        await monitor_dao.create(
+            Url(f"http://test{i}.url"), timedelta(seconds=60), r"some"
+        )
+
+    context = WorkerContext(
+        pool=database,
+        requester=requester,
+        owner='test-worker',
+        concurrency=AdaptiveConcurrency(
+            min_limit=1,
+            max_limit=2,
+            initial_limit=2,
+            increase=1,
+            decrease=0.5,
+            max_loop_lag=1.0,
+            max_timeout_rate=0.5,
+            latency_tolerance=2.0,
+        ),
+    )
+    pipelines = [
+        asyncio.create_task(_sync_pipeline(context)) for _ in range(2)
+    ]
+    try:
+        await _wait_for_logs(database, 5)
+    finally:
+        for pipeline in pipelines:
+            pipeline.cancel()
+        for pipeline in pipelines:
+            with pytest.raises(asyncio.CancelledError):
+                await pipeline
+
+    assert await monitor_dao.select_unlocked(10) == [], \
+        "All scanned monitors must be rescheduled"
+
+
+@pytest.mark.asyncio
+async def test_pipeline_counts_monitors(mocker: MockerFixture, monkeypatch):
+    monkeypatch.setattr(settings, 'PIPELINE_CONCURRENCY', 4)
+    monkeypatch.setattr(settings, 'POLL_INTERVAL', 0.05)
+    claim_limits = []
+    persisted: list[tuple] = []
+    failed_persist: list[list] = []
+    in_flight = max_in_flight = 0
+    next_id = 0
+
+    async def claim_items(context, limit: int):
+        nonlocal next_id
+        claim_limits.append(limit)
+        # Coalesced monitors of one URL end up in one task
+        items = [
+            SimpleNamespace(id=next_id + i, url='http://same.url')
+            for i in range(limit)
+        ]
+        next_id += limit
+        return items
+
+    async def sync_group(context, items, queue_deadline):
+        nonlocal in_flight, max_in_flight
+        in_flight += len(items)
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if items[0].id == 0:
+                raise RuntimeError("Scan failed")
+            return [(item.id, None) for item in items]
+        finally:
+            in_flight -= len(items)
+
+    async def persist_results(context, results):
+        if len(persisted) == 0 and not failed_persist:
+            failed_persist.append(results)
+            raise ConnectionError("Connection lost")
+        persisted.extend(results)
+
+    mocker.patch('mservice.scheduler._claim_items', claim_items)
+    mocker.patch('mservice.scheduler._bounded_sync_group', sync_group)
+    mocker.patch('mservice.scheduler._persist_results', persist_results)
+
+    pipeline = asyncio.create_task(_sync_pipeline(cast(WorkerContext, None)))
+    await asyncio.sleep(0.2)
+    pipeline.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await pipeline
+
+    assert max_in_flight == 4, "Claimed monitors must be bounded, not tasks"
+    assert all(limit == 4 for limit in claim_limits)
+    assert failed_persist, "Saving must fail once"
+    assert len(persisted) >= 4, "A failed scan or save must not stop the pipeline"
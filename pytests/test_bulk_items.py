@@ -0,0 +1,61 @@
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from mservice import settings
+from mservice.api.monitors import _read_bulk_items
+
+
+def _request(body: bytes, content_type: str, chunk_size: int = 7) -> Request:
+    chunks = [
+        body[i:i + chunk_size] for i in range(0, len(body), chunk_size)
+    ] or [b'']
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {
+            'type': 'http.request', 'body': chunk, 'more_body': bool(chunks)
+        }
+
+    return Request(
+        {
+            'type': 'http',
+            'method': 'POST',
+            'headers': [(b'content-type', content_type.encode())],
+        },
+        receive,
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'body, status',
+    [
+        pytest.param(b'{"a": 1}\n{"a": 2}\n', None, id='fits'),
+        pytest.param(b'{"a": 1}\n{"a": 2}\n{"a": 3}', 413, id='no newline'),
+        pytest.param(b'{"a": 1}\n{"a": 2}\n{"a": 3}\n', 413, id='newline'),
+    ]
+)
+async def test_bulk_items_ndjson_limit(
+        monkeypatch, body: bytes, status: int | None
+):
+    monkeypatch.setattr(settings, 'BULK_MAX_ITEMS', 2)
+    request = _request(body, 'application/x-ndjson')
+
+    if status is None:
+        assert len(await _read_bulk_items(request)) == 2
+    else:
+        with pytest.raises(HTTPException) as e:
+            await _read_bulk_items(request)
+        assert e.value.status_code == status
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('content_type', ['application/json', 'application/x-ndjson'])
+async def test_bulk_items_body_size(monkeypatch, content_type: str):
+    monkeypatch.setattr(settings, 'BULK_MAX_BODY_SIZE', 20)
+    request = _request(b'[' + b'{"a": 1},' * 10 + b'{"a": 1}]', content_type)
+
+    with pytest.raises(HTTPException) as e:
+        await _read_bulk_items(request)
+    assert e.value.status_code == 413
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+
+from mservice.concurrency import AdaptiveConcurrency, DECISIONS
+
+
+@pytest.fixture
+def concurrency():
+    return AdaptiveConcurrency(
+        min_limit=2,
+        max_limit=20,
+        initial_limit=4,
+        increase=2,
+        decrease=0.5,
+        max_loop_lag=0.1,
+        max_timeout_rate=0.1,
+        latency_tolerance=2.0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit(concurrency: AdaptiveConcurrency):
+    max_active = 0
+
+    async def scan():
+        nonlocal max_active
+        async with concurrency.slot():
+            max_active = max(max_active, concurrency.active)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[scan() for _ in range(10)])
+    assert max_active == 4, "Scans over the limit must wait"
+
+
+@pytest.mark.asyncio
+async def test_concurrency_increase(concurrency: AdaptiveConcurrency):
+    decision = concurrency.adjust()
+    assert decision.action == 'hold', "Unused limit must not grow"
+
+    async with concurrency.slot(), concurrency.slot():
+        async with concurrency.slot(), concurrency.slot():
+            pass
+    decision = concurrency.adjust()
+    assert decision.action == 'increase'
+    assert concurrency.limit == 6
+
+
+def test_concurrency_timeouts(concurrency: AdaptiveConcurrency):
+    for _ in range(9):
+        concurrency.record(0.1)
+    concurrency.record(None, timed_out=True)
+    concurrency.record(None, timed_out=True)
+
+    decision = concurrency.adjust()
+    assert decision.action == 'decrease'
+    assert decision.reason == 'timeout rate'
+    assert concurrency.limit == 2
+
+
+def test_concurrency_latency(concurrency: AdaptiveConcurrency):
+    for latency in (0.1, 0.5):
+        for _ in range(20):
+            concurrency.record(latency)
+        decision = concurrency.adjust()
+
+    assert decision.action == 'decrease', "p95 grew over the tolerance"
+    assert decision.reason == 'latency p95'
+    assert concurrency.snapshot()['decisions'][-1]['limit'] == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrency_loop_lag(concurrency: AdaptiveConcurrency):
+    controller = asyncio.create_task(concurrency.run(0.3))
+    await asyncio.sleep(0.05)
+    time.sleep(0.2)  # blocks the event loop
+    await asyncio.sleep(0.4)
+    controller.cancel()
+
+    [decision, *_] = concurrency.decisions
+    assert decision.action == 'decrease'
+    assert decision.reason == 'event loop lag'
+
+
+def test_concurrency_decisions_exported(concurrency: AdaptiveConcurrency, caplog):
+    decreases = DECISIONS.labels(action='decrease', reason='timeout rate')
+    before = decreases.value
+    concurrency.record(None, timed_out=True)
+
+    with caplog.at_level('INFO', logger='mservice.concurrency'):
+        concurrency.adjust()
+
+    assert decreases.value == before + 1
+    assert "Concurrency limit 4 -> 2 (timeout rate" in caplog.text
@@ -0,0 +1,47 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from asyncpg import UndefinedTableError
+from fastapi import HTTPException
+
+from mservice import settings
+from mservice.dependencies import (
+    PREPARED_STATEMENTS, db_connection, prepare_statements
+)
+
+
+@pytest.mark.asyncio
+async def test_prepare_statements():
+    connection = AsyncMock()
+
+    await prepare_statements(connection)
+
+    prepared = [call.args for call in connection.executemany.await_args_list]
+    assert prepared == [(statement, []) for statement in PREPARED_STATEMENTS]
+
+
+@pytest.mark.asyncio
+async def test_prepare_statements_missing_schema():
+    connection = AsyncMock()
+    connection.executemany.side_effect = UndefinedTableError(
+        'relation "monitors" does not exist'
+    )
+
+    await prepare_statements(connection)
+
+    assert connection.executemany.await_count == 1, \
+        "Should give up once the schema is missing"
+
+
+@pytest.mark.asyncio
+async def test_connection_acquire_timeout(monkeypatch):
+    monkeypatch.setattr(settings, 'DB_ACQUIRE_TIMEOUT', 0.01)
+    pool = AsyncMock()
+    pool.acquire.side_effect = asyncio.TimeoutError()
+
+    with pytest.raises(HTTPException) as error:
+        await anext(db_connection(pool))
+
+    assert error.value.status_code == 503
+    pool.acquire.assert_awaited_once_with(timeout=0.01)
@@ -0,0 +1,176 @@
+import asyncio
+import time
+
+import pytest
+
+from mservice.limiter import HostLimits, HostLimiter, QueueTimeoutException
+
+
+@pytest.mark.asyncio
+async def test_limiter_concurrency():
+    limiter = HostLimiter(HostLimits(max_concurrency=2, rate=0, burst=1))
+    max_active = 0
+
+    async def request():
+        nonlocal max_active
+        async with limiter.slot():
+            max_active = max(max_active, limiter.active)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[request() for _ in range(10)])
+    assert max_active == 2, "Requests over the limit must wait"
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_rate():
+    limiter = HostLimiter(HostLimits(max_concurrency=10, rate=50, burst=2))
+
+    async def request():
+        async with limiter.slot():
+            pass
+
+    start = time.monotonic()
+    await asyncio.gather(*[request() for _ in range(7)])
+    # 2 requests go at once, the other 5 wait for tokens at 50 per second
+    assert time.monotonic() - start >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_limiter_raised_limit():
+    limiter = HostLimiter(HostLimits(max_concurrency=1, rate=0, burst=1))
+    max_active = 0
+
+    async def request():
+        nonlocal max_active
+        async with limiter.slot():
+            limiter.limits = HostLimits(max_concurrency=3, rate=0, burst=1)
+            max_active = max(max_active, limiter.active)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[request() for _ in range(6)])
+    assert max_active == 3, "Waiting requests must use the raised limit"
+
+
+def test_limits_restrict():
+    limits = HostLimits(max_concurrency=4, rate=10, burst=1)
+
+    assert limits.restrict(2, 5) == HostLimits(2, 5, 1)
+    assert limits.restrict(8, 20) == limits, "Overrides can't raise limits"
+    assert limits.restrict(rate=0) == limits
+    assert HostLimits(4, 0, 1).restrict(rate=5).rate == 5
+
+
+@pytest.mark.asyncio
+async def test_limiter_override_per_request():
+    limiter = HostLimiter(HostLimits(max_concurrency=4, rate=0, burst=1))
+    max_active = {'strict': 0, 'loose': 0}
+
+    async def request(kind: str, max_concurrency: int):
+        async with limiter.slot(max_concurrency):
+            max_active[kind] = max(max_active[kind], limiter.active)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[request('strict', 1) for _ in range(3)])
+    await asyncio.gather(*[request('loose', 10) for _ in range(8)])
+    assert max_active == {'strict': 1, 'loose': 4}
+    assert limiter.limits.max_concurrency == 4, \
+        "Overrides must not change the host limits"
+
+
+@pytest.mark.asyncio
+async def test_limiter_override_rate():
+    limiter = HostLimiter(HostLimits(max_concurrency=10, rate=0, burst=1))
+
+    async def request(rate: float | None):
+        async with limiter.slot(rate=rate):
+            pass
+
+    start = time.monotonic()
+    await asyncio.gather(*[request(None) for _ in range(5)])
+    assert time.monotonic() - start < 0.05
+
+    start = time.monotonic()
+    await asyncio.gather(*[request(50) for _ in range(3)])
+    # Requests with the override keep 1 / 50 seconds from each other
+    assert time.monotonic() - start >= 0.04
+
+
+@pytest.mark.asyncio
+async def test_limiter_deadline():
+    limiter = HostLimiter(HostLimits(max_concurrency=1, rate=0, burst=1))
+    loop = asyncio.get_running_loop()
+
+    async def hold():
+        async with limiter.slot():
+            await asyncio.sleep(0.1)
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    with pytest.raises(QueueTimeoutException):
+        async with limiter.slot(deadline=loop.time() + 0.01):
+            pass
+    await holder
+
+    async with limiter.slot(deadline=loop.time()):
+        assert limiter.active == 1, "A free slot must be taken at once"
+    assert limiter.active == 0
+
+    rated = HostLimiter(HostLimits(max_concurrency=10, rate=1, burst=1))
+    async with rated.slot(deadline=loop.time() + 0.01):
+        pass
+    with pytest.raises(QueueTimeoutException):
+        async with rated.slot(deadline=loop.time() + 0.01):
+            pass
+    assert rated.active == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_hands_over_slots():
+    limiter = HostLimiter(HostLimits(max_concurrency=1, rate=0, burst=1))
+    order = []
+
+    async def request(name: str, max_concurrency: int | None = None):
+        async with limiter.slot(max_concurrency):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[request(str(i)) for i in range(5)])
+    assert order == ['0', '1', '2', '3', '4'], "Waiters must go in FIFO order"
+    assert len(limiter._waiters) == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_skips_strict_waiters():
+    limiter = HostLimiter(HostLimits(max_concurrency=2, rate=0, burst=1))
+    started = []
+
+    async def request(name: str, max_concurrency: int | None = None):
+        async with limiter.slot(max_concurrency):
+            started.append(name)
+            await asyncio.sleep(0.05)
+
+    tasks = [
+        asyncio.create_task(request('first')),
+        asyncio.create_task(request('second')),
+        asyncio.create_task(request('strict', 1)),
+        asyncio.create_task(request('loose')),
+    ]
+    await asyncio.sleep(0.07)
+    assert started == ['first', 'second', 'loose'], \
+        "A waiter over its own limit must not block the others"
+    await asyncio.gather(*tasks)
+    assert started[-1] == 'strict'
+
+
+@pytest.mark.asyncio
+async def test_limiter_idle():
+    limiter = HostLimiter(HostLimits(max_concurrency=1, rate=20, burst=1))
+    assert limiter.idle
+
+    async with limiter.slot():
+        assert not limiter.idle
+    assert not limiter.idle, "Taken token must be refilled first"
+
+    await asyncio.sleep(0.06)
+    assert limiter.idle
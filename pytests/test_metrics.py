@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from mservice.metrics import MetricsRegistry, start_metrics_server, registry
+
+
+def test_counter():
+    metrics = MetricsRegistry()
+    scans = metrics.counter('test_scans_total', 'Scans')
+    errors = metrics.counter('test_errors_total', 'Errors', ('kind',))
+
+    scans.inc()
+    scans.inc(2)
+    errors.labels(kind='timeout').inc()
+
+    rendered = metrics.render()
+    assert '# TYPE test_scans_total counter' in rendered
+    assert 'test_scans_total 3.0' in rendered
+    assert 'test_errors_total{kind="timeout"} 1.0' in rendered
+
+
+def test_histogram():
+    metrics = MetricsRegistry()
+    latency = metrics.histogram('test_latency_seconds', 'Latency', buckets=(0.1, 1.0))
+
+    for value in (0.05, 0.1, 0.5, 5.0):
+        latency.observe(value)
+
+    rendered = metrics.render()
+    assert 'test_latency_seconds_bucket{le="0.1"} 2' in rendered
+    assert 'test_latency_seconds_bucket{le="1.0"} 3' in rendered
+    assert 'test_latency_seconds_bucket{le="+Inf"} 4' in rendered
+    assert 'test_latency_seconds_count 4' in rendered
+    assert 'test_latency_seconds_sum 5.65' in rendered
+
+
+@pytest.mark.asyncio
+async def test_histogram_time():
+    metrics = MetricsRegistry()
+    durations = metrics.histogram('test_query_seconds', 'Queries', ('method',))
+
+    @durations.time(method='select')
+    async def select():
+        await asyncio.sleep(0.01)
+        return 1
+
+    assert await select() == 1
+    assert 'test_query_seconds_count{method="select"} 1' in metrics.render()
+
+
+def test_duplicate_metric():
+    metrics = MetricsRegistry()
+    metrics.counter('test_total', 'Test')
+    with pytest.raises(ValueError):
+        metrics.histogram('test_total', 'Test')
+
+
+@pytest.mark.asyncio
+async def test_metrics_server():
+    server = await start_metrics_server(0, '127.0.0.1')
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+    finally:
+        server.close()
+
+    assert response.startswith(b'HTTP/1.1 200 OK')
+    assert registry.render().split('\n')[0].encode() in response
@@ -0,0 +1,95 @@
+import asyncio
+import re
+
+import pytest
+
+from mservice.network_timings import RequestTracer
+from mservice.requester import Requester, RequestSuccessSchema
+
+
+@pytest.mark.asyncio
+async def test_tracer(mocker):
+    clock = mocker.patch('mservice.network_timings.time.perf_counter')
+    tracer = RequestTracer()
+    events = [
+        (0.0, 'connection.connect_tcp.started'),
+        (0.05, 'connection.connect_tcp.complete'),
+        (0.05, 'connection.start_tls.started'),
+        (0.15, 'connection.start_tls.complete'),
+        (0.15, 'http11.send_request_headers.started'),
+        (0.16, 'http11.send_request_headers.complete'),
+        (0.4, 'http11.receive_response_headers.started'),
+        (0.45, 'http11.receive_response_headers.complete'),
+    ]
+    # DNS is set by the network backend while the connection is opened
+    tracer.timings.dns = 0.02
+    for now, event in events:
+        clock.return_value = now
+        await tracer(event, {})
+
+    assert tracer.timings.connect == pytest.approx(0.03), "DNS is subtracted"
+    assert tracer.timings.tls == pytest.approx(0.1)
+    assert tracer.timings.ttfb == pytest.approx(0.3)
+    assert tracer.timings.download is None
+
+
+@pytest.mark.asyncio
+async def test_tracer_reused_connection():
+    tracer = RequestTracer()
+    for event in (
+            'http11.send_request_headers.started',
+            'http11.send_request_headers.complete',
+            'http11.receive_response_headers.started',
+            'http11.receive_response_headers.complete',
+    ):
+        await tracer(event, {})
+
+    assert tracer.timings.ttfb is not None
+    assert tracer.timings.dns is None
+    assert tracer.timings.connect is None
+    assert tracer.timings.tls is None
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    while (await reader.readline()) not in (b'\r\n', b''):
+        pass
+    body = b'some body'
+    writer.write(
+        b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body)
+    )
+    await writer.drain()
+    writer.close()
+
+
+@pytest.mark.asyncio
+async def test_requester_timings():
+    server = await asyncio.start_server(_serve, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        async with Requester(collect_timings=True) as requester:
+            result = await requester.request_url(
+                f'http://localhost:{port}/', (re.compile(r'body'),)
+            )
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    assert isinstance(result, RequestSuccessSchema)
+    timings = result.timings
+    assert timings.dns is not None, "Host must be resolved by the backend"
+    assert timings.connect is not None
+    assert timings.tls is None, "No TLS for plain HTTP"
+    assert timings.ttfb is not None
+    assert timings.download is not None
+    assert result.response_size == len(b'some body')
+
+
+@pytest.mark.asyncio
+async def test_requester_without_timings(mock_httpx_get):
+    mock_httpx_get(status_code=200, content=b'some body')
+
+    async with Requester(collect_timings=False) as requester:
+        result = await requester.request_url('https://existing.io/')
+
+    assert result.timings is None
+    assert result.response_size == len(b'some body'), "Content-Length is used"
@@ -1,6 +1,20 @@
+import asyncio
+import re
+import time
+
 import pytest
 
-from mservice.parser import find_pattern
+from mservice.parser import (
+    REGEXP_CACHE_HITS,
+    REGEXP_CACHE_MISSES,
+    find_pattern,
+    PatternCache,
+    compile_pattern,
+    StreamMatcher,
+    RegexpEvaluator,
+    RegexpTimeoutException,
+    is_inline_safe,
+)
 
 
 @pytest.mark.parametrize(
@@ -35,3 +49,246 @@ from mservice.parser import find_pattern
 def test_parser(text: str, pattern: str, result: bool):
     result_returned = find_pattern(text, pattern)
     assert result_returned == result, "Found result must match"
+
+
+def test_parser_compiled():
+    assert find_pattern('sample text', compile_pattern(r'^sample'))
+
+
+def test_pattern_cache():
+    cache = PatternCache(max_size=2)
+
+    first = cache.compile(r'first')
+    assert cache.compile(r'first') is first, "Compiled pattern must be reused"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.compile(r'first', re.IGNORECASE)
+    assert cache.misses == 2, "Flags are a part of the cache key"
+
+    cache.compile(r'second')
+    assert len(cache) == 2, "Cache must be bounded"
+    cache.compile(r'first')
+    assert cache.misses == 4, "Oldest pattern must be evicted"
+
+
+def test_pattern_cache_metrics():
+    hits, misses = REGEXP_CACHE_HITS.value, REGEXP_CACHE_MISSES.value
+    cache = PatternCache(max_size=2)
+    cache.compile(r'sample')
+    cache.compile(r'sample')
+    cache.clear()
+    assert REGEXP_CACHE_HITS.value == hits + 1
+    assert REGEXP_CACHE_MISSES.value == misses + 1, \
+        "Exported counters must not be reset with the cache"
+
+
+def test_pattern_cache_malformed():
+    cache = PatternCache(max_size=2)
+
+    with pytest.raises(re.error):
+        cache.compile(r'.+@^[A')
+    assert len(cache) == 0
+
+
+@pytest.fixture
+def inline_evaluator():
+    return RegexpEvaluator(processes=0)
+
+
+@pytest.fixture
+def pool_evaluator():
+    evaluator = RegexpEvaluator(processes=1, inline_limit=0, time_budget=1.0)
+    yield evaluator
+    evaluator.close()
+
+
+@pytest.mark.parametrize(
+    'chunks, overlap, result',
+    [
+        pytest.param(['some ', 'sample', ' text'], 16, True, id='one chunk'),
+        pytest.param(['some sam', 'ple text'], 16, True, id='spanning chunks'),
+        pytest.param(['some sam', 'ple text'], 0, False, id='no overlap'),
+        pytest.param(['some ', 'text'], 16, False, id='not found'),
+    ]
+)
+@pytest.mark.asyncio
+async def test_stream_matcher(
+        inline_evaluator: RegexpEvaluator,
+        chunks: list[str],
+        overlap: int,
+        result: bool,
+):
+    matcher = StreamMatcher(
+        [re.compile(r'sample')], inline_evaluator, overlap=overlap, window=1
+    )
+    for chunk in chunks:
+        await matcher.feed(chunk)
+    await matcher.finish()
+    assert ('sample' in matcher.found) == result, "Found result must match"
+
+
+@pytest.mark.parametrize(
+    'regexp, chunks, result',
+    [
+        pytest.param(r'error$', ['an error', 's happened'], False, id='end'),
+        pytest.param(r'error$', ['an error', '\nnext'], True, id='end of line'),
+        pytest.param(r'error$', ['an error'], True, id='end of text'),
+        pytest.param(r'foo(?!bar)', ['foo', 'bar'], False, id='lookahead'),
+        pytest.param(r'foo(?!bar)', ['foo', 'baz'], True, id='lookahead passed'),
+        pytest.param(r'^sample', ['xxxxxxsa', 'mple'], False, id='start'),
+        pytest.param(r'^sample', ['xxxxx\nsa', 'mple'], True, id='start of line'),
+        pytest.param(r'\bsample', ['xxxxxxsa', 'mple'], False, id='word boundary'),
+    ]
+)
+@pytest.mark.asyncio
+async def test_stream_matcher_boundaries(
+        inline_evaluator: RegexpEvaluator,
+        pool_evaluator: RegexpEvaluator,
+        regexp: str,
+        chunks: list[str],
+        result: bool,
+):
+    for evaluator in (inline_evaluator, pool_evaluator):
+        matcher = StreamMatcher(
+            [compile_pattern(regexp)], evaluator, overlap=3, window=1
+        )
+        for chunk in chunks:
+            await matcher.feed(chunk)
+        await matcher.finish()
+        assert (regexp in matcher.found) == result, \
+            "Matches must not depend on where the text is split"
+
+
+@pytest.mark.asyncio
+async def test_stream_matcher_settled_long_match(
+        inline_evaluator: RegexpEvaluator,
+):
+    matcher = StreamMatcher(
+        [re.compile(r'a.*z|b')], inline_evaluator, overlap=2, window=1
+    )
+    # The leftmost match ends too close to the end, but "b" is settled
+    assert await matcher.feed('a b xxxxxxz')
+
+
+@pytest.mark.asyncio
+async def test_stream_matcher_window(pool_evaluator: RegexpEvaluator):
+    matcher = StreamMatcher(
+        [re.compile(r'sample')], pool_evaluator, overlap=0, window=100
+    )
+    assert not await matcher.feed('some sam'), "Window is not filled yet"
+    await matcher.finish('ple text')
+    assert matcher.found == {'sample'}, "Buffered chunks must be joined"
+
+
+@pytest.mark.asyncio
+async def test_stream_matcher_inline_early():
+    evaluator = RegexpEvaluator(processes=1, inline_limit=100)
+    matcher = StreamMatcher(
+        [re.compile(r'needle')], evaluator, overlap=10, window=1000000
+    )
+    assert await matcher.feed('needle' + 'x' * 1000), \
+        "Inline patterns must be searched before the window is filled"
+    assert not matcher._buffer, "Nothing is buffered for inline patterns"
+    evaluator.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_matcher_inline_slices():
+    evaluator = RegexpEvaluator(processes=1, inline_limit=100)
+    matcher = StreamMatcher(
+        [re.compile(r'needle')], evaluator, overlap=10, window=1000000
+    )
+    # The match spans two slices of one chunk
+    assert await matcher.feed('x' * 75 + 'needle' + 'x' * 100)
+    evaluator.close()
+
+
+@pytest.mark.parametrize(
+    'regexp, safe',
+    [
+        pytest.param(r'status:\s+ok', True, id='simple'),
+        pytest.param(r'<title>[^<]*</title>', True, id='class repeat'),
+        pytest.param(r'(a+)+$', False, id='nested repeat'),
+        pytest.param(r'(a|aa)*b', False, id='alternation in repeat'),
+        pytest.param(r'(\w+)\s\1', False, id='backreference'),
+        pytest.param(r'\d{4}-\d{2}', True, id='fixed repeats'),
+        pytest.param(r'.*.*.*z', False, id='repeats in a row'),
+        pytest.param(r'\s*\s*\s*\s*$x', False, id='class repeats in a row'),
+        pytest.param(r'a+b[^c]*c', False, id='separated repeats'),
+    ]
+)
+def test_is_inline_safe(regexp: str, safe: bool):
+    assert is_inline_safe(re.compile(regexp)) == safe
+    evaluator = RegexpEvaluator(processes=1, inline_limit=100)
+    assert evaluator.searches_inline(re.compile(regexp)) == safe
+
+
+@pytest.mark.asyncio
+async def test_stream_matcher_unsafe_in_pool(pool_evaluator: RegexpEvaluator):
+    pool_evaluator.inline_limit = 1000
+    pool_evaluator.time_budget = 0.5
+    matcher = StreamMatcher(
+        [re.compile(r'(a+)+$'), re.compile(r'a')], pool_evaluator, window=1
+    )
+    await matcher.feed('a' * 40 + 'b')
+    await matcher.finish()
+    assert matcher.found == {'a'}, "Safe pattern is searched inline"
+    assert matcher.timed_out == {'(a+)+$'}, "Unsafe pattern must go to the pool"
+
+
+@pytest.mark.asyncio
+async def test_evaluator_polynomial_in_pool(pool_evaluator: RegexpEvaluator):
+    pool_evaluator.inline_limit = 1000
+    pool_evaluator.time_budget = 0.5
+    await pool_evaluator.search(re.compile(r'warm up'), 'x' * 2000)
+
+    started = time.monotonic()
+    with pytest.raises(RegexpTimeoutException):
+        await pool_evaluator.search(re.compile(r'.*.*.*z'), 'x' * 500)
+    assert time.monotonic() - started < 2, \
+        "Polynomial pattern must be searched in the pool within the budget"
+
+
+@pytest.mark.asyncio
+async def test_stream_matcher_many(inline_evaluator: RegexpEvaluator):
+    matcher = StreamMatcher(
+        [re.compile(r'some'), re.compile(r'text'), re.compile(r'other')],
+        inline_evaluator,
+        overlap=4,
+        window=1,
+    )
+    assert not await matcher.feed('some '), "Not every pattern is found yet"
+    assert not matcher.found, "Match at the end of a chunk isn't settled yet"
+    await matcher.feed('text ')
+    assert matcher.found == {'some'}
+    await matcher.finish()
+    assert matcher.found == {'some', 'text'}
+    assert matcher.pending.keys() == {'other'}
+
+
+@pytest.mark.asyncio
+async def test_evaluator_pool(pool_evaluator: RegexpEvaluator):
+    assert await pool_evaluator.search(compile_pattern(r'^text'), 'sample\ntext')
+    assert not await pool_evaluator.search(re.compile(r'[yu]+'), 'sample text')
+
+
+@pytest.mark.asyncio
+async def test_evaluator_timeout(pool_evaluator: RegexpEvaluator):
+    pool_evaluator.time_budget = 0.5
+    with pytest.raises(RegexpTimeoutException):
+        await pool_evaluator.search(re.compile(r'(a+)+$'), 'a' * 40 + 'b')
+
+    pool_evaluator.time_budget = 5.0
+    assert await pool_evaluator.search(re.compile(r'sample'), 'sample text'), \
+        "Pool must be recreated after a timeout"
+
+
+@pytest.mark.asyncio
+async def test_evaluator_queue(pool_evaluator: RegexpEvaluator):
+    pool_evaluator.time_budget = 0.2
+    source = 'x' * 1000000 + 'needle'
+
+    results = await asyncio.gather(*[
+        pool_evaluator.search(re.compile(r'needle'), source) for _ in range(50)
+    ])
+    assert all(results), "Waiting for a free process must not use the budget"
@@ -0,0 +1,18 @@
+import importlib
+from typing import get_args
+
+import pytest
+
+from mservice import settings
+
+
+def test_invalid_reschedule_policy(monkeypatch):
+    monkeypatch.setenv('RESCHEDULE_POLICY', 'later')
+    try:
+        with pytest.raises(ValueError, match='RESCHEDULE_POLICY'):
+            importlib.reload(settings)
+    finally:
+        monkeypatch.undo()
+        importlib.reload(settings)
+
+    assert settings.RESCHEDULE_POLICY in get_args(settings.ReschedulePolicy)
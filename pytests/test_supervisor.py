@@ -0,0 +1,156 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import pytest
+from pytest_mock import MockerFixture
+
+from mservice import settings
+from mservice.supervisor import WorkerSupervisor, _run_until_signal
+
+
+@pytest.mark.asyncio
+async def test_worker_stops_on_signal(mocker: MockerFixture):
+    cleaned_up = False
+
+    async def monitors_update_task(validator_cache_path=None):
+        nonlocal cleaned_up
+        try:
+            await asyncio.sleep(100)
+        except asyncio.CancelledError:
+            # The second signal must not interrupt the cleanup
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.sleep(0.1)
+            cleaned_up = True
+
+    mocker.patch(
+        'mservice.supervisor.monitors_update_task', monitors_update_task
+    )
+
+    worker = asyncio.create_task(_run_until_signal())
+    await asyncio.sleep(0.1)
+    os.kill(os.getpid(), signal.SIGTERM)
+    await asyncio.wait_for(worker, 5)
+
+    assert cleaned_up, "Worker must be stopped through the task cancellation"
+
+
+def _fake_worker(events, ignore_term: bool = False):
+    def run_worker(use_uvloop, metrics_port, validator_cache_path):
+        # Forked children inherit the handlers of the supervisor
+        signal.signal(
+            signal.SIGTERM, signal.SIG_IGN if ignore_term else signal.SIG_DFL
+        )
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        events.put((
+            multiprocessing.current_process().name,
+            os.getpid(),
+            metrics_port,
+            validator_cache_path,
+        ))
+        time.sleep(100)
+
+    return run_worker
+
+
+def _supervise(supervisor: WorkerSupervisor, drive):
+    """
+    Runs the supervisor until drive returns, drive runs in a thread
+    """
+    errors = []
+
+    def driver():
+        try:
+            drive()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            supervisor._stopping = True
+
+    handlers = {
+        sig: signal.getsignal(sig) for sig in (signal.SIGTERM, signal.SIGINT)
+    }
+    thread = threading.Thread(target=driver)
+    thread.start()
+    try:
+        supervisor.run()
+    finally:
+        thread.join()
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+    if errors:
+        raise errors[0]
+
+
+@pytest.fixture
+def fork_supervisor(mocker: MockerFixture):
+    def create(events, ignore_term: bool = False, **kwargs) -> WorkerSupervisor:
+        mocker.patch(
+            'mservice.supervisor.run_worker', _fake_worker(events, ignore_term)
+        )
+        supervisor = WorkerSupervisor(**kwargs)
+        # Spawned children would import the real worker, forked ones run the fake
+        mocker.patch.object(
+            supervisor, '_context', multiprocessing.get_context('fork')
+        )
+        return supervisor
+
+    return create
+
+
+def test_supervisor_respawns_slot(fork_supervisor, mocker: MockerFixture):
+    mocker.patch.object(settings, 'VALIDATOR_CACHE_PATH', 'validators.json')
+    events = multiprocessing.get_context('fork').Queue()
+    supervisor = fork_supervisor(
+        events, processes=2, restart_delay=0.3, metrics_port=9100
+    )
+    started = []
+    respawned = []
+
+    def drive():
+        started.extend(events.get(timeout=10) for _ in range(2))
+        killed_at = time.monotonic()
+        os.kill(started[0][1], signal.SIGKILL)
+        respawned.append(events.get(timeout=10))
+        respawned.append(time.monotonic() - killed_at)
+
+    _supervise(supervisor, drive)
+
+    assert sorted((name, port, path) for name, _, port, path in started) == [
+        ('monitoring-worker-0', 9100, 'validators.json.0'),
+        ('monitoring-worker-1', 9101, 'validators.json.1'),
+    ], "Every slot must get its own metrics port and cache file"
+    killed_name, killed_pid, killed_port, killed_path = started[0]
+    (name, pid, port, path), restarted_after = respawned
+    assert (name, port, path) == (killed_name, killed_port, killed_path), \
+        "The killed slot must be started again with the same settings"
+    assert pid != killed_pid
+    assert restarted_after >= 0.3, "Restart must wait for the restart delay"
+
+
+def test_supervisor_kills_stuck_children(fork_supervisor):
+    events = multiprocessing.get_context('fork').Queue()
+    supervisor = fork_supervisor(
+        events,
+        ignore_term=True,
+        processes=1,
+        shutdown_timeout=0.3,
+        metrics_port=0,
+    )
+    started = []
+
+    def drive():
+        started.append(events.get(timeout=10))
+        started.append(time.monotonic())
+
+    _supervise(supervisor, drive)
+
+    (name, pid, port, path), stopped_at = started
+    assert port == 0, "Metrics are off without the base port"
+    assert time.monotonic() - stopped_at >= 0.3, \
+        "Children must get the shutdown timeout to stop"
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
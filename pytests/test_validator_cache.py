@@ -0,0 +1,71 @@
+import pytest
+from httpx import Response
+
+from mservice.validator_cache import ValidatorCache
+
+
+def test_validator_cache():
+    cache = ValidatorCache(max_size=10)
+    response = Response(200, headers={'ETag': '"v1"'})
+
+    cache.put('http://test.url', response, {'some', 'other'}, {'some'})
+
+    entry = cache.get('http://test.url', {'some'})
+    assert entry is not None
+    assert entry.headers() == {'If-None-Match': '"v1"'}
+    assert entry.found_patterns == {'some'}
+    assert cache.get('http://test.url', {'unknown'}) is None, \
+        "Patterns which were never searched need a full request"
+
+
+def test_validator_cache_no_validators():
+    cache = ValidatorCache(max_size=10)
+    cache.put('http://test.url', Response(200, headers={'ETag': '"v1"'}), set(), set())
+    cache.put('http://test.url', Response(200), set(), set())
+
+    assert cache.get('http://test.url', set()) is None, \
+        "Responses without validators must drop the cached ones"
+
+
+def test_validator_cache_bounded():
+    cache = ValidatorCache(max_size=2)
+    for i in range(3):
+        cache.put(
+            f'http://test{i}.url',
+            Response(200, headers={'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}),
+            set(),
+            set(),
+        )
+
+    assert len(cache) == 2
+    assert cache.get('http://test0.url', set()) is None, "Oldest URL must be evicted"
+
+
+def test_validator_cache_persistence(tmp_path):
+    path = str(tmp_path / 'validators.json')
+    cache = ValidatorCache(max_size=10)
+    cache.put('http://test.url', Response(200, headers={'ETag': '"v1"'}), {'a'}, {'a'})
+    cache.save(path)
+
+    loaded_cache = ValidatorCache(max_size=10)
+    loaded_cache.load(path)
+    assert loaded_cache.get('http://test.url', {'a'}) == \
+        cache.get('http://test.url', {'a'})
+
+
+@pytest.mark.parametrize(
+    'content',
+    [
+        pytest.param('{"http://test.url": {"etag": "v1"', id='broken json'),
+        pytest.param('{"http://test.url": {"etag": "v1"}}', id='missing keys'),
+        pytest.param('{"http://test.url": null}', id='wrong entry'),
+        pytest.param('[]', id='wrong data'),
+    ]
+)
+def test_validator_cache_malformed(tmp_path, content: str):
+    path = tmp_path / 'validators.json'
+    path.write_text(content)
+
+    cache = ValidatorCache(max_size=10)
+    cache.load(str(path))
+    assert len(cache) == 0, "Malformed cache file must be ignored"
@@ -1,21 +1,38 @@
-import asyncio
 import logging
 
-from mservice.scheduler import monitors_update_task
+import click
+
+from mservice import settings
+from mservice.supervisor import run_worker, WorkerSupervisor
 from mservice.utils import prepare_logger
 
 logger = logging.getLogger(__name__)
 
 
-async def main():
+@click.command()
+@click.option(
+    '--processes',
+    default=settings.WORKER_PROCESSES,
+    help='number of worker processes, each with its own event loop',
+)
+@click.option(
+    '--uvloop/--no-uvloop',
+    'use_uvloop',
+    default=settings.WORKER_UVLOOP,
+    help='use uvloop event loop if it is installed',
+)
+def main(processes: int, use_uvloop: bool):
     """
-    Runs an async task for monitoring URLs
+    Runs an async task for monitoring URLs. With more than one process it
+    runs a supervisor which forks and restarts worker processes.
     """
+    if processes <= 1:
+        run_worker(use_uvloop)
+        return
+
     prepare_logger()
-    logger.info("Starting monitoring worker")
-    await monitors_update_task()
-    logger.info("Stopping monitoring worker")
+    WorkerSupervisor(processes, use_uvloop).run()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()